@@ -5,22 +5,32 @@ from ui.main_window import setup_ui
 from ui.window import set_window_style
 from ui.event_handlers import apply_event_handlers
 from ui.widgets import Tooltip, SegmentedProgressBar
-from ui.dialogs import LoadFileDialog, DetectPeaksDialog, PartitionEvokedDialog
+from ui.dialogs import LoadFileDialog, DetectPeaksDialog, PartitionEvokedDialog, PerformanceDialog
 from utils.image_utils import load_svg_image
 from utils.navigation_utils import apply_navigation_operations
 from utils.table_operations_utils import apply_table_operations
+from utils.startup_utils import prewarm_heavy_modules
 from core.event_handlers import handle_canvas_click
 from core.app_state import initialize_app_state, clear_plot
 from core.apply_threshold import apply_threshold
 from core.calculate_rise import calculate_rise
 from core.calculate_decay import calculate_decay
 from core.calculate_baseline import calculate_baseline
+from core.instrumentation import get_instrumentation
+from core.parameter_sweep import sweep_parameters
+from core.template_matching import apply_template_matching
+from core.event_fitting import calculate_event_kinetics
+from utils.session_utils import save_session, open_session
+from core.edit_history import undo_edit, redo_edit
+from core.live_acquisition import start_live_acquisition, stop_live_acquisition
+from core.chunked_pipeline import analyze_large_file
 
 class App(customtkinter.CTk):
     def __init__(self):
         super().__init__()
         setup_ui(self)
         initialize_app_state(self)
+        prewarm_heavy_modules(self)
 
     def detect_peaks(self):
         if self.time is None or self.df_f is None:
@@ -28,17 +38,109 @@ class App(customtkinter.CTk):
             return
         
         self.progress_bar.set(0)
+        instrumentation = get_instrumentation(self)
 
-        # Step 1: Apply threshold to find all peaks
-        apply_threshold(self)
+        with instrumentation.action("detect_peaks", self):
+            # Step 1: Apply threshold to find all peaks
+            apply_threshold(self)
 
-        # Step 2: Calculate rise time for the detected peaks and plot the rise fit curve
-        calculate_rise(self)
+            # Step 2: Fit rise and decay of the detected peaks and plot the fit curves
+            self.fit_kinetics()
 
-        # Step 3: Calculate decay time for the detected peaks and plot the decay fit curve
-        calculate_decay(self)
+        self.after(500, lambda: self.progress_bar.set(0))
+
+    def detect_events(self):
+        if self.time is None or self.df_f is None:
+            messagebox.showwarning(title="Warning", message="No data loaded.")
+            return
+
+        self.progress_bar.set(0)
+        instrumentation = get_instrumentation(self)
+
+        with instrumentation.action("detect_events", self):
+            # Step 1: Detect events by deconvolution with the rise/decay template
+            if not apply_template_matching(self):
+                return
+
+            # Step 2: Fit rise and decay of the detected events as for threshold detection
+            self.fit_kinetics()
 
         self.after(500, lambda: self.progress_bar.set(0))
+
+    def fit_kinetics(self):
+        instrumentation = get_instrumentation(self)
+
+        # Screening runs only need the model-free metrics of the table, which use the baseline
+        if self.last_skip_fits == "on":
+            with instrumentation.stage("baseline"):
+                calculate_baseline(self, window_size=int(self.last_baseline_window_size), percentile=float(self.last_baseline_percentage))
+            with instrumentation.stage("table"):
+                self.update_table()
+            self.canvas.draw()
+            return
+
+        # One double-exponential model per event, fitted for all events at once
+        if self.last_event_model == "on":
+            with instrumentation.stage("event_fit"):
+                calculate_event_kinetics(self)
+            return
+
+        # Calculate rise time for the detected peaks and plot the rise fit curve
+        with instrumentation.stage("rise"):
+            calculate_rise(self)
+
+        # Calculate decay time for the detected peaks and plot the decay fit curve
+        with instrumentation.stage("decay"):
+            calculate_decay(self)
+
+    def sweep_parameters(self):
+        if self.time is None or self.df_f is None:
+            messagebox.showwarning(title="Warning", message="No data loaded.")
+            return
+
+        with get_instrumentation(self).action("parameter_sweep", self):
+            sweep_parameters(self)
+
+    def undo_edit(self, event=None):
+        # Ctrl+Z in a text entry undoes the typing, not a peak edit
+        if event is not None and event.widget.winfo_class() == 'Entry':
+            return
+        with get_instrumentation(self).action("undo", self):
+            undo_edit(self)
+
+    def redo_edit(self, event=None):
+        if event is not None and event.widget.winfo_class() == 'Entry':
+            return
+        with get_instrumentation(self).action("redo", self):
+            redo_edit(self)
+
+    def save_session(self):
+        with get_instrumentation(self).action("save_session", self):
+            save_session(self)
+
+    def open_session(self):
+        with get_instrumentation(self).action("open_session", self):
+            open_session(self)
+
+    def toggle_live_acquisition(self):
+        if self.live_acquisition is not None:
+            with get_instrumentation(self).action("stop_live", self):
+                stop_live_acquisition(self)
+        else:
+            with get_instrumentation(self).action("start_live", self):
+                start_live_acquisition(self)
+        self.live_button.configure(text="Stop Live" if self.live_acquisition is not None else "Live")
+
+    def analyze_large_file(self):
+        with get_instrumentation(self).action("large_file", self):
+            analyze_large_file(self)
+
+    def show_performance_panel(self):
+        # Reuse the open panel instead of stacking a second one
+        if getattr(self, 'performance_dialog', None) is not None and self.performance_dialog.winfo_exists():
+            self.performance_dialog.focus()
+            return
+        self.performance_dialog = PerformanceDialog(self, self.instrumentation)
     
     def handle_partition(self):
         if self.time is None or self.df_f is None:
@@ -55,7 +157,11 @@ class App(customtkinter.CTk):
             self,
             default_peak_num=self.last_peak_num,
             default_interval_size=self.last_interval_size,
-            default_offset=self.last_offset
+            default_offset=self.last_offset,
+            default_pre_samples=self.last_pre_samples,
+            default_post_samples=self.last_post_samples,
+            default_outlier_z=self.last_outlier_z,
+            default_align_group=self.last_align_group
         )
                 
         # # Clear previous partition lines and labels
@@ -0,0 +1,428 @@
+"""
+Headless benchmark suite for the analysis hot paths
+Each stage runs on synthetic traces and reports the best wall time over the repeats
+and the peak traced memory of one extra run
+
+Usage:
+    python benchmarks/run_benchmarks.py --samples 10000 100000 --repeat 3
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json --tolerance 0.25
+    python benchmarks/run_benchmarks.py --precision float32
+    python benchmarks/run_benchmarks.py --check-precision --samples 100000
+    python benchmarks/run_benchmarks.py --check-chunked --samples 100000
+
+Note: the rise stage recalculates the baseline itself, so its time includes one baseline pass.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import matplotlib
+matplotlib.use("Agg")
+
+from benchmarks.synthetic_traces import generate_trace, write_trace, TIME_COLUMN, SIGNAL_COLUMN
+from core.headless_session import HeadlessSession
+from core.calculate_baseline import calculate_baseline
+from core.apply_threshold import find_threshold_peaks, mark_peaks
+from core.calculate_rise import calculate_rise
+from core.calculate_decay import calculate_decay
+from core.event_fitting import calculate_event_kinetics, decay_band_samples, fit_events
+from core.kinetic_metrics import compute_kinetic_metrics
+from core.calculate_baseline import percentile_baseline
+from core.precision import PRECISIONS, precision_dtype
+from core.chunked_pipeline import run_chunked_pipeline
+from core.signal_conversion import convert_trace
+from utils.file_utils import read_excel_columns
+from utils.table_operations_utils import build_table_rows, TABLE_COLUMNS
+
+DEFAULT_SIZES = (10_000, 100_000)
+
+# Largest allowed float32 deviations from the float64 pipeline: relative error of the
+# arrays, share of detected peaks found by both, and median relative difference of the
+# event fits and model-free metrics of the peaks both paths fitted. The event model must
+# also converge for most synthetic events, in both precisions
+PRECISION_TOLERANCES = {
+    'df_f': 1e-5,
+    'baseline': 1e-5,
+    'peak_agreement': 0.99,
+    'event_fit': 2e-3,
+    'metrics': 1e-4,
+    'event_convergence': 0.5,
+}
+
+# Deviations of PRECISION_TOLERANCES that are lower limits
+LOWER_LIMITS = ('peak_agreement', 'event_convergence')
+
+# Largest factor between a fitted time constant and the generator's for a converged fit
+# to count
+CONVERGENCE_TAU_FACTOR = 3
+
+class BenchmarkContext:
+    """
+    Inputs shared by all stages of one trace size
+    """
+    def __init__(self, n_samples, work_dir, args):
+        self.n_samples = n_samples
+        self.args = args
+        self.dtype = precision_dtype(args.precision)
+        self.trace = generate_trace(n_samples, seed=args.seed)
+        self.paths = write_trace(self.trace, work_dir, f"synthetic_{n_samples}", args.formats)
+        self.export_path = os.path.join(work_dir, f"export_{n_samples}.xlsx")
+
+        # ΔF/F as computed by Load File in the selected precision, reused by all detection and fitting stages
+        signal = self.trace['signal'].astype(self.dtype)
+        self.df_f = convert_trace(signal, args.baseline_window, args.baseline_percentile)['df_f']
+
+    def new_session(self, values=None):
+        return HeadlessSession(
+            self.trace['time'],
+            self.df_f if values is None else values,
+            baseline_window_size=self.args.baseline_window,
+            baseline_percentage=self.args.baseline_percentile
+        )
+
+    def detect(self, session):
+        return find_threshold_peaks(session.df_f, self.args.threshold, self.args.distance, self.args.width)
+
+    def detected_session(self, with_baseline=True):
+        session = self.new_session()
+        if with_baseline:
+            calculate_baseline(session, window_size=self.args.baseline_window, percentile=self.args.baseline_percentile)
+        mark_peaks(session, self.detect(session))
+        return session
+
+def _setup_identity(ctx):
+    return ctx
+
+def _setup_session(ctx):
+    return ctx.new_session()
+
+def _run_load_npy(ctx):
+    data = np.load(ctx.paths['npy'])
+    return data[:, 0], data[:, 1]
+
+def _run_load_csv(ctx):
+    import pandas as pd
+    return pd.read_csv(ctx.paths['csv'])
+
+def _run_load_xlsx(ctx):
+    return read_excel_columns(ctx.paths['xlsx'], "Sheet1", TIME_COLUMN, SIGNAL_COLUMN)
+
+def _run_baseline(session):
+    calculate_baseline(session, window_size=session.last_baseline_window_size, percentile=session.last_baseline_percentage)
+
+def _setup_convert(ctx):
+    trace = generate_trace(ctx.n_samples, seed=ctx.args.seed, rfp=True)
+    return trace['signal'].astype(ctx.dtype), trace['rfp'].astype(ctx.dtype), ctx.args
+
+def _run_convert(state):
+    signal, rfp, args = state
+    convert_trace(signal, args.baseline_window, args.baseline_percentile, rfp=rfp, rfp_smoothing_window=5)
+
+def _run_threshold(ctx):
+    return ctx.detect(ctx.new_session())
+
+def _setup_fit(ctx):
+    return ctx.detected_session()
+
+def _run_rise(session):
+    calculate_rise(session, no_draw=True)
+
+def _run_decay(session):
+    calculate_decay(session, no_draw=True)
+
+def _run_event_fit(session):
+    calculate_event_kinetics(session, no_draw=True)
+
+def _setup_table(ctx):
+    session = ctx.detected_session()
+    calculate_rise(session, no_draw=True)
+    calculate_decay(session, no_draw=True)
+    return session
+
+def _run_table(session):
+    return build_table_rows(session)
+
+def _setup_export(ctx):
+    import pandas as pd
+    session = _setup_table(ctx)
+    return ctx.export_path, pd.DataFrame(build_table_rows(session), columns=TABLE_COLUMNS)
+
+def _run_export(state):
+    path, df = state
+    df.to_excel(path, index=False)
+
+def _run_chunked(ctx):
+    output_path = os.path.join(os.path.dirname(ctx.export_path), f"chunked_{ctx.n_samples}.csv")
+    run_chunked_pipeline(
+        ctx.paths['npy'], output_path,
+        baseline_window=ctx.args.baseline_window, baseline_percentile=ctx.args.baseline_percentile,
+        peak_threshold=ctx.args.threshold, min_distance=ctx.args.distance, width=ctx.args.width,
+        chunk_samples=ctx.args.chunk_samples
+    )
+
+# (name, setup, run, required file format)
+STAGES = [
+    ("load_npy", _setup_identity, _run_load_npy, 'npy'),
+    ("load_csv", _setup_identity, _run_load_csv, 'csv'),
+    ("load_xlsx", _setup_identity, _run_load_xlsx, 'xlsx'),
+    ("baseline", _setup_session, _run_baseline, None),
+    ("convert_drr", _setup_convert, _run_convert, None),
+    ("threshold", _setup_identity, _run_threshold, None),
+    ("rise", _setup_fit, _run_rise, None),
+    ("decay", _setup_fit, _run_decay, None),
+    ("event_fit", _setup_fit, _run_event_fit, None),
+    ("table", _setup_table, _run_table, None),
+    ("export", _setup_export, _run_export, None),
+    ("chunked", _setup_identity, _run_chunked, 'npy'),
+]
+
+def run_stage(ctx, setup, run, repeat):
+    """
+    Time one stage and measure its peak traced memory
+
+    Returns:
+        dict: best and median wall time in seconds, peak memory in bytes
+    """
+    timings = []
+    for _ in range(repeat):
+        state = setup(ctx)
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured in a separate run because tracing slows the stage down
+    state = setup(ctx)
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'best_s': min(timings),
+        'median_s': float(np.median(timings)),
+        'peak_bytes': peak,
+    }
+
+def _relative_error(values, reference):
+    values, reference = np.asarray(values, dtype=np.float64), np.asarray(reference, dtype=np.float64)
+    return float(np.nanmax(np.abs(values - reference)) / max(np.nanmax(np.abs(reference)), 1e-300))
+
+def _median_relative_difference(values, reference):
+    difference = np.abs(values - reference) / np.maximum(np.abs(reference), 1e-12)
+    return float(np.nanmedian(difference)) if np.isfinite(difference).any() else 0.0
+
+def event_convergence(trace, peaks, fits):
+    """
+    Share of the synthetic events the event model converges for, with both time constants
+    within CONVERGENCE_TAU_FACTOR of the generator's (swapped or runaway taus do not count)
+
+    Detected peaks with no event of the generator starting in their fit window are noise
+    maxima on the tails of events and are not counted.
+    """
+    events = trace['event_indices']
+    first = np.minimum(np.searchsorted(events, fits['start']), len(events) - 1)
+    is_event = (events[first] >= fits['start']) & (events[first] <= peaks)
+    accurate = fits['converged'].copy()
+    for name in ("tau_rise", "tau_decay"):
+        with np.errstate(invalid='ignore'):
+            ratio = fits[name] / trace[name]
+            accurate &= (ratio < CONVERGENCE_TAU_FACTOR) & (ratio > 1 / CONVERGENCE_TAU_FACTOR)
+    return float(accurate[is_event].mean()) if is_event.any() else 1.0
+
+def check_precision(trace, args):
+    """
+    Run conversion, baseline, detection, event fits and model-free metrics in float64 and
+    float32 and measure how far the float32 results are from the float64 ones, and how
+    often the event model converges in either precision
+
+    Returns:
+        dict: Deviation per PRECISION_TOLERANCES key, plus the bytes of the trace arrays per precision
+    """
+    runs = {}
+    for precision in PRECISIONS:
+        df_f = convert_trace(trace['signal'].astype(precision_dtype(precision)), args.baseline_window, args.baseline_percentile)['df_f']
+        baseline = percentile_baseline(df_f, args.baseline_window, args.baseline_percentile)
+        peaks = find_threshold_peaks(df_f, args.threshold, args.distance, args.width)
+        fits = fit_events(trace['time'], df_f, peaks, band_samples=decay_band_samples(df_f, baseline, peaks))
+        metrics = compute_kinetic_metrics(trace['time'], df_f, baseline, peaks)
+        runs[precision] = df_f, baseline, peaks, fits, metrics
+
+    df_f64, baseline64, peaks64, fits64, metrics64 = runs['float64']
+    df_f32, baseline32, peaks32, fits32, metrics32 = runs['float32']
+    common, i64, i32 = np.intersect1d(peaks64, peaks32, return_indices=True)
+    fitted = fits64['converged'][i64] & fits32['converged'][i32]
+
+    return {
+        'df_f': _relative_error(df_f32, df_f64),
+        'baseline': _relative_error(baseline32, baseline64),
+        'peak_agreement': len(common) / max(len(np.union1d(peaks64, peaks32)), 1),
+        'event_fit': max(
+            _median_relative_difference(fits32[name][i32][fitted], fits64[name][i64][fitted])
+            for name in ("amplitude", "tau_rise", "tau_decay")
+        ),
+        'metrics': _median_relative_difference(metrics32[i32], metrics64[i64]),
+        'event_convergence': min(event_convergence(trace, runs[precision][2], runs[precision][3]) for precision in PRECISIONS),
+        'bytes': {precision: runs[precision][0].nbytes + runs[precision][1].nbytes for precision in PRECISIONS},
+    }
+
+def in_memory_table(trace, args):
+    """
+    Table of the whole trace analysed in memory: Load File, Detect Peaks and the event model
+    """
+    import pandas as pd
+
+    converted = convert_trace(trace['signal'], args.baseline_window, args.baseline_percentile)
+    session = HeadlessSession(
+        trace['time'], converted['df_f'],
+        baseline_window_size=args.baseline_window, baseline_percentage=args.baseline_percentile, peak_onset_window=50
+    )
+    session.raw_values = pd.Series(trace['signal'])
+    session.raw_baseline = converted['raw_baseline']
+    mark_peaks(session, find_threshold_peaks(session.df_f, args.threshold, args.distance, args.width))
+    # Drawn, so that the onset markers of the event fits start the metrics as in the app
+    calculate_event_kinetics(session)
+    return session.table_rows
+
+def check_chunked(trace, args, work_dir):
+    """
+    Run the chunked pipeline with a few chunk sizes, one of them the whole trace, and compare
+    its CSV rows with the table of the in-memory run
+
+    Returns:
+        list: (chunk samples, peaks written, peaks the event model failed for, rows that
+               differ from the in-memory table) per chunk size
+    """
+    n_samples = len(trace['time'])
+    path = write_trace(trace, work_dir, f"chunked_check_{n_samples}", ['npy'])['npy']
+    reference = [tuple(row) for row in in_memory_table(trace, args)]
+
+    results = []
+    for chunk_samples in sorted({max(n_samples // 7, 1), min(args.chunk_samples, n_samples), n_samples}):
+        output_path = os.path.join(work_dir, f"chunked_check_{n_samples}_{chunk_samples}.csv")
+        n_peaks, n_fallbacks = run_chunked_pipeline(
+            path, output_path,
+            baseline_window=args.baseline_window, baseline_percentile=args.baseline_percentile,
+            peak_threshold=args.threshold, min_distance=args.distance, width=args.width,
+            chunk_samples=chunk_samples
+        )
+        with open(output_path, newline='', encoding='utf-8') as f:
+            rows = [tuple(row) for row in csv.reader(f)][1:]
+        differing = sum(row != expected for row, expected in zip(rows, reference)) + abs(len(rows) - len(reference))
+        results.append((chunk_samples, n_peaks, n_fallbacks, differing))
+    return results
+
+def precision_failures(deviations):
+    """
+    Names of the deviations outside PRECISION_TOLERANCES
+    """
+    return [
+        name for name, limit in PRECISION_TOLERANCES.items()
+        if (deviations[name] < limit if name in LOWER_LIMITS else deviations[name] > limit)
+    ]
+
+def compare_results(results, baseline, tolerance):
+    """
+    List the stages that became slower than the saved baseline by more than the tolerance
+    """
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference and reference['best_s'] > 0:
+            ratio = result['best_s'] / reference['best_s']
+            if ratio > 1 + tolerance:
+                regressions.append((key, reference['best_s'], result['best_s'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CaFire analysis pipeline on synthetic traces")
+    parser.add_argument("--samples", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Trace lengths (10k to 10M)")
+    parser.add_argument("--stages", nargs="+", default=[name for name, *_ in STAGES], help="Stages to run")
+    parser.add_argument("--formats", nargs="+", default=["npy", "csv", "xlsx"], help="File formats to write and load")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline-window", type=int, default=50)
+    parser.add_argument("--baseline-percentile", type=float, default=30)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--distance", type=float, default=5)
+    parser.add_argument("--width", type=float, default=2)
+    parser.add_argument("--chunk-samples", type=int, default=100_000, help="Chunk size of the chunked stage")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before a stage is flagged")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float64", help="Precision of the trace values")
+    parser.add_argument("--check-precision", action="store_true", help="Check the float32 results against float64 instead of timing")
+    parser.add_argument("--check-chunked", action="store_true", help="Check the chunked pipeline against the in-memory run instead of timing")
+    args = parser.parse_args()
+
+    if args.check_chunked:
+        failed = False
+        print(f"{'samples':>10} {'chunk':>10} {'peaks':>8} {'fallbacks':>10} {'differing':>10}")
+        with tempfile.TemporaryDirectory() as work_dir:
+            for n_samples in args.samples:
+                results = check_chunked(generate_trace(n_samples, seed=args.seed), args, work_dir)
+                for chunk_samples, n_peaks, n_fallbacks, differing in results:
+                    print(f"{n_samples:>10} {chunk_samples:>10} {n_peaks:>8} {n_fallbacks:>10} {differing:>10}")
+                # Every chunk size must give the in-memory table, and the same fallbacks
+                if any(differing for *_, differing in results) or len({result[2] for result in results}) > 1:
+                    print(f"CHUNKED {n_samples}: the chunked results differ from the in-memory run")
+                    failed = True
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.check_precision:
+        failed = False
+        print(f"{'samples':>10} {'ΔF/F':>10} {'baseline':>10} {'peaks':>8} {'fits':>10} {'metrics':>10} {'converged':>10} {'MB f64/f32':>12}")
+        for n_samples in args.samples:
+            deviations = check_precision(generate_trace(n_samples, seed=args.seed), args)
+            memory = deviations['bytes']
+            print(f"{n_samples:>10} {deviations['df_f']:10.2e} {deviations['baseline']:10.2e} "
+                  f"{deviations['peak_agreement']:8.4f} {deviations['event_fit']:10.2e} {deviations['metrics']:10.2e} {deviations['event_convergence']:10.2%} "
+                  f"{memory['float64'] / 2**20:5.1f}/{memory['float32'] / 2**20:<5.1f}")
+            for name in precision_failures(deviations):
+                print(f"PRECISION {name}/{n_samples}: {deviations[name]:.3g} (limit {PRECISION_TOLERANCES[name]:g})")
+                failed = True
+        if failed:
+            sys.exit(1)
+        return
+
+    results = {}
+    print(f"{'stage':<12} {'samples':>10} {'best [ms]':>12} {'median [ms]':>12} {'peak [MB]':>10}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_samples in args.samples:
+            ctx = BenchmarkContext(n_samples, work_dir, args)
+            for name, setup, run, fmt in STAGES:
+                if name not in args.stages or (fmt is not None and fmt not in ctx.paths):
+                    continue
+                result = run_stage(ctx, setup, run, args.repeat)
+                results[f"{name}/{n_samples}"] = result
+                print(f"{name:<12} {n_samples:>10} {result['best_s'] * 1000:12.1f} "
+                      f"{result['median_s'] * 1000:12.1f} {result['peak_bytes'] / 2**20:10.1f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for key, before, after, ratio in regressions:
+            print(f"REGRESSION {key}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
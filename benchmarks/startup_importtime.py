@@ -0,0 +1,88 @@
+"""
+Startup import-time benchmark
+Runs `python -X importtime` on the application module in a fresh interpreter and
+summarizes where the import time goes
+
+Usage:
+    python benchmarks/startup_importtime.py [--module app.CaFire] [--top 20] [--repeat 3]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utils.startup_utils import HEAVY_MODULES
+
+def run_importtime(module):
+    """
+    Import a module with -X importtime in a subprocess
+
+    Args:
+        module: Dotted name of the module to import
+
+    Returns:
+        tuple: (list of (self_us, cumulative_us, name) rows, set of modules loaded at exit)
+    """
+    code = f"import sys, {module}; print('\\n'.join(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+        except ValueError:
+            continue
+    return rows, set(result.stdout.split())
+
+def summarize(rows, loaded_modules, top):
+    """
+    Print the total import time, the slowest top-level imports and the deferred modules that were loaded
+    """
+    # Top-level imports are the rows without indentation in the importtime tree
+    top_level = [row for row in rows if not row[2].startswith("  ")]
+    total_ms = sum(row[1] for row in top_level) / 1000
+
+    print(f"Total import time: {total_ms:.1f} ms ({len(rows)} modules)")
+    print(f"\nSlowest {top} imports (cumulative):")
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:16.1f} {self_us / 1000:10.1f}  {name.strip()}")
+
+    eager = [name for name in HEAVY_MODULES if name in loaded_modules]
+    print("\nDeferred modules loaded at startup:", ", ".join(eager) if eager else "none")
+    return total_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize -X importtime for the application startup")
+    parser.add_argument("--module", default="app.CaFire", help="Module imported at startup")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest imports to list")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs to take the fastest total from")
+    args = parser.parse_args()
+
+    totals = []
+    for i in range(args.repeat):
+        rows, loaded_modules = run_importtime(args.module)
+        # Only print the detailed table for the last run, earlier runs warm the file cache
+        if i == args.repeat - 1:
+            totals.append(summarize(rows, loaded_modules, args.top))
+        else:
+            top_level = [row for row in rows if not row[2].startswith("  ")]
+            totals.append(sum(row[1] for row in top_level) / 1000)
+
+    print(f"\nBest of {args.repeat}: {min(totals):.1f} ms")
+
+if __name__ == "__main__":
+    main()
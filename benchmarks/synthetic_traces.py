@@ -0,0 +1,203 @@
+"""
+Synthetic calcium trace generator
+Produces reproducible GCaMP-like recordings (optionally with an RFP reference channel)
+and writes them in the formats CaFire and the benchmarks read
+
+Usage:
+    python benchmarks/synthetic_traces.py --samples 100000 --rfp --formats npy csv xlsx --out synthetic
+"""
+import os
+import argparse
+import numpy as np
+
+# Recording sizes covered by the benchmarks
+SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+
+# Column headers written to CSV / Excel, matching the fields of the Load dialog
+TIME_COLUMN = "Time"
+SIGNAL_COLUMN = "GCaMP"
+RFP_COLUMN = "RFP"
+
+# Excel worksheets cannot hold more rows than this (header included)
+XLSX_MAX_ROWS = 1_048_576
+
+def event_kernel(sample_interval, tau_rise, tau_decay, duration=None):
+    """
+    Unit-peak GCaMP event shape (1 - e^{-t/tau_rise}) * e^{-t/tau_decay}
+
+    Args:
+        sample_interval: Time between samples
+        tau_rise: Rise time constant
+        tau_decay: Decay time constant
+        duration: Kernel length in time units (defaults to 10 decay constants)
+
+    Returns:
+        np.ndarray: Kernel samples normalized to a peak of 1
+    """
+    duration = duration or 10 * tau_decay
+    t = np.arange(0, duration, sample_interval)
+    kernel = (1 - np.exp(-t / tau_rise)) * np.exp(-t / tau_decay)
+    return kernel / kernel.max()
+
+def generate_trace(n_samples, sample_interval=0.01, event_rate=0.5, tau_rise=0.02, tau_decay=0.3,
+                   amplitude=0.5, amplitude_cv=0.3, noise_sd=0.02, drift=0.1, f0=100.0,
+                   rfp=False, rfp_f0=80.0, seed=0):
+    """
+    Generate a synthetic GCaMP recording
+
+    Args:
+        n_samples: Number of samples
+        sample_interval: Time between samples
+        event_rate: Mean event rate (events per time unit, Poisson)
+        tau_rise: Rise time constant of each event
+        tau_decay: Decay time constant of each event
+        amplitude: Mean event amplitude in ΔF/F
+        amplitude_cv: Coefficient of variation of the amplitudes (gamma distributed)
+        noise_sd: Standard deviation of the additive noise relative to f0
+        drift: Relative size of the slow bleaching / drift component
+        f0: Resting fluorescence of the GCaMP channel
+        rfp: Also generate an RFP reference channel sharing the drift
+        rfp_f0: Resting fluorescence of the RFP channel
+        seed: Seed of the random generator
+
+    Returns:
+        dict: time, signal, rfp (or None), true ΔF/F, event indices and amplitudes, and the
+              rise and decay time constants
+    """
+    from scipy.signal import oaconvolve
+
+    rng = np.random.default_rng(seed)
+    time = np.arange(n_samples) * sample_interval
+    duration = n_samples * sample_interval
+
+    # Poisson event times with gamma distributed amplitudes
+    n_events = rng.poisson(event_rate * duration)
+    event_indices = np.sort(rng.integers(0, n_samples, n_events))
+    shape = 1 / amplitude_cv ** 2
+    amplitudes = rng.gamma(shape, amplitude / shape, n_events)
+
+    impulses = np.zeros(n_samples)
+    np.add.at(impulses, event_indices, amplitudes)
+    true_df_f = oaconvolve(impulses, event_kernel(sample_interval, tau_rise, tau_decay))[:n_samples]
+
+    # Slow drift shared by both channels: bleaching plus a slow oscillation
+    phase = time / max(duration, sample_interval)
+    slow = 1 - drift * phase + 0.5 * drift * np.sin(2 * np.pi * 3 * phase)
+
+    signal = f0 * slow * (1 + true_df_f) + noise_sd * f0 * rng.standard_normal(n_samples)
+
+    rfp_values = None
+    if rfp:
+        rfp_values = rfp_f0 * slow + noise_sd * rfp_f0 * rng.standard_normal(n_samples)
+
+    return {
+        'time': time,
+        'signal': signal,
+        'rfp': rfp_values,
+        'true_df_f': true_df_f,
+        'event_indices': event_indices,
+        'amplitudes': amplitudes,
+        'tau_rise': tau_rise,
+        'tau_decay': tau_decay,
+    }
+
+def _columns(trace):
+    columns = [(TIME_COLUMN, trace['time']), (SIGNAL_COLUMN, trace['signal'])]
+    if trace['rfp'] is not None:
+        columns.append((RFP_COLUMN, trace['rfp']))
+    return columns
+
+def write_npy(trace, path):
+    """
+    Write the trace as a (n_samples, n_columns) float array: time, signal[, rfp]
+    """
+    np.save(path, np.column_stack([values for _, values in _columns(trace)]))
+    return path
+
+def write_csv(trace, path):
+    """
+    Write the trace as a CSV file with a header row
+    """
+    import pandas as pd
+
+    pd.DataFrame(dict(_columns(trace))).to_csv(path, index=False)
+    return path
+
+def write_xlsx(trace, path, sheet_name="Sheet1"):
+    """
+    Write the trace as an Excel workbook readable by the Load dialog
+
+    Raises:
+        ValueError: If the trace does not fit in one worksheet
+    """
+    import openpyxl
+
+    columns = _columns(trace)
+    n_samples = len(trace['time'])
+    if n_samples + 1 > XLSX_MAX_ROWS:
+        raise ValueError(f"{n_samples} samples do not fit in one worksheet ({XLSX_MAX_ROWS - 1} max).")
+
+    # Write-only mode streams the rows instead of building the whole sheet in memory
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([name for name, _ in columns])
+    for row in zip(*[values.tolist() for _, values in columns]):
+        ws.append(row)
+    wb.save(path)
+    return path
+
+WRITERS = {
+    'npy': write_npy,
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+}
+
+def write_trace(trace, out_dir, name, formats=('npy', 'csv', 'xlsx')):
+    """
+    Write one trace in several formats, skipping Excel when the trace is too long for a worksheet
+
+    Returns:
+        dict: Path written for each format
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for fmt in formats:
+        if fmt == 'xlsx' and len(trace['time']) + 1 > XLSX_MAX_ROWS:
+            continue
+        paths[fmt] = WRITERS[fmt](trace, os.path.join(out_dir, f"{name}.{fmt}"))
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic GCaMP traces")
+    parser.add_argument("--samples", type=int, nargs="+", default=list(SIZES), help="Trace lengths to generate")
+    parser.add_argument("--formats", nargs="+", default=["npy", "csv", "xlsx"], choices=sorted(WRITERS))
+    parser.add_argument("--out", default="synthetic", help="Output directory")
+    parser.add_argument("--sample-interval", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=0.5, help="Events per time unit")
+    parser.add_argument("--tau-rise", type=float, default=0.02)
+    parser.add_argument("--tau-decay", type=float, default=0.3)
+    parser.add_argument("--amplitude", type=float, default=0.5, help="Mean ΔF/F amplitude")
+    parser.add_argument("--noise", type=float, default=0.02, help="Noise SD relative to F0")
+    parser.add_argument("--drift", type=float, default=0.1)
+    parser.add_argument("--rfp", action="store_true", help="Add an RFP reference channel")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_samples in args.samples:
+        trace = generate_trace(
+            n_samples,
+            sample_interval=args.sample_interval,
+            event_rate=args.rate,
+            tau_rise=args.tau_rise,
+            tau_decay=args.tau_decay,
+            amplitude=args.amplitude,
+            noise_sd=args.noise,
+            drift=args.drift,
+            rfp=args.rfp,
+            seed=args.seed
+        )
+        paths = write_trace(trace, args.out, f"synthetic_{n_samples}", args.formats)
+        print(f"{n_samples} samples, {len(trace['event_indices'])} events:", ", ".join(paths.values()))
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,9 @@
+from core.instrumentation import Instrumentation
+from core.edit_history import EditHistory
+from core.artist_registry import clear_artist_groups
+from utils.overview_utils import draw_overview
+from utils.navigation_utils import cancel_pending_view
+
 def initialize_data_state(app):
     """
     Initialize data-related state variables
@@ -10,7 +16,13 @@ def initialize_data_state(app):
     app.raw_values = None
     app.raw_baseline = None
     app.baseline_values = None
+    # Reference channel of a ΔR/R load, kept so that the trace can be re-derived (parameter sweep)
+    app.raw_rfp = None
     app.convert_to_df_f = False
+    # File the trace was read from, kept in saved sessions
+    app.source_path = None
+    # Tail reader, tracker and timer of the live mode while it runs
+    app.live_acquisition = None
 
 def initialize_ui_elements(app):
     """
@@ -28,6 +40,20 @@ def initialize_ui_elements(app):
     app.partition_lines = []
     app.partition_labels = []
     app.rise_start_markers = {}  
+    app.average_ax = None
+    app.threshold_line = None
+    app.preview_line = None
+    # Navigation target not drawn yet, its idle callback and the middle-button pan in progress
+    app.pending_xlim = None
+    app.pending_ylim = None
+    app.navigation_job = None
+    app.pan_start = None
+    # Time index of the artists, for culling on limit changes (built on the first navigation)
+    app.viewport_index = None
+    app.viewport_index_signature = None
+    # Tooltip of the marked peak under the cursor
+    app.hover_annotation = None
+    app.hovered_peak = None
 
 def initialize_calculation_state(app):
     """
@@ -43,6 +69,16 @@ def initialize_calculation_state(app):
     app.rise_times = {}  
     app.tau_values = {}  
     app.amplitudes = {} 
+    # Model each τ of a peak was fitted with, {peak: {'rise': model, 'decay': model}}
+    app.tau_source = {}
+    app.peak_average = None
+    # Undo/redo of manual peak edits
+    app.edit_history = EditHistory()
+    # Caches tied to the loaded trace, rebuilt when app.df_f is replaced
+    app.peak_candidates = None
+    app.auto_threshold_noise = None
+    # Memoized baseline, bands, local minima and envelopes of the trace (created on first use)
+    app.trace_context = None
 
 def initialize_parameters(app):
     """
@@ -70,8 +106,11 @@ def initialize_last_used_values(app):
     app.last_x_col = ""
     app.last_y_col = ""
     app.last_RFP_col = ""
+    app.last_RFP_smoothing_window_size = ""
     app.last_baseline_window_size = ""
     app.last_baseline_percentage = ""
+    app.last_keep_raw_baseline = "on"
+    app.last_precision = "float64"
     app.last_peak_threshold = ""
     app.last_min_distance = ""
     app.last_peak_onset_window = ""
@@ -79,6 +118,20 @@ def initialize_last_used_values(app):
     app.last_interval_size = ""
     app.last_offset = ""
     app.last_width = ""  
+    app.last_pre_samples = ""
+    app.last_post_samples = ""
+    app.last_outlier_z = ""
+    app.last_align_group = "off"
+    app.last_auto_threshold = "off"
+    app.last_threshold_k = "4"
+    app.last_template_tau_rise = ""
+    app.last_template_tau_decay = ""
+    app.last_template_k = "4"
+    app.last_event_model = "off"
+    app.last_skip_fits = "off"
+    app.last_live_frame_rate = "5"
+    app.last_live_span = "30"
+    app.last_chunk_samples = "1000000"
 
 def initialize_app_state(app):
     """
@@ -93,6 +146,9 @@ def initialize_app_state(app):
     initialize_parameters(app)
     initialize_last_used_values(app)
 
+    # Disabled until switched on in the Performance panel
+    app.instrumentation = Instrumentation()
+
 def clear_plot(app, reset_data=False):
     """
     Clear all elements on the plot and optionally reset the data state
@@ -101,71 +157,67 @@ def clear_plot(app, reset_data=False):
         app: Main application instance
         reset_data: Whether to reset the data state
     """
-    for point in app.points:
-        if point in app.ax.lines:
-            point.remove()
-    app.points = []
-    
-    for text in app.texts:
-        if text in app.ax.texts:
-            text.remove()
-    app.texts = []
+    # Markers, fit curves and partition lines leave the axes group by group, in one pass
+    clear_artist_groups(app)
+    app.viewport_index = None
+
+    if getattr(app, 'hover_annotation', None) is not None and app.hover_annotation.axes is not None:
+        app.hover_annotation.remove()
+    app.hover_annotation = None
+    app.hovered_peak = None
     
     app.marked_peaks = []
-    
-    for line in app.decay_lines:
-        if line in app.ax.lines:
-            line.remove()
-    app.decay_lines = []
     app.decay_calculated = []
-    app.decay_line_map = {}
-    
-    for line in app.rise_lines:
-        if line in app.ax.lines:
-            line.remove()
-    app.rise_lines = []
     app.rise_calculated = []
-    app.rise_line_map = {}
     app.rise_times = {}
     app.tau_values = {}
     app.amplitudes = {}
+    app.tau_source = {}
     
-    for key in list(app.rise_start_markers.keys()):
-        marker = app.rise_start_markers[key]
-        if marker in app.ax.lines:
-            marker.remove()
-    app.rise_start_markers = {}
-    
-    if app.baseline_line is not None and app.baseline_line in app.ax.lines:
+    if app.baseline_line is not None and app.baseline_line.axes is app.ax:
         app.baseline_line.remove()
     app.baseline_line = None
-    
-    for line in app.partition_lines:
-        if line in app.ax.lines:
-            line.remove()
-    app.partition_lines = []
-    
-    for label in app.partition_labels:
-        if label in app.ax.texts:
-            label.remove()
-    app.partition_labels = []
+
+    if getattr(app, 'threshold_line', None) is not None and app.threshold_line.axes is app.ax:
+        app.threshold_line.remove()
+    app.threshold_line = None
+
+    if getattr(app, 'average_ax', None) is not None:
+        try:
+            app.average_ax.remove()
+        except (ValueError, AttributeError):
+            pass
+    app.average_ax = None
+    app.peak_average = None
+
+    # Edits refer to peaks that are gone
+    if getattr(app, 'edit_history', None) is not None:
+        app.edit_history.clear()
     
     if hasattr(app, 'tree') and app.tree is not None:
         for item in app.tree.get_children():
             app.tree.delete(item)
     
     if reset_data:
+        app.peak_candidates = None
+        app.auto_threshold_noise = None
+        app.trace_context = None
         app.time = None
         app.df_f = None
         app.raw_values = None
         app.raw_baseline = None
         app.baseline_values = None
+        app.raw_rfp = None
+        app.source_path = None
         app.baseline_window_size = None
         app.baseline_percentage = None
         app.peak_num = None
         app.click_window_size = None
         if hasattr(app, 'evoked_var') and app.evoked_var is not None:
             app.evoked_var.set("off")
+        # A view requested for the previous trace must not move the next one
+        cancel_pending_view(app)
+        draw_overview(app)
     
     if hasattr(app, 'canvas') and app.canvas is not None:
         app.canvas.draw()
\ No newline at end of file
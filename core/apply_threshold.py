@@ -1,16 +1,109 @@
-from ui.dialogs import DetectPeaksDialog
+import numpy as np
 from core.app_state import clear_plot
+from core.instrumentation import get_instrumentation
+from core.progress import get_progress_reporter
+from core.auto_threshold import compute_auto_threshold, draw_threshold_line
+from core.peak_candidates import get_peak_candidates, show_peak_preview, remove_peak_preview
 from tkinter import messagebox
-from scipy.signal import find_peaks
+
+def find_threshold_peaks(values, peak_threshold, min_distance=None, width=None):
+    """
+    Find peaks above a threshold with the optional distance and width constraints
+
+    Args:
+        values: Trace values
+        peak_threshold: Minimum peak height, a scalar or one value per sample
+        min_distance: Minimum distance between peaks in samples (None to disable)
+        width: Minimum peak width in samples (None to disable)
+
+    Returns:
+        np.ndarray: Indices of the detected peaks
+    """
+    from scipy.signal import find_peaks
+
+    # Build the parameter dictionary for find_peaks
+    peak_params = {'height': peak_threshold}
+    if min_distance:
+        peak_params['distance'] = min_distance
+    if width:
+        peak_params['width'] = width
+
+    peaks, _ = find_peaks(values, **peak_params)
+    return peaks
+
+def mark_peaks(app, peaks, progress=None):
+    """
+    Plot and register detected peaks so that rise and decay can be calculated for them
+
+    Args:
+        app: Main application instance
+        peaks: Indices of the peaks in app.df_f
+        progress: Progress callback receiving the fraction of peaks marked (defaults to the progress bar)
+    """
+    if progress is None:
+        progress = get_progress_reporter(app, start=0.0, span=0.4)
+    total_peaks = len(peaks)
+    app.marked_peaks = []  # Clear existing peaks
+    for i, peak_idx in enumerate(peaks):
+        x_peak = app.time.iloc[peak_idx]
+        y_peak = app.df_f.iloc[peak_idx]
+        point = app.ax.plot(x_peak, y_peak, 'ro')[0]
+        app.points.append(point)
+        app.marked_peaks.append((x_peak, y_peak))
+        app.decay_calculated.append(False)
+        app.rise_calculated.append(False)
+
+        progress((i + 1) / total_peaks)
+    progress.finish()
+
+def preview_threshold_peaks(app, candidates, params):
+    """
+    Show the peaks the current dialog parameters would detect, without fitting anything
+
+    Args:
+        app: Main application instance
+        candidates: Cached PeakCandidates of the trace
+        params: Parsed dialog parameters, None to hide the preview
+
+    Returns:
+        int: Number of previewed peaks, None when the preview is hidden
+    """
+    if params is None:
+        remove_peak_preview(app)
+        app.canvas.draw_idle()
+        return None
+
+    peak_threshold, min_distance, width, auto_threshold, threshold_k = params
+    if auto_threshold:
+        peak_threshold = compute_auto_threshold(app, threshold_k)
+    peaks = candidates.select(peak_threshold, min_distance, width)
+    show_peak_preview(app, peaks)
+    return len(peaks)
 
 def apply_threshold(app):
+    from ui.dialogs import DetectPeaksDialog
+
+    instrumentation = get_instrumentation(app)
     try:
+        # All local maxima are found once; the preview and the final detection filter this cache
+        with instrumentation.stage("candidates"):
+            candidates = get_peak_candidates(app)
+        height_range = None
+        if candidates.heights.size > 0:
+            height_range = (float(np.median(candidates.heights)), float(candidates.heights.max()))
+
         dialog = DetectPeaksDialog(
             app, 
             peak_threshold=app.last_peak_threshold,
             min_distance=app.last_min_distance,
             width=app.last_width,
-            peak_onset_window=app.last_peak_onset_window
+            peak_onset_window=app.last_peak_onset_window,
+            auto_threshold=app.last_auto_threshold,
+            threshold_k=app.last_threshold_k,
+            event_model=app.last_event_model,
+            skip_fits=app.last_skip_fits,
+            on_preview=lambda params: preview_threshold_peaks(app, candidates, params),
+            height_range=height_range
         )
         
         # Bind the main window destroy event
@@ -20,18 +113,28 @@ def apply_threshold(app):
                 dialog.destroy()
         
         app.bind('<Destroy>', handle_destroy)
-        app.wait_window(dialog)
+        with instrumentation.stage("dialog", idle=True):
+            app.wait_window(dialog)
         app.unbind('<Destroy>')
+
+        remove_peak_preview(app)
+        if dialog.user_cancelled:
+            app.canvas.draw_idle()
         
         if dialog.user_cancelled or not hasattr(dialog, 'peak_threshold'):
             return
 
         if not dialog.user_cancelled:
             try:
-
-                peak_threshold = float(dialog.peak_threshold)
+                auto_threshold = dialog.auto_threshold == "on"
+                if not auto_threshold:
+                    peak_threshold = float(dialog.peak_threshold)
                 
                 # Save user input parameters (including empty values)
+                app.last_auto_threshold = dialog.auto_threshold
+                app.last_threshold_k = dialog.threshold_k
+                app.last_event_model = dialog.event_model
+                app.last_skip_fits = dialog.skip_fits
                 app.last_peak_threshold = dialog.peak_threshold
                 app.last_min_distance = dialog.min_distance  # Save original input, not using default value
                 app.last_width = dialog.width  # Save original input, not using default value
@@ -42,7 +145,8 @@ def apply_threshold(app):
                 width = float(dialog.width) if dialog.width else 4
 
                 # Clear previous points
-                clear_plot(app, reset_data=False)
+                with instrumentation.stage("clear"):
+                    clear_plot(app, reset_data=False)
 
                 # Redraw baseline when in "Load Raw Data" mode (i.e., not converted to ΔF/F or DR/R)
                 if (not getattr(app, 'convert_to_df_f', False)) and hasattr(app, 'baseline_values') and app.baseline_values is not None:
@@ -62,37 +166,31 @@ def apply_threshold(app):
                         app.ax.legend(loc='best')
                     app.canvas.draw()
 
-                # Build the parameter dictionary for find_peaks
-                peak_params = {'height': peak_threshold}
-                if dialog.min_distance:
-                    peak_params['distance'] = min_distance
-                if dialog.width:
-                    peak_params['width'] = width
+                # Per-sample threshold following the local baseline and noise
+                if auto_threshold:
+                    with instrumentation.stage("auto_threshold"):
+                        peak_threshold = compute_auto_threshold(app, float(dialog.threshold_k))
+                    draw_threshold_line(app, peak_threshold)
 
                 # Find peaks with the provided parameters
-                peaks, _ = find_peaks(app.df_f, **peak_params)
-                total_peaks = len(peaks)
+                with instrumentation.stage("find_peaks"):
+                    peaks = candidates.select(
+                        peak_threshold,
+                        min_distance=min_distance if dialog.min_distance else None,
+                        width=width if dialog.width else None
+                    )
+                instrumentation.count("peaks_detected", len(peaks))
 
                 # Update plot and table
                 if peaks.size > 0:
-                    app.marked_peaks = []  # Clear existing peaks
-                    for i, peak_idx in enumerate(peaks):
-                        x_peak = app.time.iloc[peak_idx]
-                        y_peak = app.df_f.iloc[peak_idx]
-                        point = app.ax.plot(x_peak, y_peak, 'ro')[0]
-                        app.points.append(point)
-                        app.marked_peaks.append((x_peak, y_peak))
-                        app.decay_calculated.append(False)
-                        app.rise_calculated.append(False)
-
-                        # Update progress
-                        progress = 0.4 * (i + 1) / total_peaks
-                        app.progress_bar.set(progress)
-                        app.update()
+                    with instrumentation.stage("mark_peaks"):
+                        mark_peaks(app, peaks)
                 
                     # Update table and canvas
-                    app.update_table()
-                    app.canvas.draw()
+                    with instrumentation.stage("table"):
+                        app.update_table()
+                    with instrumentation.stage("draw"):
+                        app.canvas.draw()
 
             except ValueError as e:
                 messagebox.showerror(title="Error", message=str(e))
@@ -0,0 +1,67 @@
+"""
+Artist groups of the plot
+The per-peak artists live in a few app attributes, one per kind (peak markers, fit curves,
+onset markers, partition lines...). Clearing goes through this module so that a whole
+group is dropped at once, without the per-artist membership tests of the axes' artist
+lists that made clearing P peaks O(P²).
+"""
+
+# App attribute of every group of plot artists, and the empty container it is reset to
+ARTIST_GROUPS = {
+    'points': list,
+    'texts': list,
+    'rise_lines': list,
+    'decay_lines': list,
+    'rise_start_markers': dict,
+    'partition_lines': list,
+    'partition_labels': list,
+}
+
+# Peak -> artist maps that index a group and are emptied with it
+GROUP_MAPS = {
+    'rise_lines': 'rise_line_map',
+    'decay_lines': 'decay_line_map',
+}
+
+def remove_artists(artists):
+    """
+    Remove artists from their axes with the public Artist.remove, skipping those
+    already removed
+
+    Artist.remove searches the axes' children list from its start, so the artists are
+    removed in the order ax.get_children() lists them: each one is then found next to the
+    front of the list and the whole removal stays about linear.
+
+    Args:
+        artists: Iterable of matplotlib artists
+    """
+    by_axes = {}
+    for artist in artists:
+        if artist.axes is not None:
+            by_axes.setdefault(artist.axes, []).append(artist)
+        elif artist.figure is not None:
+            artist.remove()
+
+    for ax, doomed in by_axes.items():
+        order = {id(child): position for position, child in enumerate(ax.get_children())}
+        doomed.sort(key=lambda artist: order.get(id(artist), -1))
+        for artist in doomed:
+            artist.remove()
+
+def clear_artist_groups(app, *names):
+    """
+    Remove every artist of the given groups from the plot and reset the groups
+
+    Args:
+        app: Main application instance
+        names: Group names from ARTIST_GROUPS, all groups when none are given
+    """
+    doomed = []
+    for name in names or tuple(ARTIST_GROUPS):
+        group = getattr(app, name, None)
+        if group:
+            doomed.extend(group.values() if isinstance(group, dict) else group)
+        setattr(app, name, ARTIST_GROUPS[name]())
+        if name in GROUP_MAPS:
+            setattr(app, GROUP_MAPS[name], {})
+    remove_artists(doomed)
@@ -0,0 +1,131 @@
+import numpy as np
+from core.precision import as_float_array
+from core.trace_context import get_trace_context
+
+# Scales the median absolute deviation to the standard deviation of Gaussian noise
+MAD_TO_SIGMA = 1.4826
+
+# The MAD is evaluated every window / NOISE_GRID_FACTOR samples and interpolated in between
+NOISE_GRID_FACTOR = 4
+
+# Window values taken by one batch of medians, bounding the temporary copies
+NOISE_BLOCK_VALUES = 1_000_000
+
+def rolling_noise_sigma(residual, window):
+    """
+    Local noise level of a baseline-subtracted trace from a rolling median absolute deviation
+
+    The noise level changes slowly compared to the window, so the MAD of the window centred
+    on every window / NOISE_GRID_FACTOR-th sample is computed exactly and σ is interpolated
+    linearly in between: each sample enters about 2·NOISE_GRID_FACTOR medians instead of the
+    2·window of two running medians.
+
+    Args:
+        residual: Trace minus its baseline
+        window: Length of the rolling window in samples
+
+    Returns:
+        np.ndarray: Robust σ estimate for every sample
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    residual = as_float_array(residual)
+    n = len(residual)
+    if n == 0:
+        return np.empty(0)
+    window = max(int(window), 3)
+
+    # Windows centred on the grid samples, the edges repeated as the trace ends
+    padded = np.pad(residual, (window // 2, window - 1 - window // 2), mode='edge')
+    windows = sliding_window_view(padded, window)
+    grid = np.arange(0, n, max(window // NOISE_GRID_FACTOR, 1))
+    if grid[-1] != n - 1:
+        grid = np.append(grid, n - 1)
+
+    # Median of each window, then the median distance to it. Events are sparse, so they
+    # shift neither median much and do not inflate σ.
+    mad = np.empty(len(grid))
+    step = max(NOISE_BLOCK_VALUES // window, 1)
+    for start in range(0, len(grid), step):
+        block = windows[grid[start:start + step]]
+        center = np.median(block, axis=1)
+        mad[start:start + step] = np.median(np.abs(block - center[:, None]), axis=1)
+    sigma = np.interp(np.arange(n), grid, MAD_TO_SIGMA * mad)
+
+    # Flat stretches (saturation, padded data) give σ = 0; fall back to the global estimate there
+    global_mad = np.median(np.abs(residual - np.median(residual)))
+    fallback = MAD_TO_SIGMA * global_mad
+    if fallback > 0:
+        sigma = np.where(sigma > 0, sigma, fallback)
+    return sigma
+
+def noise_window_size(baseline_window_size, n_samples):
+    """
+    Default rolling window for the noise estimate: wide compared to the baseline window
+    so that single events stay a minority of the samples in every window
+    """
+    window = max(10 * int(baseline_window_size), 101)
+    return min(window, max(n_samples, 3))
+
+def auto_threshold(values, baseline, k=4.0, window=None):
+    """
+    Noise-adaptive detection threshold baseline + k·σ(t)
+
+    Args:
+        values: Trace values
+        baseline: Baseline of the trace (output of calculate_baseline)
+        k: Number of noise standard deviations above the baseline
+        window: Rolling window for the noise estimate in samples (None for the default)
+
+    Returns:
+        tuple: (threshold, sigma) arrays with one value per sample
+    """
+    values = as_float_array(values)
+    baseline = as_float_array(baseline)
+    if window is None:
+        window = noise_window_size(50, len(values))
+
+    sigma = rolling_noise_sigma(values - baseline, window)
+    return baseline + float(k) * sigma, sigma
+
+def compute_auto_threshold(app, k):
+    """
+    Noise-adaptive threshold of the loaded trace, computed on top of its baseline
+
+    The baseline and σ do not depend on k, so they are kept in app.auto_threshold_noise
+    and only recomputed for a new trace or new baseline settings.
+
+    Args:
+        app: Main application instance
+        k: Number of noise standard deviations above the baseline
+
+    Returns:
+        np.ndarray: Threshold for every sample, also stored in app.auto_threshold_values
+    """
+    window_size = int(app.last_baseline_window_size) if app.last_baseline_window_size else 50
+    percentile = float(app.last_baseline_percentage) if app.last_baseline_percentage else 30
+
+    noise = getattr(app, 'auto_threshold_noise', None)
+    if noise is None or noise['source'] is not app.df_f or noise['settings'] != (window_size, percentile):
+        # The baseline stored at load time may be on the raw signal, so the baseline of the
+        # displayed trace is taken from the trace context; app.baseline_values is left as is
+        baseline = as_float_array(get_trace_context(app).baseline(window_size, percentile))
+        sigma = rolling_noise_sigma(app.df_f.values - baseline, noise_window_size(window_size, len(app.df_f)))
+        noise = {'source': app.df_f, 'settings': (window_size, percentile), 'baseline': baseline, 'sigma': sigma}
+        app.auto_threshold_noise = noise
+
+    threshold = noise['baseline'] + float(k) * noise['sigma']
+    app.auto_threshold_values = threshold
+    return threshold
+
+def draw_threshold_line(app, threshold):
+    """
+    Show the automatic threshold on the plot, replacing the previous one
+
+    Args:
+        app: Main application instance
+        threshold: Threshold for every sample
+    """
+    if getattr(app, 'threshold_line', None) is not None and app.threshold_line in app.ax.lines:
+        app.threshold_line.remove()
+    app.threshold_line, = app.ax.plot(app.time, threshold, color='orange', linestyle=':', linewidth=1, alpha=0.9)
@@ -1,26 +1,69 @@
 import numpy as np
-from tkinter import messagebox
+from core.notifications import show_warning
+from core.precision import as_float_array
+from core.trace_context import get_trace_context
 
-def calculate_baseline(app, window_size=50, percentile=30):
-    if app.time is None or app.df_f is None:
-        messagebox.showwarning(title="Warning", message="No data loaded.")
-        return
+# Window values passed to one np.percentile call: its temporary copy stays about 2 MB and
+# in cache, which is also faster than larger blocks
+BASELINE_BLOCK_VALUES = 250_000
+
+def rolling_baseline(values, window_size, percentile, from_start=True):
+    """
+    Rolling-percentile baseline: sample i >= window_size uses the window_size samples before it,
+    the first samples the window_size samples starting at them
+
+    Args:
+        values: Trace values
+        window_size: Window length in samples
+        percentile: Percentile of each window
+        from_start: Whether values start at the beginning of the trace; otherwise the first
+                    window_size samples have no complete window and are left NaN
+
+    Returns:
+        np.ndarray: Baseline of every sample, in the precision of values
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    values = as_float_array(values)
+    n, window_size = len(values), int(window_size)
+    baseline = np.full(n, np.nan, dtype=values.dtype)
 
-    window_size = int(window_size)
-    percentile = float(percentile)
+    if n > window_size:
+        windows = sliding_window_view(values[:-1], window_size)
+        step = max(BASELINE_BLOCK_VALUES // window_size, 1)
+        for start in range(0, len(windows), step):
+            baseline[window_size + start:window_size + start + step] = np.percentile(windows[start:start + step], percentile, axis=1)
 
-    # Initialize baseline array
-    app.baseline_values = np.zeros_like(app.df_f)
+    if from_start:
+        if n >= 2 * window_size - 1:
+            baseline[:window_size] = np.percentile(sliding_window_view(values[:2 * window_size - 1], window_size), percentile, axis=1)
+        else:
+            # Short trace: the forward windows are cut at its end
+            for i in range(min(window_size, n)):
+                baseline[i] = np.percentile(values[i:i + window_size], percentile)
+    return baseline
 
-    # Calculate baseline for each point
-    for i in range(len(app.df_f)):
-        if i < window_size:  # If it's a point at the beginning, use the next points
-            window = app.df_f[i:i+window_size]
-        else:  # If it's a point at the end, use the previous points
-            window = app.df_f[i-window_size:i]
-        
-        # Calculate the percentile of the window as the baseline
-        app.baseline_values[i] = np.percentile(window, percentile)
+def percentile_baseline(values, window_size=50, percentile=30):
+    """
+    Rolling-percentile baseline of a whole trace, non-finite values replaced by its mean
+
+    Args:
+        values: Trace values
+        window_size: Window length in samples
+        percentile: Percentile of each window
+
+    Returns:
+        np.ndarray: Baseline of every sample
+    """
+    # Percentile of the window before each point, or after it for the first points
+    baseline = rolling_baseline(values, int(window_size), float(percentile))
+    mean_baseline = np.nanmean(baseline, axis=0, dtype=np.float64)
+    return np.nan_to_num(baseline, copy=False, nan=mean_baseline, posinf=mean_baseline, neginf=mean_baseline)
+
+def calculate_baseline(app, window_size=50, percentile=30):
+    if app.time is None or app.df_f is None:
+        show_warning(app, "No data loaded.")
+        return
 
-    mean_baseline = np.nanmean(app.baseline_values, axis=0)
-    app.baseline_values = np.nan_to_num(app.baseline_values, nan=mean_baseline, posinf=mean_baseline, neginf=mean_baseline)
+    # Memoized per trace and settings: repeated fits reuse the same baseline array
+    app.baseline_values = get_trace_context(app).baseline(window_size, percentile)
@@ -1,6 +1,11 @@
+import time
 import numpy as np
-from tkinter import messagebox
-from scipy.optimize import curve_fit
+from core.notifications import show_warning
+from core.instrumentation import get_instrumentation
+from core.progress import NullProgress, get_progress_reporter
+from core.event_fitting import EXPONENTIAL_MODEL, set_tau_source
+from core.edit_history import get_edit_history
+from core.trace_context import get_trace_context
 
 def decay_function(t, tau, y0):
     """
@@ -8,7 +13,20 @@ def decay_function(t, tau, y0):
     """
     return y0 * np.exp(-t / tau)
 
-def calculate_decay(app, single_peak=None, no_draw=False):
+def calculate_decay(app, single_peak=None, no_draw=False, progress=None, peaks=None):
+    """
+    Fit the exponential decay of the marked peaks whose decay is not calculated yet
+
+    Args:
+        app: Main application instance
+        single_peak: Recalculate only this peak
+        no_draw: Skip redrawing the canvas and table
+        progress: Progress callback (defaults to the progress bar)
+        peaks: Marked peaks a full pass is limited to (all by default)
+    """
+    from scipy.optimize import curve_fit
+
+    instrumentation = get_instrumentation(app)
     total_peaks = len(app.marked_peaks)
 
     # Sort marked peaks by time
@@ -20,45 +38,43 @@ def calculate_decay(app, single_peak=None, no_draw=False):
         peaks_to_process = [(peak_index, single_peak)]
     else:
         peaks_to_process = list(enumerate(app.marked_peaks))
+        if peaks is not None:
+            peaks = set(peaks)
+            peaks_to_process = [(i, peak) for i, peak in peaks_to_process if peak in peaks]
+        # A full pass replaces fits outside the click edits: undoing an older edit would bring
+        # back the replaced fits of its peaks
+        get_edit_history(app).clear()
 
-    # Calculate the standard deviation range of the baseline
-    baseline_mean = np.mean(app.baseline_values)
-    baseline_std = np.std(app.baseline_values)
-    peak_values = [peak[1] for peak in app.marked_peaks]
-    mean_peak_value = np.mean(peak_values)
-    ratio = (mean_peak_value - baseline_mean) / baseline_std
-    if (ratio <= 5):
-        baseline_upper = baseline_mean
-    elif (ratio > 5 and ratio <= 10):
-        baseline_upper = baseline_mean + baseline_std
-    else:
-        baseline_upper = baseline_mean + 2 * baseline_std
-    baseline_range = (baseline_mean - 2 * baseline_std, baseline_upper)
+    # Only full passes report progress, a single peak is recalculated in one step
+    if progress is None:
+        progress = NullProgress() if single_peak else get_progress_reporter(app, start=0.7, span=0.3)
+
+    # Samples in the baseline range of the decays, memoized per trace and baseline
+    context = get_trace_context(app)
+    band_samples = context.band_positions('decay')
 
     for i, (current_peak_time, current_peak_value) in peaks_to_process:
         # Skip if decay has already been calculated for this peak
         if app.decay_calculated[i]:
             continue
 
-        current_peak_index = app.time[app.time == current_peak_time].index[0]
+        current_peak_index = context.sample_index(current_peak_time)
 
         # Define next peak index if it exists
         if i + 1 < len(app.marked_peaks):
-            next_peak_index = app.time[app.time == app.marked_peaks[i + 1][0]].index[0]
+            next_peak_index = context.sample_index(app.marked_peaks[i + 1][0])
         else:
             next_peak_index = len(app.df_f)
 
         # Find the first point in the range between the current peak and the next peak that is in the baseline range
-        search_range = app.df_f[current_peak_index:next_peak_index]
-        baseline_points = np.where((search_range >= baseline_range[0]) & 
-                                    (search_range <= baseline_range[1]))[0]
+        first_in_band = np.searchsorted(band_samples, current_peak_index)
         
-        if len(baseline_points) > 0:
+        if first_in_band < len(band_samples) and band_samples[first_in_band] < next_peak_index:
             # Found a point in the baseline range, use the first point
-            min_index_between_peaks = current_peak_index + baseline_points[0]
+            min_index_between_peaks = int(band_samples[first_in_band])
         else:
             # Not found a point in the baseline range, use the minimum value point
-            min_index_between_peaks = np.argmin(search_range) + current_peak_index
+            min_index_between_peaks = np.argmin(app.df_f[current_peak_index:next_peak_index]) + current_peak_index
 
         # Prepare data for fitting
         t_data = app.time[current_peak_index:min_index_between_peaks + 1].values
@@ -84,13 +100,17 @@ def calculate_decay(app, single_peak=None, no_draw=False):
             y0_norm = y0 / y_scale
             
             # Fit using normalized data
-            popt, _ = curve_fit(
-                lambda t, tau_norm: decay_function(t * t_scale, tau_norm * t_scale, y0_norm),
-                t_norm,
-                y_data_norm,
-                p0=[0.5],
-                bounds=(0.0001, np.inf)
-            )
+            fit_start = time.perf_counter()
+            try:
+                popt, _ = curve_fit(
+                    lambda t, tau_norm: decay_function(t * t_scale, tau_norm * t_scale, y0_norm),
+                    t_norm,
+                    y_data_norm,
+                    p0=[0.5],
+                    bounds=(0.0001, np.inf)
+                )
+            finally:
+                instrumentation.record_fit("decay", time.perf_counter() - fit_start)
             
             # Convert normalized tau back to real scale
             tau_fitted = popt[0] * t_scale
@@ -113,18 +133,17 @@ def calculate_decay(app, single_peak=None, no_draw=False):
             app.decay_lines.append(decay_line)
             app.decay_line_map[(current_peak_time, current_peak_value)] = decay_line
             app.tau_values[(current_peak_time, current_peak_value)] = tau_fitted
+            set_tau_source(app, (current_peak_time, current_peak_value), 'decay', EXPONENTIAL_MODEL)
             app.decay_calculated[i] = True
 
-            # Update progress
-            if not single_peak:
-                progress = 0.7 + (0.3 * (i + 1) / total_peaks)
-                app.progress_bar.set(progress)
-                app.update()  # Force update GUI
+            progress((i + 1) / total_peaks)
             
             if not no_draw:
                 app.canvas.draw()
         except RuntimeError:
-            messagebox.showwarning(title="Warning", message=f"Decay fitting failed for peak at {current_peak_time}.")
+            instrumentation.count("decay_fit_failures")
+            show_warning(app, f"Decay fitting failed for peak at {current_peak_time}.")
  
         if not no_draw:
-            app.update_table()  # Update table
\ No newline at end of file
+            app.update_table()  # Update table
+    progress.finish()
@@ -1,7 +1,16 @@
+import time
 import numpy as np
-from tkinter import messagebox
-from scipy.optimize import curve_fit
+from core.notifications import show_warning
+from core.instrumentation import get_instrumentation
+from core.progress import NullProgress, get_progress_reporter
 from core.calculate_baseline import calculate_baseline
+from core.kinetic_metrics import rising_crossings
+from core.event_fitting import EXPONENTIAL_MODEL, set_tau_source, tau_source
+from core.edit_history import get_edit_history
+from core.trace_context import get_trace_context
+
+# Fraction of the onset-to-peak amplitude reached after one τ of an exponential rise
+TAU_FRACTION = 1 - np.exp(-1)
 
 def rise_function(t, tau, y0_baseline):
     """
@@ -11,8 +20,30 @@ def rise_function(t, tau, y0_baseline):
     return y0_baseline * np.exp(t / tau)
 
 
-def calculate_rise(app, single_peak=None, no_draw=False):
-    calculate_baseline(app, window_size=int(app.last_baseline_window_size), percentile=float(app.last_baseline_percentage))
+def calculate_rise(app, single_peak=None, no_draw=False, progress=None, recalculate_baseline=True, peaks=None,
+                   outliers=True):
+    """
+    Fit the exponential rise of the marked peaks whose rise is not calculated yet
+
+    Args:
+        app: Main application instance
+        single_peak: Recalculate only this peak
+        no_draw: Skip redrawing the canvas and table
+        progress: Progress callback (defaults to the progress bar)
+        recalculate_baseline: Recalculate the baseline of app.df_f first
+        peaks: Marked peaks a full pass is limited to (all by default)
+        outliers: Replace the outlier taus after a full pass (see process_abnormal_tau_values)
+
+    Returns:
+        bool: False if a full pass stopped at a failed fit
+    """
+    from scipy.optimize import curve_fit
+
+    instrumentation = get_instrumentation(app)
+    # Callers that already hold the baseline of app.df_f (parameter sweeps) skip the recalculation
+    if recalculate_baseline:
+        with instrumentation.stage("rise/baseline"):
+            calculate_baseline(app, window_size=int(app.last_baseline_window_size), percentile=float(app.last_baseline_percentage))
 
     total_peaks = len(app.marked_peaks)
 
@@ -24,55 +55,49 @@ def calculate_rise(app, single_peak=None, no_draw=False):
         peaks_to_process = [(peak_index, single_peak)]
     else:
         peaks_to_process = list(enumerate(app.marked_peaks))
+        if peaks is not None:
+            peaks = set(peaks)
+            peaks_to_process = [(i, peak) for i, peak in peaks_to_process if peak in peaks]
+        # A full pass replaces fits outside the click edits: undoing an older edit would bring
+        # back the replaced fits of its peaks
+        get_edit_history(app).clear()
+
+    # Only full passes report progress, a single peak is recalculated in one step
+    if progress is None:
+        progress = NullProgress() if single_peak else get_progress_reporter(app, start=0.4, span=0.3)
+    # Peaks that never rise are deleted, which shifts the indices of the later peaks
+    removed = 0
 
     peak_onset_window = int(app.last_peak_onset_window) if app.last_peak_onset_window else None
-    peak_values = [peak[1] for peak in app.marked_peaks]
-    mean_peak_value = np.mean(peak_values)
-    baseline_mean = np.mean(app.baseline_values)
-    baseline_std = np.std(app.baseline_values)
-    baseline_lower = baseline_mean - 8 * baseline_std
-    ratio = (mean_peak_value - baseline_mean) / baseline_std
-    if (ratio <= 10):
-        baseline_upper = baseline_mean
-    else:
-        baseline_upper = baseline_mean + 2 * baseline_std
+    # Baseline band, its samples and the local minima are memoized per trace and baseline
+    context = get_trace_context(app)
+    values = context.values()
+    band_samples = context.band_positions('rise')
+    band_minima = context.band_positions('rise', local_minima=True)
+    local_minima = context.local_min_positions()
 
     for i, (peak_time, peak_value) in peaks_to_process:
+        i -= removed
         if app.rise_calculated[i]:
             continue
 
-        peak_index = app.time[app.time == peak_time].index[0]
+        peak_index = context.sample_index(peak_time)
         rise_start_index = None
 
         if rise_start_index is None:
-            prev_peak_time, _ = app.marked_peaks[i - 1] if i > 0 else (None, None)
-            prev_peak_index = app.time[app.time == prev_peak_time].index[0] if prev_peak_time is not None else 0
-            search_start = prev_peak_index if i > 0 else 0
-                
-            # Check if there is any data point between the two peaks that is in the baseline range
-            between_peaks_data = app.df_f[search_start:peak_index]
-            points_near_baseline = np.any((between_peaks_data >= baseline_lower) & (between_peaks_data <= baseline_upper))
-
-            if points_near_baseline: # If there is a data point in this range, find the local minimum
-                # Find the local minimum from the current peak to the previous peak
-                for j in range(peak_index - 1, search_start - 1, -1):
-                    # Check if it is a local minimum
-                    if j > 0 and j < len(app.df_f) - 1:
-                        if app.df_f[j] < app.df_f[j - 1] and app.df_f[j] < app.df_f[j + 1]:
-                            # Check if it is in the baseline range
-                            if baseline_lower <= app.df_f[j] <= baseline_upper:
-                                rise_start_index = j
-                                break
-                
-                # If no suitable local minimum is found, find the first point in the baseline range
-                if rise_start_index is None:
-                    for j in range(peak_index - 1, search_start - 1, -1):
-                        if baseline_lower <= app.df_f[j] <= baseline_upper:
-                            rise_start_index = j
-                            break
-                    # If still not found, use the starting point of the search range
-                    if rise_start_index is None:
-                        rise_start_index = search_start
+            search_start = context.sample_index(app.marked_peaks[i - 1][0]) if i > 0 else 0
+
+            # Samples in the baseline range between the two peaks, and the local minima among them
+            in_band = band_samples[np.searchsorted(band_samples, search_start):np.searchsorted(band_samples, peak_index)]
+
+            if len(in_band): # If there is a data point in this range, find the local minimum
+                # The local minimum in the baseline range closest before the current peak
+                minima = band_minima[np.searchsorted(band_minima, search_start):np.searchsorted(band_minima, peak_index)]
+                if len(minima):
+                    rise_start_index = int(minima[-1])
+                else:
+                    # If no suitable local minimum is found, use the last point in the baseline range
+                    rise_start_index = int(in_band[-1])
             else: # If there is no data point in this range  
                 # Find the lowest point between the two peaks
                 min_index = search_start + np.argmin(app.df_f[search_start:peak_index])
@@ -94,6 +119,8 @@ def calculate_rise(app, single_peak=None, no_draw=False):
                     app.marked_peaks.pop(i)
                     app.decay_calculated.pop(i)
                     app.rise_calculated.pop(i)
+                    app.tau_source.pop((peak_time, peak_value), None)
+                    removed += 1
                     app.canvas.draw()
                     app.update_table()
                     continue
@@ -101,15 +128,11 @@ def calculate_rise(app, single_peak=None, no_draw=False):
         
         if (peak_onset_window is not None):
             # Find all local minima within the window
-            local_mins = []
-            for j in range(peak_index - peak_onset_window + 1, peak_index - 1):
-                if app.df_f[j] < app.df_f[j-1] and app.df_f[j] < app.df_f[j+1]:
-                    local_mins.append(j)
+            local_mins = local_minima[np.searchsorted(local_minima, peak_index - peak_onset_window + 1):np.searchsorted(local_minima, peak_index - 1)]
             
             # If local minima are found, select the index of the smallest value
-            if local_mins:
-                min_values = [app.df_f[idx] for idx in local_mins]
-                rise_start_index = local_mins[np.argmin(min_values)]
+            if len(local_mins):
+                rise_start_index = int(local_mins[np.argmin(values[local_mins])])
             else:
                 # If no local minima are found, use the minimum value point in the window
                 rise_start_index = peak_index - peak_onset_window + np.argmin(app.df_f[peak_index - peak_onset_window:peak_index])
@@ -155,13 +178,17 @@ def calculate_rise(app, single_peak=None, no_draw=False):
             y0_norm = y0 / y_scale
 
             # Fit using normalized data
-            popt, _ = curve_fit(
-                lambda t, tau_norm: rise_function(t * t_scale, tau_norm * t_scale, y0_norm),
-                t_norm,
-                y_data_norm,
-                p0=[0.5],
-                bounds=(0.0001, np.inf)
-            )
+            fit_start = time.perf_counter()
+            try:
+                popt, _ = curve_fit(
+                    lambda t, tau_norm: rise_function(t * t_scale, tau_norm * t_scale, y0_norm),
+                    t_norm,
+                    y_data_norm,
+                    p0=[0.5],
+                    bounds=(0.0001, np.inf)
+                )
+            finally:
+                instrumentation.record_fit("rise", time.perf_counter() - fit_start)
 
             # Convert normalized tau back to real scale
             tau_fitted = popt[0] * t_scale
@@ -243,13 +270,10 @@ def calculate_rise(app, single_peak=None, no_draw=False):
             app.rise_lines.append(rise_line)
             app.rise_line_map[(peak_time, peak_value)] = rise_line
             app.rise_times[(peak_time, peak_value)] = tau_fitted
+            set_tau_source(app, (peak_time, peak_value), 'rise', EXPONENTIAL_MODEL)
             app.rise_calculated[i] = True
             
-            # Update progress
-            if not single_peak:
-                progress = 0.4 + (0.3 * (i + 1) / total_peaks)
-                app.progress_bar.set(progress)
-                app.update()  # Force update GUI
+            progress((i + 1) / total_peaks)
             
             # Only draw immediately when not delaying
             if single_peak and not no_draw:
@@ -258,13 +282,17 @@ def calculate_rise(app, single_peak=None, no_draw=False):
                 
         except (RuntimeError, ValueError) as e:
             # If the fitting fails, display a warning
+            instrumentation.count("rise_fit_failures")
             if single_peak:
-                messagebox.showwarning(title="Warning", message=f"Rise fitting failed for peak at {peak_time}. Error: {str(e)}")
+                show_warning(app, f"Rise fitting failed for peak at {peak_time}. Error: {str(e)}")
             else:
                 return False
+    progress.finish()
 
     if not single_peak:
-        process_abnormal_tau_values(app)
+        if outliers:
+            with instrumentation.stage("rise/outliers"):
+                process_abnormal_tau_values(app)
         app.canvas.draw()
         app.update_table()
     
@@ -273,140 +301,91 @@ def calculate_rise(app, single_peak=None, no_draw=False):
         
     return True
 
+def rise_outlier_limits(taus):
+    """
+    Limits outside which a rise tau is an outlier: two standard deviations around the mean
+    of the taus, None for fewer than 3 taus
+    """
+    if len(taus) < 3:  # Ensure there are enough samples to calculate the standard deviation
+        return None
+    tau_average = np.mean(taus)
+    tau_std = np.std(taus)
+    return tau_average - 2*tau_std, tau_average + 2*tau_std
+
+def outlier_rise_times(time_values, values, starts, stops):
+    """
+    Taus replacing outliers: the 63.2% rise time from the onset, in one pass over all
+    segments, or half the onset-to-peak time where a segment never rises
+
+    Args:
+        time_values, values: Trace
+        starts, stops: Onset and peak indices
+    """
+    starts = np.asarray(starts, dtype=int)
+    stops = np.asarray(stops, dtype=int)
+    crossings = rising_crossings(time_values, values, starts, stops, (TAU_FRACTION,))[:, 0]
+    return np.where(
+        np.isfinite(crossings), crossings - time_values[starts], 0.5 * (time_values[stops] - time_values[starts])
+    )
+
 # Define the function to process abnormal tau values
 def process_abnormal_tau_values(app, single_peak=None):
-    """Process abnormal tau values, use Bezier curve and 63.2% method to recalculate"""
-    # Calculate the average and standard deviation of all valid tau values
-    valid_taus = [tau for tau in app.rise_times.values() if isinstance(tau, (int, float))]
-    if len(valid_taus) < 3:  # Ensure there are enough samples to calculate the standard deviation
+    """Process abnormal tau values, recalculated as the 63.2% rise time of the raw segment"""
+    # Calculate the average and standard deviation of all valid tau values of the exponential
+    # fits; the event model's τ_rise is another quantity and is neither pooled nor replaced
+    peaks = [
+        peak for peak, tau in app.rise_times.items()
+        if isinstance(tau, (int, float)) and tau_source(app, peak, 'rise') == EXPONENTIAL_MODEL
+    ]
+    taus = np.array([app.rise_times[peak] for peak in peaks], dtype=float)
+    limits = rise_outlier_limits(taus)
+    if limits is None:
         return
-        
-    tau_average = np.mean(valid_taus)
-    tau_std = np.std(valid_taus)
-    
+    is_outlier = (taus < limits[0]) | (taus > limits[1])
+
     # Determine the peaks that need to be processed
-    outlier_peaks = []
     if single_peak:
         # Only check if the current peak being processed is abnormal
-        peak_time, peak_value = single_peak
-        tau = app.rise_times.get((peak_time, peak_value))
-        if isinstance(tau, (float, int)) and (tau < tau_average - 2*tau_std or tau > tau_average + 2*tau_std):
-            outlier_peaks.append(single_peak)
+        outlier_peaks = [single_peak] if single_peak in peaks and is_outlier[peaks.index(single_peak)] else []
     else:
-        # Check all peaks
-        for peak, tau in list(app.rise_times.items()):
-            if isinstance(tau, (float, int)) and (tau < tau_average - 2*tau_std or tau > tau_average + 2*tau_std):
-                outlier_peaks.append(peak)
-    
-    # Process each abnormal peak
-    for peak in outlier_peaks:
-        peak_time, peak_value = peak
-        
-        try:
-            # Find the corresponding index
-            i = app.marked_peaks.index(peak)
-            peak_index = app.time[app.time == peak_time].index[0]
-            
-            # Find the rise start point of this peak
-            rise_marker = app.rise_start_markers.get(peak)
-            if rise_marker:
-                rise_x_data = rise_marker.get_xdata()[0]
-                rise_start_index = app.time[app.time == rise_x_data].index[0]
-                
-                # Delete the existing fitting line
-                if peak in app.rise_line_map:
-                    existing_line = app.rise_line_map[peak]
-                    if existing_line in app.rise_lines:
-                        app.rise_lines.remove(existing_line)
-                    existing_line.remove()
-                    app.rise_line_map.pop(peak)
-                    
-                # Prepare data
-                t_data = app.time[rise_start_index:peak_index + 1].values
-                y_data = app.df_f[rise_start_index:peak_index + 1].values
-                
-                # Use Bezier curve to connect onset and peak
-                def bezier_curve_multi(points, num=100):
-                    """Create a multi-point Bezier curve"""
-                    n = len(points) - 1
-                    t = np.linspace(0, 1, num)
-                    curve_x = np.zeros(num)
-                    curve_y = np.zeros(num)
-                    
-                    for i, point in enumerate(points):
-                        # Calculate the Bernstein polynomial
-                        binomial = np.math.comb(n, i)
-                        curve_x += binomial * (1-t)**(n-i) * t**i * point[0]
-                        curve_y += binomial * (1-t)**(n-i) * t**i * point[1]
-                    
-                    return curve_x, curve_y
-
-                # Create control points
-                control_points = []
-                # Add the starting point
-                control_points.append((t_data[0], y_data[0]))
+        outlier_peaks = [peak for peak, outlier in zip(peaks, is_outlier) if outlier]
+    # Outliers without a rise start marker cannot be reprocessed
+    outlier_peaks = [peak for peak in outlier_peaks if app.rise_start_markers.get(peak)]
 
-                # Add control points between data points
-                if len(t_data) > 2:
-                    # Take several key points as control points
-                    sample_indices = np.linspace(1, len(t_data) - 2, min(5, len(t_data) - 2)).astype(int)
-                    for idx in sample_indices:
-                        control_points.append((t_data[idx], y_data[idx]))
+    get_instrumentation(app).count("rise_outliers_reprocessed", len(outlier_peaks))
+    if not outlier_peaks:
+        return
 
-                # Add the ending point
-                control_points.append((t_data[-1], y_data[-1]))
+    # Onset and peak indices of all outliers
+    time_values = app.time.values
+    values = app.df_f.values
+    onset_times = [app.rise_start_markers[peak].get_xdata()[0] for peak in outlier_peaks]
+    starts = np.searchsorted(time_values, onset_times)
+    stops = np.searchsorted(time_values, [peak[0] for peak in outlier_peaks])
+
+    new_taus = outlier_rise_times(time_values, values, starts, stops)
+
+    for peak, start, stop, tau_new in zip(outlier_peaks, starts, stops, new_taus):
+        # Delete the existing fitting line
+        if peak in app.rise_line_map:
+            existing_line = app.rise_line_map.pop(peak)
+            if existing_line in app.rise_lines:
+                app.rise_lines.remove(existing_line)
+            existing_line.remove()
+
+        # Draw the monotone envelope the crossing was measured on
+        new_line, = app.ax.plot(
+            time_values[start:stop + 1],
+            np.maximum.accumulate(values[start:stop + 1]),
+            color='#00FF00',
+            linestyle='--'
+        )
+
+        # Update the application state
+        app.rise_lines.append(new_line)
+        app.rise_line_map[peak] = new_line
+        app.rise_times[peak] = tau_new
 
-                # Generate the Bezier curve
-                t_smooth, y_smooth = bezier_curve_multi(control_points, num=100)
-                
-                # Calculate the new tau value: use the 63.2% rise time method
-                y0 = y_data[0]
-                y_peak = y_data[-1]
-                # Calculate the y value of the 63.2% point
-                y63 = y0 + 0.632 * (y_peak - y0)
-                
-                # Find the first point on the smoothed Bezier curve that is greater than or equal to y63
-                target_indices = np.where(y_smooth >= y63)[0]
-                if len(target_indices) > 0:
-                    target_idx = target_indices[0]
-                    
-                    # If it is not the first point and needs more accurate interpolation
-                    if target_idx > 0:
-                        # Find the two points before and after y63
-                        t_before, y_before = t_smooth[target_idx-1], y_smooth[target_idx-1]
-                        t_after, y_after = t_smooth[target_idx], y_smooth[target_idx]
-                        
-                        # Linear interpolation to find a more accurate t63
-                        if y_after != y_before:  # Avoid division by zero
-                            fraction = (y63 - y_before) / (y_after - y_before)
-                            t63 = t_before + fraction * (t_after - t_before)
-                        else:
-                            t63 = t_after
-                    else:
-                        t63 = t_smooth[target_idx]
-                        
-                    tau_new = t63 - t_data[0]
-                else:
-                    # If no suitable point is found, use the default value
-                    tau_new = 0.5 * (t_data[-1] - t_data[0])
-                
-                # Draw the new fitting curve
-                new_line, = app.ax.plot(
-                    t_smooth, 
-                    y_smooth, 
-                    color='#00FF00', 
-                    linestyle='--'
-                )
-                
-                # Update the application state
-                app.rise_lines.append(new_line)
-                app.rise_line_map[(peak_time, peak_value)] = new_line
-                app.rise_times[(peak_time, peak_value)] = tau_new
-                
-        except (ValueError, IndexError) as e:
-            print(f"Error reprocessing peak {peak}: {e}")
-            continue
-    
     # Update the canvas and table (only needed in single_peak mode)
     if single_peak:
         app.canvas.draw()
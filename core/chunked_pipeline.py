@@ -0,0 +1,508 @@
+"""
+Out-of-core analysis of traces larger than memory
+
+The trace is read in blocks and analysed chunk by chunk: baseline and ΔF/F, peak detection,
+event fits and the model-free metrics, i.e. Load File, Detect Peaks with the event model and
+the table, without ever holding the whole recording. Each chunk is processed together with
+enough samples on both sides for every stage to see what it would see in the whole trace;
+a peak belongs to the chunk whose core contains it, so seams are never counted twice.
+What depends on the whole trace is collected in streaming passes of its own: the baseline
+and peak statistics the baseline bands are set from before the chunks are fitted, and the
+rise outlier limits of the separate fits after them.
+"""
+import csv
+import numpy as np
+from core.calculate_baseline import rolling_baseline
+from core.apply_threshold import find_threshold_peaks
+from core.calculate_rise import outlier_rise_times
+from core.event_fitting import band_statistics, decay_band_samples, fit_events, fit_separately, peak_amplitude
+from core.kinetic_metrics import compute_kinetic_metrics, MAX_EDGE_SAMPLES
+from core.progress import NullProgress, ThrottledProgress
+from core.signal_conversion import normalize_to_baseline
+from core.trace_context import merge_moments, moments_stats, sample_moments
+
+DEFAULT_CHUNK_SAMPLES = 1_000_000
+
+# Share of the progress of run_chunked_pipeline taken by the band statistics pass
+STATISTICS_PROGRESS = 0.25
+
+def chunk_overlap(pre_samples, post_samples, min_distance=None, width=None):
+    """
+    Samples processed on each side of a chunk core for its peaks to match the whole-trace run
+
+    The fits of a peak read pre_samples before and post_samples after it and the metrics up
+    to MAX_EDGE_SAMPLES on each side, both bounded by the neighbouring peaks, which must be
+    detected as in the whole trace: the detection itself is kept several distances and widths
+    away from the edges. The two rolling baselines (raw signal, then ΔF/F) need another two
+    windows before the chunk, which iter_chunk_results adds.
+
+    Returns:
+        int: Overlap in samples
+    """
+    event_samples = max(int(pre_samples) + int(post_samples), MAX_EDGE_SAMPLES)
+    detection_margin = 8 * max(int(min_distance or 1), int(width or 1), 1)
+    return event_samples + detection_margin
+
+def trace_statistics(blocks):
+    """
+    Number of samples and mean signal of a trace, in one pass over its blocks
+
+    Load File converts to ΔF/F only when the mean signal is above 3, and the table reads
+    the signal as ΔF/F when it is between 0 and 3; both need the mean before the first chunk.
+
+    Returns:
+        tuple: (n_samples, mean)
+    """
+    n_samples, total = 0, 0.0
+    for _, signal_values in blocks:
+        n_samples += len(signal_values)
+        total += float(np.sum(signal_values))
+    return n_samples, (total / n_samples if n_samples else np.nan)
+
+class ChunkedTraceReader:
+    """
+    Rolling window over the blocks of a trace: keeps only the samples from a given index on
+    and reads ahead as far as asked, so memory is bounded by the chunk and overlap sizes
+    """
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self.start = 0
+        self.time = np.empty(0)
+        self.signal = np.empty(0)
+
+    def read_until(self, stop):
+        """
+        Read blocks until sample stop - 1 is buffered or the trace ends
+        """
+        time_parts, signal_parts = [self.time], [self.signal]
+        available = self.start + len(self.signal)
+        while available < stop:
+            try:
+                time_values, signal_values = next(self._blocks)
+            except StopIteration:
+                break
+            time_parts.append(time_values)
+            signal_parts.append(signal_values)
+            available += len(signal_values)
+        if len(signal_parts) > 1:
+            self.time = np.concatenate(time_parts)
+            self.signal = np.concatenate(signal_parts)
+
+    def get(self, start, stop):
+        return self.time[start - self.start:stop - self.start], self.signal[start - self.start:stop - self.start]
+
+    def discard_before(self, index):
+        if index > self.start:
+            drop = index - self.start
+            self.time = self.time[drop:].copy()
+            self.signal = self.signal[drop:].copy()
+            self.start = index
+
+def _fill_baseline(baseline, valid_from):
+    """
+    Non-finite baselines (NaN samples in the window) take the mean of the valid part, like
+    calculate_baseline does with the whole trace
+    """
+    valid = baseline[valid_from:]
+    if not np.isfinite(valid).all():
+        mean_baseline = np.nanmean(valid)
+        baseline[valid_from:] = np.nan_to_num(valid, nan=mean_baseline, posinf=mean_baseline, neginf=mean_baseline)
+    return baseline
+
+def _segments(blocks, n_samples, history, overlap, chunk_samples, progress):
+    """
+    Segments of the trace around each chunk core, read through a ChunkedTraceReader
+
+    Yields:
+        tuple: (time_values, signal_values, segment_start, core_start, core_stop), stop exclusive
+    """
+    reader = ChunkedTraceReader(blocks)
+    core_start = 0
+    while core_start < n_samples:
+        core_stop = min(core_start + int(chunk_samples), n_samples)
+        segment_start = max(0, core_start - history)
+        segment_stop = min(core_stop + overlap, n_samples)
+        reader.read_until(segment_stop)
+
+        yield reader.get(segment_start, segment_stop) + (segment_start, core_start, core_stop)
+        progress(core_stop / n_samples)
+
+        core_start = core_stop
+        reader.discard_before(max(0, core_start - history))
+    progress.finish()
+
+def _detect_segment(signal_values, at_start, convert, baseline_window, baseline_percentile, peak_threshold,
+                    min_distance=None, width=None):
+    """
+    Baselines, ΔF/F and peaks of a segment, as Load File and Detect Peaks give them
+
+    Returns:
+        tuple: (first valid sample, raw baseline, ΔF/F, ΔF/F baseline, peak indices from the
+                first valid sample on)
+    """
+    w = int(baseline_window)
+    # Samples before this index have no complete baseline window (1 or 2 windows back)
+    raw_valid = 0 if at_start else w
+    valid = 0 if at_start else 2 * w
+
+    raw_baseline = _fill_baseline(rolling_baseline(signal_values, w, baseline_percentile, from_start=at_start), raw_valid)
+    df_f = signal_values.copy()
+    if convert:
+        normalize_to_baseline(signal_values[raw_valid:], raw_baseline[raw_valid:], out=df_f[raw_valid:])
+    # The fits and metrics use the baseline of the ΔF/F trace, as calculate_event_kinetics does
+    df_f_baseline = np.full(len(df_f), np.nan)
+    df_f_baseline[raw_valid:] = rolling_baseline(df_f[raw_valid:], w, baseline_percentile, from_start=at_start)
+    _fill_baseline(df_f_baseline, valid)
+
+    peaks = find_threshold_peaks(df_f[valid:], peak_threshold, min_distance, width)
+    return valid, raw_baseline, df_f, df_f_baseline, peaks
+
+def trace_band_statistics(blocks, n_samples, convert, baseline_window, baseline_percentile, peak_threshold,
+                          min_distance=None, width=None, pre_samples=50, post_samples=200,
+                          chunk_samples=DEFAULT_CHUNK_SAMPLES, progress=None):
+    """
+    Statistics the baseline bands of the whole trace are set from, in one pass over the
+    chunks without fits: the mean and standard deviation of the ΔF/F baseline and the mean
+    ΔF/F of the peaks, as TraceContext.band_limits takes them from a loaded trace
+
+    Args:
+        blocks, n_samples, convert, chunk_samples, progress: As in iter_chunk_results
+        Remaining args: Analysis parameters, as in process_segment
+
+    Returns:
+        tuple: (baseline mean, baseline standard deviation, mean peak value), see band_statistics
+    """
+    overlap = chunk_overlap(pre_samples, post_samples, min_distance, width)
+    history = overlap + 2 * int(baseline_window)
+    moments = (0, 0.0, 0.0)
+    peak_total, n_peaks = 0.0, 0
+    for _, signal_values, segment_start, core_start, core_stop in _segments(
+        blocks, n_samples, history, overlap, chunk_samples, progress or NullProgress()
+    ):
+        valid, _, df_f, df_f_baseline, peaks = _detect_segment(
+            signal_values, segment_start == 0, convert, baseline_window, baseline_percentile,
+            peak_threshold, min_distance, width
+        )
+        # Every sample and peak counts once, in the chunk whose core holds it
+        moments = merge_moments(moments, sample_moments(df_f_baseline[core_start - segment_start:core_stop - segment_start]))
+        peaks = peaks + valid
+        core_peaks = peaks[(peaks + segment_start >= core_start) & (peaks + segment_start < core_stop)]
+        peak_total += float(np.sum(df_f[core_peaks], dtype=np.float64))
+        n_peaks += len(core_peaks)
+    return moments_stats(moments) + (peak_total / n_peaks if n_peaks else np.nan,)
+
+def process_segment(time_values, signal_values, offset, core_start, core_stop, at_start, convert,
+                    baseline_window, baseline_percentile, peak_threshold, min_distance=None, width=None,
+                    pre_samples=50, post_samples=200, statistics=None):
+    """
+    Analyse the peaks of one chunk core from a segment of the trace around it
+
+    The rise outlier pass of the separate fits needs the taus of the whole trace, so the
+    separate fits are returned as fitted, with the tau replacing each if it is an outlier.
+
+    Args:
+        time_values: Sample times of the segment
+        signal_values: Raw signal of the segment
+        offset: Index of the first segment sample in the trace
+        core_start, core_stop: Trace indices of the chunk core, stop exclusive
+        at_start: Whether the segment starts at the beginning of the trace
+        convert: Whether the signal is converted to ΔF/F
+        statistics: Band statistics of the whole trace (see trace_band_statistics), those of
+                    the segment by default
+        Remaining args: Analysis parameters, as in the dialogs
+
+    Returns:
+        dict: Per-peak arrays of the core peaks: 'index' (in the trace), 'time', 'value' (ΔF/F),
+              'raw', 'raw_baseline', 'tau_rise', 'tau_decay' (NaN where the fits failed),
+              'amplitude' (NaN where the event model failed), 'fallback' (the event model failed
+              and the rise and decay were fitted separately), 'outlier_tau_rise' (the tau
+              replacing a separate rise fit that is an outlier, NaN elsewhere) and 'metrics'
+              (n_peaks, 4); and 'removed', the number of core peaks the separate rise fits
+              removed because they never rise, as calculate_rise does
+    """
+    valid, raw_baseline, df_f, df_f_baseline, peaks = _detect_segment(
+        signal_values, at_start, convert, baseline_window, baseline_percentile, peak_threshold, min_distance, width
+    )
+    time_values = time_values[valid:]
+    values = df_f[valid:]
+    baseline_values = df_f_baseline[valid:]
+    first = offset + valid
+    in_core = (peaks + first >= core_start) & (peaks + first < core_stop)
+    core = np.flatnonzero(in_core)
+
+    if statistics is None and len(peaks):
+        statistics = band_statistics(values, baseline_values, peaks)
+    result = fit_events(
+        time_values, values, peaks, pre_samples=pre_samples, post_samples=post_samples, subset=core,
+        band_samples=decay_band_samples(values, baseline_values, peaks, statistics)
+    )
+    ok = result['converged'] & np.isfinite(result['tau_rise']) & np.isfinite(result['tau_decay'])
+    tau_rise = np.where(ok, result['tau_rise'], np.nan)
+    tau_decay = np.where(ok, result['tau_decay'], np.nan)
+    with np.errstate(invalid='ignore'):
+        amplitude = np.where(ok, peak_amplitude(result['amplitude'], result['tau_rise'], result['tau_decay']), np.nan)
+    onset = np.where(ok, result['onset'], np.nan)
+
+    # Core events the model does not converge for get the separate fits, as in calculate_event_kinetics
+    fallback = np.zeros(len(peaks), dtype=bool)
+    fallback[core[~ok[core]]] = True
+    keep = np.ones(len(peaks), dtype=bool)
+    outlier_tau_rise = np.full(len(peaks), np.nan)
+    if fallback.any():
+        failed = np.flatnonzero(fallback)
+        tau_rise[failed], tau_decay[failed], onset[failed], removed = fit_separately(
+            time_values, values, baseline_values, peaks, failed, pre_samples, statistics, outliers=False
+        )
+        keep[failed[removed]] = False
+        rising = failed[~removed & np.isfinite(tau_rise[failed])]
+        if len(rising):
+            outlier_tau_rise[rising] = outlier_rise_times(
+                time_values, values, np.searchsorted(time_values, onset[rising]), peaks[rising]
+            )
+
+    # Metrics start at the fitted onsets, like peak_metrics with the drawn onset markers; the
+    # removed peaks no longer bound the metrics of their neighbours
+    onsets = np.where(np.isfinite(onset), np.searchsorted(time_values, np.nan_to_num(onset)), -1)
+    metrics = compute_kinetic_metrics(time_values, values, baseline_values, peaks[keep], onsets[keep])
+
+    selected = in_core & keep
+    core_peaks = peaks[selected]
+    return {
+        'index': core_peaks + first,
+        'time': time_values[core_peaks],
+        'value': values[core_peaks],
+        'raw': signal_values[valid:][core_peaks],
+        'raw_baseline': raw_baseline[valid:][core_peaks],
+        'tau_rise': tau_rise[selected],
+        'tau_decay': tau_decay[selected],
+        'amplitude': amplitude[selected],
+        'fallback': fallback[selected],
+        'outlier_tau_rise': outlier_tau_rise[selected],
+        'metrics': metrics[in_core[keep]],
+        'removed': int(np.sum(in_core & ~keep)),
+    }
+
+def iter_chunk_results(blocks, n_samples, convert, baseline_window, baseline_percentile, peak_threshold,
+                       min_distance=None, width=None, pre_samples=50, post_samples=200,
+                       chunk_samples=DEFAULT_CHUNK_SAMPLES, progress=None, statistics=None):
+    """
+    Analyse a trace chunk by chunk
+
+    Args:
+        blocks: Iterable of (time_values, signal_values) blocks, e.g. from iter_trace_blocks
+        n_samples: Number of samples of the trace (see trace_statistics)
+        convert: Whether the signal is converted to ΔF/F
+        chunk_samples: Samples of each chunk core
+        progress: Optional callback receiving the fraction of the trace analysed
+        statistics: Band statistics of the whole trace, see trace_band_statistics
+        Remaining args: Analysis parameters, as in process_segment
+
+    Yields:
+        dict: Results of the peaks of each chunk, see process_segment
+    """
+    overlap = chunk_overlap(pre_samples, post_samples, min_distance, width)
+    history = overlap + 2 * int(baseline_window)
+    for time_values, signal_values, segment_start, core_start, core_stop in _segments(
+        blocks, n_samples, history, overlap, chunk_samples, progress or NullProgress()
+    ):
+        yield process_segment(
+            time_values, signal_values, segment_start, core_start, core_stop, segment_start == 0, convert,
+            baseline_window, baseline_percentile, peak_threshold, min_distance, width, pre_samples, post_samples,
+            statistics
+        )
+
+def chunk_table_rows(chunk, df_f_table):
+    """
+    Table rows of the peaks of one chunk, formatted like build_table_rows (mini mode)
+
+    Args:
+        chunk: Results of one chunk from iter_chunk_results
+        df_f_table: Whether the ΔF/F column is the trace value (app.convert_to_df_f)
+    """
+    from core.event_fitting import EVENT_MODEL, EXPONENTIAL_MODEL
+    from utils.table_operations_utils import format_table_row, peak_delta_f_f
+
+    rows = []
+    for i in range(len(chunk['index'])):
+        raw_value = float(chunk['raw'][i])
+        raw_baseline = float(chunk['raw_baseline'][i])
+        delta_f_f = peak_delta_f_f(float(chunk['value'][i]), raw_value, raw_baseline, df_f_table)
+        rise_time = float(chunk['tau_rise'][i]) if np.isfinite(chunk['tau_rise'][i]) else "N/A"
+        decay_time = float(chunk['tau_decay'][i]) if np.isfinite(chunk['tau_decay'][i]) else "N/A"
+        if (rise_time, decay_time) == ("N/A", "N/A"):
+            model = "N/A"
+        else:
+            model = EXPONENTIAL_MODEL if chunk['fallback'][i] else EVENT_MODEL
+        rows.append(format_table_row(chunk['time'][i], delta_f_f, rise_time, decay_time, model, raw_value, raw_baseline, chunk['metrics'][i]))
+    return rows
+
+def _replace_rise_outliers(rows_path, output_path, replacements):
+    """
+    Copy the table rows to the output file, with the τ (rise) of some rows replaced
+
+    Args:
+        replacements: Row number (0 for the first peak) -> new τ (rise)
+    """
+    from utils.table_operations_utils import TABLE_COLUMNS
+
+    column = TABLE_COLUMNS.index("τ (rise)")
+    with open(rows_path, newline='', encoding='utf-8') as source, \
+            open(output_path, 'w', newline='', encoding='utf-8') as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target)
+        writer.writerow(next(reader))
+        for i, row in enumerate(reader):
+            if i in replacements:
+                row[column] = f"{replacements[i]:.6f}"
+            writer.writerow(row)
+
+def run_chunked_pipeline(file_path, output_path, x_col=None, y_col=None, sheet_name=None, convert_to_df_f=True,
+                         baseline_window=50, baseline_percentile=30, peak_threshold=0.1, min_distance=None,
+                         width=None, pre_samples=50, chunk_samples=DEFAULT_CHUNK_SAMPLES, progress=None):
+    """
+    Analyse a trace file chunk by chunk and write the peak table to a CSV file as it goes
+
+    The results are those of loading the file, detecting peaks with the event model and
+    reading the table, with post_samples = 4 · pre_samples as in calculate_event_kinetics.
+    A first pass over the chunks collects the band statistics of the whole trace. The rows
+    are then written to a temporary file next to the output, and the rise outliers among
+    the separate fits, judged against all of them, are replaced while it is copied over;
+    only the taus of the separate fits are kept in memory for that.
+
+    Args:
+        file_path: Trace file (.xlsx, .csv or .npy), see iter_trace_blocks
+        output_path: CSV file receiving one row of TABLE_COLUMNS per peak
+        convert_to_df_f: Convert to ΔF/F (when the mean signal is above 3, as Load File does)
+        chunk_samples: Samples of each chunk core; memory grows with it, not with the trace
+        progress: Optional callback receiving the fraction of the trace analysed
+        Remaining args: Column selection and analysis parameters
+
+    Returns:
+        tuple: (number of peaks written, number of detected peaks the event model did not
+                converge for)
+    """
+    import os
+    import tempfile
+    from core.calculate_rise import rise_outlier_limits
+    from utils.file_utils import iter_trace_blocks
+    from utils.table_operations_utils import TABLE_COLUMNS
+
+    def blocks():
+        return iter_trace_blocks(file_path, x_col, y_col, sheet_name, block_samples=max(int(chunk_samples) // 4, 1))
+
+    progress = progress or NullProgress()
+    n_samples, mean_signal = trace_statistics(blocks())
+    convert = bool(convert_to_df_f) and mean_signal > 3
+    df_f_table = bool(convert_to_df_f) or 0 <= mean_signal <= 3
+    parameters = (
+        convert, baseline_window, baseline_percentile, peak_threshold,
+        min_distance, width, int(pre_samples), 4 * int(pre_samples), chunk_samples
+    )
+
+    statistics = trace_band_statistics(
+        blocks(), n_samples, *parameters, progress=ThrottledProgress(progress, 0.0, STATISTICS_PROGRESS)
+    )
+
+    n_peaks = n_fallbacks = 0
+    # Row number, tau and outlier replacement of every separate rise fit
+    separate_rows, separate_taus, outlier_taus = [], [], []
+    handle, rows_path = tempfile.mkstemp(suffix='.csv', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        with os.fdopen(handle, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TABLE_COLUMNS)
+            for chunk in iter_chunk_results(
+                blocks(), n_samples, *parameters,
+                progress=ThrottledProgress(progress, STATISTICS_PROGRESS, 1 - STATISTICS_PROGRESS), statistics=statistics
+            ):
+                writer.writerows(chunk_table_rows(chunk, df_f_table))
+                separate = np.flatnonzero(np.isfinite(chunk['outlier_tau_rise']))
+                separate_rows.append(n_peaks + separate)
+                separate_taus.append(chunk['tau_rise'][separate])
+                outlier_taus.append(chunk['outlier_tau_rise'][separate])
+                n_peaks += len(chunk['index'])
+                n_fallbacks += int(chunk['fallback'].sum()) + chunk['removed']
+
+        taus = np.concatenate(separate_taus) if separate_taus else np.empty(0)
+        limits = rise_outlier_limits(taus)
+        if limits is None:
+            os.replace(rows_path, output_path)
+        else:
+            is_outlier = (taus < limits[0]) | (taus > limits[1])
+            rows = np.concatenate(separate_rows)[is_outlier]
+            _replace_rise_outliers(rows_path, output_path, dict(zip(rows.tolist(), np.concatenate(outlier_taus)[is_outlier])))
+    finally:
+        if os.path.exists(rows_path):
+            os.remove(rows_path)
+    progress.finish()
+    return n_peaks, n_fallbacks
+
+def analyze_large_file(app):
+    """
+    Ask for the settings, a trace file and an output file, then analyse the trace chunk by chunk
+    without loading it; the loaded session is left untouched
+
+    Args:
+        app: Main application instance
+    """
+    from tkinter import filedialog, messagebox
+    from core.instrumentation import get_instrumentation
+    from core.progress import get_progress_reporter
+    from ui.dialogs import LargeFileDialog
+
+    dialog = LargeFileDialog(
+        app,
+        sheet_name=app.last_sheet_name,
+        x_col=app.last_x_col,
+        y_col=app.last_y_col,
+        baseline_window_size=app.last_baseline_window_size or "50",
+        baseline_percentage=app.last_baseline_percentage or "30",
+        peak_threshold=app.last_peak_threshold,
+        min_distance=app.last_min_distance,
+        width=app.last_width,
+        peak_onset_window=app.last_peak_onset_window,
+        chunk_samples=app.last_chunk_samples
+    )
+    app.wait_window(dialog)
+    if dialog.user_cancelled:
+        return
+
+    file_path = filedialog.askopenfilename(filetypes=[("Trace files", "*.xlsx *.csv *.npy"), ("All files", "*.*")])
+    if not file_path:
+        return
+    output_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+    if not output_path:
+        return
+
+    app.last_chunk_samples = dialog.chunk_samples
+
+    instrumentation = get_instrumentation(app)
+    progress = get_progress_reporter(app)
+    try:
+        with instrumentation.stage("chunked_pipeline"):
+            n_peaks, n_fallbacks = run_chunked_pipeline(
+                file_path, output_path,
+                x_col=dialog.x_col or None,
+                y_col=dialog.y_col or None,
+                sheet_name=dialog.sheet_name or None,
+                convert_to_df_f=dialog.convert_to_df_f == "on",
+                baseline_window=int(dialog.baseline_window_size),
+                baseline_percentile=float(dialog.baseline_percentage),
+                peak_threshold=float(dialog.peak_threshold),
+                min_distance=float(dialog.min_distance) if dialog.min_distance else None,
+                width=float(dialog.width) if dialog.width else None,
+                pre_samples=int(dialog.peak_onset_window) if dialog.peak_onset_window else 50,
+                chunk_samples=int(dialog.chunk_samples),
+                progress=progress
+            )
+    except (OSError, ValueError) as e:
+        messagebox.showerror(title="Error", message=f"Analyzing the file failed: {str(e)}")
+        return
+    finally:
+        app.after(500, lambda: app.progress_bar.set(0))
+    instrumentation.count("peaks_detected", n_peaks)
+    instrumentation.count("event_fit_fallbacks", n_fallbacks)
+    message = f"{n_peaks} peaks written to {output_path}."
+    if n_fallbacks:
+        message += f"\n\nThe event model did not converge for {n_fallbacks} peaks. Their rise and decay were fitted separately."
+    messagebox.showinfo(title="Analyze Large File", message=message)
@@ -0,0 +1,201 @@
+"""
+Undo/redo of manual peak edits
+
+Every click edit is stored as the state of the few peaks it touched, before and after: the
+edited peak and the neighbours whose rise or decay was refitted. Undoing restores those
+states, fit results and curves included, so nothing is refitted and one step only costs
+the data of about three peaks. Full passes of the rise, decay and event fits refit peaks
+outside the edits and clear the history.
+"""
+import bisect
+from collections import deque
+
+# Number of edits that can be undone
+MAX_HISTORY = 200
+
+def snapshot_peak(app, peak):
+    """
+    State of one marked peak: calculated flags, fit results and the data of its artists
+
+    Args:
+        app: Main application instance
+        peak: (time, value) of a marked peak
+
+    Returns:
+        dict: Snapshot that restore_peak can apply
+    """
+    i = app.marked_peaks.index(peak)
+
+    def line_data(line):
+        return None if line is None else (line.get_xdata().copy(), line.get_ydata().copy())
+
+    return {
+        'peak': peak,
+        'rise_calculated': app.rise_calculated[i],
+        'decay_calculated': app.decay_calculated[i],
+        'rise_time': app.rise_times.get(peak),
+        'tau': app.tau_values.get(peak),
+        'amplitude': app.amplitudes.get(peak),
+        'tau_source': dict(app.tau_source.get(peak, {})),
+        'onset': line_data(app.rise_start_markers.get(peak)),
+        'rise_line': line_data(app.rise_line_map.get(peak)),
+        'decay_line': line_data(app.decay_line_map.get(peak)),
+    }
+
+def snapshot_peaks(app, peaks):
+    """
+    Snapshots of the given peaks that are currently marked
+    """
+    return [snapshot_peak(app, peak) for peak in peaks if peak is not None and peak in app.marked_peaks]
+
+def neighbour_peaks(app, peak_time):
+    """
+    Marked peaks right before and right after a time (None where there is none)
+    """
+    # (t,) sorts before and (t, inf) after every (t, value), so the tuples are bisected by time
+    left = bisect.bisect_left(app.marked_peaks, (peak_time,))
+    right = bisect.bisect_right(app.marked_peaks, (peak_time, float('inf')))
+    previous = app.marked_peaks[left - 1] if left > 0 else None
+    following = app.marked_peaks[right] if right < len(app.marked_peaks) else None
+    return previous, following
+
+def _pop_result(results, peak):
+    results.pop(peak, None)
+
+def _remove_artist(artist, artists=None):
+    if artists is not None and artist in artists:
+        artists.remove(artist)
+    if artist.axes is not None:
+        artist.remove()
+
+def remove_peak_state(app, peak, unmark=False):
+    """
+    Remove the fit results and curves of a peak, and the peak itself with unmark
+    """
+    if peak in app.rise_line_map:
+        _remove_artist(app.rise_line_map.pop(peak), app.rise_lines)
+    if peak in app.decay_line_map:
+        _remove_artist(app.decay_line_map.pop(peak), app.decay_lines)
+    if peak in app.rise_start_markers:
+        _remove_artist(app.rise_start_markers.pop(peak))
+    for results in (app.rise_times, app.tau_values, app.amplitudes, app.tau_source):
+        _pop_result(results, peak)
+
+    if unmark:
+        i = app.marked_peaks.index(peak)
+        _remove_artist(app.points.pop(i))
+        app.marked_peaks.pop(i)
+        app.rise_calculated.pop(i)
+        app.decay_calculated.pop(i)
+
+def restore_peak(app, snapshot):
+    """
+    Apply a snapshot: mark the peak if needed, then restore its results and redraw its curves
+    """
+    peak = snapshot['peak']
+    if peak not in app.marked_peaks:
+        i = bisect.bisect_left(app.marked_peaks, (peak[0],))
+        app.marked_peaks.insert(i, peak)
+        app.points.insert(i, app.ax.plot(peak[0], peak[1], 'ro')[0])
+        app.rise_calculated.insert(i, False)
+        app.decay_calculated.insert(i, False)
+    else:
+        remove_peak_state(app, peak)
+    i = app.marked_peaks.index(peak)
+    app.rise_calculated[i] = snapshot['rise_calculated']
+    app.decay_calculated[i] = snapshot['decay_calculated']
+
+    for results, key in ((app.rise_times, 'rise_time'), (app.tau_values, 'tau'), (app.amplitudes, 'amplitude')):
+        if snapshot[key] is not None:
+            results[peak] = snapshot[key]
+    if snapshot['tau_source']:
+        app.tau_source[peak] = dict(snapshot['tau_source'])
+
+    if snapshot['onset'] is not None:
+        app.rise_start_markers[peak] = app.ax.plot(*snapshot['onset'], 'gx')[0]
+    if snapshot['rise_line'] is not None:
+        line, = app.ax.plot(*snapshot['rise_line'], color='#00FF00', linestyle='--')
+        app.rise_lines.append(line)
+        app.rise_line_map[peak] = line
+    if snapshot['decay_line'] is not None:
+        line, = app.ax.plot(*snapshot['decay_line'], color='#FF00FF', linestyle='--')
+        app.decay_lines.append(line)
+        app.decay_line_map[peak] = line
+
+class EditHistory:
+    """
+    Bounded undo and redo stacks of peak edits, each edit being (label, before, after)
+    snapshot lists of the peaks it touched
+    """
+    def __init__(self, max_steps=MAX_HISTORY):
+        self.undo_stack = deque(maxlen=max_steps)
+        self.redo_stack = []
+
+    def push(self, label, before, after):
+        self.undo_stack.append((label, before, after))
+        self.redo_stack.clear()
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+def _apply_states(app, current, target):
+    """
+    Replace the states of the current snapshots' peaks by the target snapshots
+    """
+    target_peaks = {snapshot['peak'] for snapshot in target}
+    for snapshot in current:
+        if snapshot['peak'] in app.marked_peaks:
+            remove_peak_state(app, snapshot['peak'], unmark=snapshot['peak'] not in target_peaks)
+    for snapshot in target:
+        restore_peak(app, snapshot)
+    app.canvas.draw()
+    app.update_table()
+
+def get_edit_history(app):
+    history = getattr(app, 'edit_history', None)
+    if history is None:
+        history = app.edit_history = EditHistory()
+    return history
+
+def undo_edit(app):
+    """
+    Revert the last peak edit
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        str: Label of the reverted edit, None when there was nothing to undo
+    """
+    history = get_edit_history(app)
+    if not history.can_undo():
+        return None
+    label, before, after = history.undo_stack.pop()
+    _apply_states(app, after, before)
+    history.redo_stack.append((label, before, after))
+    return label
+
+def redo_edit(app):
+    """
+    Apply the last undone peak edit again
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        str: Label of the edit, None when there was nothing to redo
+    """
+    history = get_edit_history(app)
+    if not history.can_redo():
+        return None
+    label, before, after = history.redo_stack.pop()
+    _apply_states(app, before, after)
+    history.undo_stack.append((label, before, after))
+    return label
@@ -0,0 +1,540 @@
+"""
+Full-event kinetic model fitted to all events at once
+
+Each event is y(t) = b + A·(1 - e^{-(t-t0)/τ_rise})·e^{-(t-t0)/τ_decay} for t > t0 and b before,
+so onset, amplitude, rise and decay are fitted together instead of the separate rise and
+decay exponentials. Events are fitted in batches with a vectorized Levenberg-Marquardt
+using the analytic Jacobian of the model, on windows that end where the decay is back in
+the baseline band as with calculate_decay. Events the model cannot fit fall back to the
+separate rise and decay fits.
+"""
+import time
+import numpy as np
+from core.edit_history import get_edit_history
+from core.instrumentation import get_instrumentation
+from core.notifications import show_warning
+from core.progress import NullProgress, get_progress_reporter
+from core.precision import as_float_array
+from core.trace_context import decay_band, get_trace_context
+
+# Parameter order of the fitter. The fitter works on log τ_rise and log(τ_decay - τ_rise):
+# both taus stay positive and the decay stays slower than the rise, so the two time
+# constants cannot swap (the model is symmetric in them)
+PARAMETERS = ("baseline", "onset", "amplitude", "tau_rise", "tau_decay")
+
+# Convergence tolerances of the fitter: scaled parameter step and gradient (the cosine of
+# the angle between the residuals and the Jacobian columns)
+STEP_TOLERANCE = 1e-8
+GRADIENT_TOLERANCE = 1e-6
+
+# Models a τ is fitted with, recorded per peak in app.tau_source. The event model's τ_rise is
+# the rise time constant of the double exponential; the exponential τ_rise is the growth
+# constant of rise_function (or the 63.2% rise time of an outlier), so the two are not pooled
+EVENT_MODEL = "Event"
+EXPONENTIAL_MODEL = "Exponential"
+
+def set_tau_source(app, peak, kind, model):
+    """
+    Record the model the 'rise' or 'decay' τ of a peak was fitted with
+    """
+    app.tau_source.setdefault(peak, {})[kind] = model
+
+def tau_source(app, peak, kind):
+    """
+    Model the 'rise' or 'decay' τ of a peak was fitted with (the separate exponential fits by default)
+    """
+    return app.tau_source.get(peak, {}).get(kind, EXPONENTIAL_MODEL)
+
+def tau_model(app, peak):
+    """
+    Table label of the models of a peak's taus: the model name, or both when they differ
+    """
+    rise, decay = tau_source(app, peak, 'rise'), tau_source(app, peak, 'decay')
+    return rise if rise == decay else f"{rise} rise, {decay} decay"
+
+def event_model(s, amplitude, tau_rise, tau_decay):
+    """
+    Event shape A·(1 - e^{-s/τ_rise})·e^{-s/τ_decay} for s = t - t0 > 0, zero before the onset
+    """
+    s = np.maximum(s, 0)
+    return amplitude * (1 - np.exp(-s / tau_rise)) * np.exp(-s / tau_decay)
+
+def peak_amplitude(amplitude, tau_rise, tau_decay):
+    """
+    Height of the event above its baseline, reached at s = τ_rise·ln(1 + τ_decay/τ_rise)
+    """
+    return event_model(tau_rise * np.log1p(tau_decay / tau_rise), amplitude, tau_rise, tau_decay)
+
+def _model_and_jacobian(t, theta):
+    """
+    Model values and analytic Jacobian for a batch of events
+
+    The fitter works on the peak height H instead of A = H / max(shape): a slow rise with a
+    large A and a fast one with a smaller A then share H, which the data pins down, and
+    the rise/amplitude trade-off no longer forms a curved valley the iterations crawl along.
+
+    Args:
+        t: Sample times, shape (n_events, n_samples)
+        theta: Parameters (baseline, onset, peak height, log τ_rise, log(τ_decay - τ_rise)),
+               shape (n_events, 5)
+
+    Returns:
+        tuple: (model of shape (n_events, n_samples), Jacobian of shape (n_events, n_samples, 5)),
+               both in the precision of t
+    """
+    theta = theta.astype(t.dtype, copy=False)
+    baseline, onset, height = theta[:, 0:1], theta[:, 1:2], theta[:, 2:3]
+    tau_rise = np.exp(theta[:, 3:4])
+    tau_decay = tau_rise + np.exp(theta[:, 4:5])
+
+    # Maximum of the shape, at s* = τ_rise·ln(1 + τ_decay/τ_rise)
+    s_max = tau_rise * np.log1p(tau_decay / tau_rise)
+    rise_max = np.exp(-s_max / tau_rise)
+    decay_max = np.exp(-s_max / tau_decay)
+    shape_max = (1 - rise_max) * decay_max
+    amplitude = height / shape_max
+
+    s = t - onset
+    active = s > 0
+    s = np.where(active, s, t.dtype.type(0))
+    rise_term = np.exp(-s / tau_rise)
+    decay_term = np.exp(-s / tau_decay)
+    shape = (1 - rise_term) * decay_term
+    model = baseline + amplitude * shape
+
+    jacobian = np.empty(t.shape + (5,), dtype=t.dtype)
+    jacobian[..., 0] = 1.0
+    # d/dt0 = -d/ds, zero before the onset
+    jacobian[..., 1] = np.where(active, -amplitude * (rise_term / tau_rise * decay_term - shape / tau_decay), t.dtype.type(0))
+    jacobian[..., 2] = shape / shape_max
+    # τ·d/dτ of the shape and of its maximum (at the maximum d/ds = 0, so s* is held fixed)
+    relative_rise = -rise_term * decay_term * s / tau_rise + shape / shape_max * rise_max * decay_max * s_max / tau_rise
+    relative_decay = shape * s / tau_decay - shape * s_max / tau_decay
+    rise_derivative = amplitude * relative_rise
+    decay_derivative = amplitude * relative_decay
+    # Chain rule through τ_decay = τ_rise + e^{θ4}
+    jacobian[..., 3] = rise_derivative + tau_rise / tau_decay * decay_derivative
+    jacobian[..., 4] = (1 - tau_rise / tau_decay) * decay_derivative
+    return model, jacobian
+
+def _initial_guess(t, y, mask, peak_pos):
+    """
+    Starting parameters from the shape of each window
+    """
+    rows = np.arange(len(t))
+    last = mask.sum(axis=1) - 1
+    t_peak = t[rows, peak_pos]
+    y_peak = y[rows, peak_pos]
+
+    # Onset: lowest point before the peak
+    before_peak = np.arange(t.shape[1])[None, :] <= peak_pos[:, None]
+    onset_pos = np.argmin(np.where(before_peak & mask, y, np.inf), axis=1)
+    baseline = y[rows, onset_pos]
+    onset = t[rows, onset_pos]
+    dt = (t[rows, last] - t[:, 0]) / np.maximum(last, 1)
+    tau_rise = np.maximum((t_peak - onset) / 2, dt / 2)
+
+    # Decay: first time after the peak below 1/e of the amplitude, otherwise half the remaining window
+    level = baseline + (y_peak - baseline) / np.e
+    after_peak = (~before_peak) & mask & (y < level[:, None])
+    crossing = np.argmax(after_peak, axis=1)
+    found = after_peak[rows, crossing]
+    tau_decay = np.where(found, t[rows, crossing] - t_peak, (t[rows, last] - t_peak) / 2)
+    tau_decay = np.maximum(tau_decay, 2 * tau_rise)
+
+    return np.column_stack([baseline, onset, y_peak - baseline, np.log(tau_rise), np.log(tau_decay - tau_rise)])
+
+def fit_event_batch(t, y, mask, peak_pos, max_iterations=100, step_tolerance=STEP_TOLERANCE,
+                    gradient_tolerance=GRADIENT_TOLERANCE):
+    """
+    Levenberg-Marquardt fit of the event model to a batch of padded windows
+
+    Model, Jacobian and residuals are evaluated in the precision of t and y (float32 or
+    float64); the parameters, normal equations and costs always accumulate in float64.
+    An event has converged when an accepted step is small relative to the parameters
+    (both scaled by the Jacobian column norms) or when the projected gradient is orthogonal
+    to the residuals within the tolerance, as in MINPACK's xtol and gtol tests, and the
+    result is inside the bounds with a positive height.
+
+    Args:
+        t: Sample times, shape (n_events, n_samples), padded rows repeat their last time
+        y: Sample values, same shape
+        mask: True for real samples, False for padding
+        peak_pos: Position of the detected peak in each window
+        max_iterations: Maximum number of iterations
+        step_tolerance: Scaled step length, relative to the scaled parameters, that converges
+        gradient_tolerance: Largest cosine between the residuals and a Jacobian column at a minimum
+
+    Returns:
+        tuple: (parameters (n_events, 5) with the taus as times, residual sum of squares, converged flags)
+    """
+    weights = mask.astype(y.dtype)
+    theta = _initial_guess(t, y, mask, peak_pos).astype(np.float64)
+    # Tolerances below the rounding of the model in its precision cannot be met
+    step_tolerance = max(step_tolerance, 10 * np.finfo(y.dtype).eps)
+    gradient_tolerance = max(gradient_tolerance, np.sqrt(np.finfo(y.dtype).eps))
+    # Box bounds of the onset and the log taus; baseline and height are free
+    span = np.maximum(t[np.arange(len(t)), mask.sum(axis=1) - 1] - t[:, 0], 1e-12)
+    lower = np.full((len(t), 5), -np.inf)
+    upper = np.full((len(t), 5), np.inf)
+    lower[:, 1], upper[:, 1] = t[:, 0], t[np.arange(len(t)), peak_pos]
+    lower[:, 3:], upper[:, 3:] = np.log(span * 1e-3)[:, None], np.log(span * 10)[:, None]
+
+    model, jacobian = _model_and_jacobian(t, theta)
+    residual = (model - y) * weights
+    cost = np.einsum('ij,ij->i', residual, residual, dtype=np.float64)
+    damping = np.full(len(t), 1e-3)
+    active = np.ones(len(t), dtype=bool)
+    converged = np.zeros(len(t), dtype=bool)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        J = jacobian[idx] * weights[idx, :, None]
+        JTJ = np.einsum('eli,elj->eij', J, J, dtype=np.float64)
+        gradient = np.einsum('eli,el->ei', J, residual[idx], dtype=np.float64)
+        diagonal = np.einsum('eii->ei', JTJ)
+        scale = np.sqrt(np.maximum(diagonal, 1e-300))
+
+        # Parameters held at a bound by the gradient are fixed for this step (projected gradient)
+        fixed = ((theta[idx] <= lower[idx]) & (gradient > 0)) | ((theta[idx] >= upper[idx]) & (gradient < 0))
+        gradient[fixed] = 0
+
+        # Gradient test: no free Jacobian column is correlated with the residuals any more
+        cosine = np.abs(gradient) / (scale * np.sqrt(np.maximum(cost[idx], 1e-300))[:, None])
+        at_minimum = (cosine.max(axis=1) <= gradient_tolerance) | (cost[idx] == 0)
+        converged[idx[at_minimum]] = True
+        active[idx[at_minimum]] = False
+        keep = ~at_minimum
+        if not keep.any():
+            break
+        idx, JTJ, gradient, diagonal, scale, fixed = idx[keep], JTJ[keep], gradient[keep], diagonal[keep], scale[keep], fixed[keep]
+
+        # Marquardt scaling of the diagonal keeps the step well conditioned for every parameter;
+        # the fixed parameters are decoupled so that their step is zero
+        free = ~fixed
+        system = JTJ * (free[:, :, None] & free[:, None, :])
+        system = system + (damping[idx, None] * np.maximum(diagonal, 1e-12))[:, :, None] * np.eye(5)[None]
+        try:
+            step = np.linalg.solve(system, -gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            # A degenerate window (flat or too short) makes its system singular
+            step = np.einsum('eij,ej->ei', np.linalg.pinv(system), -gradient)
+
+        candidate = np.clip(theta[idx] + step, lower[idx], upper[idx])
+
+        new_model, new_jacobian = _model_and_jacobian(t[idx], candidate)
+        new_residual = (new_model - y[idx]) * weights[idx]
+        new_cost = np.einsum('ij,ij->i', new_residual, new_residual, dtype=np.float64)
+
+        improved = np.isfinite(new_cost) & (new_cost < cost[idx])
+        accepted = idx[improved]
+        # Step test on the step actually taken, after the bounds
+        taken = (candidate[improved] - theta[accepted]) * scale[improved]
+        small_step = np.linalg.norm(taken, axis=1) <= step_tolerance * (np.linalg.norm(theta[accepted] * scale[improved], axis=1) + step_tolerance)
+        theta[accepted] = candidate[improved]
+        jacobian[accepted] = new_jacobian[improved]
+        residual[accepted] = new_residual[improved]
+        cost[accepted] = new_cost[improved]
+
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-9)
+        damping[idx[~improved]] *= 4
+
+        converged[accepted[small_step]] = True
+        active[accepted[small_step]] = False
+        # No step improves the cost any more: stopped, converged only if the gradient test passes
+        active[idx[~improved][damping[idx[~improved]] > 1e8]] = False
+
+    # A fit held by a bound or without a positive height is determined by the constraints,
+    # not by the data (e.g. a decay cut short pins τ_decay - τ_rise at its floor): not converged
+    converged &= np.all((theta > lower) & (theta < upper), axis=1) & (theta[:, 2] > 0)
+
+    parameters = theta.copy()
+    parameters[:, 3] = np.exp(theta[:, 3])
+    parameters[:, 4] = parameters[:, 3] + np.exp(theta[:, 4])
+    parameters[:, 2] = theta[:, 2] / peak_amplitude(1.0, parameters[:, 3], parameters[:, 4])
+    return parameters, cost, converged
+
+def event_windows(n_samples, peak_indices, pre_samples, post_samples, band_samples=None):
+    """
+    Fitting window of each event, cut at the neighbouring peaks
+
+    Args:
+        band_samples: Sorted positions of the samples in the baseline band of the decays; when
+                      given, a window ends at the first of them after its peak, as the decay
+                      of calculate_decay does
+
+    Returns:
+        tuple: (start, stop) index arrays, stop exclusive
+    """
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    previous = np.concatenate(([-1], peak_indices[:-1]))
+    following = np.concatenate((peak_indices[1:], [n_samples]))
+    start = np.maximum(peak_indices - pre_samples, previous + 1)
+    start = np.maximum(start, 0)
+    stop = np.minimum(peak_indices + post_samples + 1, following)
+    if band_samples is not None and len(band_samples):
+        first = np.searchsorted(band_samples, peak_indices, side='right')
+        back_in_band = first < len(band_samples)
+        end = band_samples[np.minimum(first, len(band_samples) - 1)] + 1
+        stop = np.where(back_in_band, np.minimum(stop, end), stop)
+    return start, stop
+
+def band_statistics(values, baseline_values, peak_indices):
+    """
+    Statistics the baseline bands are set from (see trace_context.BAND_RULES), as
+    TraceContext.band_limits takes them from a session
+
+    Args:
+        values: Trace values
+        baseline_values: Baseline of the trace
+        peak_indices: Indices of the detected peaks
+
+    Returns:
+        tuple: (baseline mean, baseline standard deviation, mean peak value)
+    """
+    baseline_values = as_float_array(baseline_values)
+    return (
+        float(np.mean(baseline_values, dtype=np.float64)), float(np.std(baseline_values, dtype=np.float64)),
+        float(np.mean(values[np.asarray(peak_indices, dtype=int)], dtype=np.float64))
+    )
+
+def decay_band_samples(values, baseline_values, peak_indices, statistics=None):
+    """
+    Sorted positions of the samples in the baseline band of the decays (see
+    trace_context.decay_band), for the callers without a session
+
+    Args:
+        values: Trace values
+        baseline_values: Baseline of the trace
+        peak_indices: Indices of the detected peaks
+        statistics: band_statistics to use instead of those of these arrays (a part of a
+                    longer trace)
+    """
+    if len(peak_indices) == 0:
+        return np.empty(0, dtype=int)
+    if statistics is None:
+        statistics = band_statistics(values, baseline_values, peak_indices)
+    lower, upper = decay_band(*statistics)
+    return np.flatnonzero((values >= lower) & (values <= upper))
+
+def fit_events(time_values, values, peak_indices, pre_samples=50, post_samples=200, subset=None,
+               band_samples=None, batch_size=256, progress=None, instrumentation=None):
+    """
+    Fit the event model to every peak
+
+    Args:
+        time_values: Sample times
+        values: Trace values; float32 values are fitted in float32 (see fit_event_batch)
+        peak_indices: Sorted indices of all detected peaks, which bound the windows
+        pre_samples: Samples before each peak searched for the onset
+        subset: Positions in peak_indices of the events to fit (None for all), the others stay NaN
+        post_samples: Samples after each peak used for the decay
+        band_samples: Optional sorted positions of the samples in the baseline band of the
+                      decays, which end the windows (see event_windows). A decay is only
+                      followed until the trace is back at its baseline: after that the
+                      rolling baseline catches up with long events and the ΔF/F undershoots,
+                      which the model cannot fit
+        batch_size: Number of events fitted together
+        progress: Optional callback receiving the fraction of events fitted
+        instrumentation: Optional Instrumentation receiving the batch fit times
+
+    Returns:
+        dict: One array per parameter name, plus 'cost', 'converged', 'start' and 'stop'
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    values = as_float_array(values)
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    n_events = len(peak_indices)
+
+    start, stop = event_windows(len(values), peak_indices, int(pre_samples), int(post_samples), band_samples)
+    parameters = np.full((n_events, 5), np.nan)
+    cost = np.full(n_events, np.nan)
+    converged = np.zeros(n_events, dtype=bool)
+    subset = np.arange(n_events) if subset is None else np.asarray(subset, dtype=int)
+
+    for batch_start in range(0, len(subset), batch_size):
+        batch = subset[batch_start:batch_start + batch_size]
+        lengths = stop[batch] - start[batch]
+        width = int(lengths.max())
+
+        # Pad every window to the longest one; padded samples get zero weight
+        offsets = np.arange(width)
+        index_grid = start[batch, None] + np.minimum(offsets[None, :], lengths[:, None] - 1)
+        mask = offsets[None, :] < lengths[:, None]
+
+        # Times relative to each window start keep their resolution in the precision of the
+        # values; the onsets are shifted back after the fit
+        origin = time_values[start[batch]]
+        t = (time_values[index_grid] - origin[:, None]).astype(values.dtype, copy=False)
+
+        fit_start = time.perf_counter()
+        parameters[batch], cost[batch], converged[batch] = fit_event_batch(
+            t, values[index_grid], mask, peak_indices[batch] - start[batch]
+        )
+        parameters[batch, 1] += origin
+        if instrumentation is not None:
+            instrumentation.record_fit("event_batch", time.perf_counter() - fit_start)
+        if progress is not None:
+            progress((batch_start + len(batch)) / len(subset))
+
+    result = {name: parameters[:, i] for i, name in enumerate(PARAMETERS)}
+    result.update(cost=cost, converged=converged, start=start, stop=stop)
+    return result
+
+def fit_separately(time_values, values, baseline_values, peak_indices, subset, pre_samples=50,
+                   statistics=None, outliers=True):
+    """
+    Separate rise and decay fits of some events, the fallback of the event model for the
+    callers without a session (live mode, chunked pipeline)
+
+    The fits run on a HeadlessSession with every peak marked, so that the search windows are
+    cut at the neighbouring peaks as in the app.
+
+    Args:
+        time_values: Sample times
+        values: Trace values
+        baseline_values: Baseline of the trace
+        peak_indices: Sorted indices of all detected peaks
+        subset: Positions in peak_indices of the events to fit
+        pre_samples: Samples before each peak searched for the onset
+        statistics: band_statistics of the whole trace when these arrays are a part of it
+        outliers: Replace the outlier rise taus among the subset, as a full rise pass does
+
+    Returns:
+        tuple: (tau_rise, tau_decay, onset time) of the subset, NaN where a fit failed, and
+               whether the rise pass removed each event because it never rises
+    """
+    from core.apply_threshold import mark_peaks
+    from core.calculate_decay import calculate_decay
+    from core.calculate_rise import calculate_rise
+    from core.headless_session import HeadlessSession
+
+    session = HeadlessSession(time_values, values, peak_onset_window=pre_samples, draw=False)
+    session.baseline_values = np.asarray(baseline_values)
+    get_trace_context(session).band_statistics = statistics
+    mark_peaks(session, peak_indices, progress=NullProgress())
+    peaks = [session.marked_peaks[i] for i in subset]
+
+    calculate_rise(session, no_draw=True, progress=NullProgress(), recalculate_baseline=False, peaks=peaks, outliers=outliers)
+    calculate_decay(session, no_draw=True, progress=NullProgress(), peaks=peaks)
+
+    # Peaks are looked up by (time, value): a rise pass can remove peaks that never rise
+    tau_rise = np.array([session.rise_times.get(peak, np.nan) for peak in peaks], dtype=float)
+    tau_decay = np.array([session.tau_values.get(peak, np.nan) for peak in peaks], dtype=float)
+    onset = np.array([
+        session.rise_start_markers[peak].get_xdata()[0] if peak in session.rise_start_markers else np.nan
+        for peak in peaks
+    ], dtype=float)
+    marked = set(session.marked_peaks)
+    removed = np.array([peak not in marked for peak in peaks], dtype=bool)
+    return tau_rise, tau_decay, onset, removed
+
+def calculate_event_kinetics(app, no_draw=False, progress=None):
+    """
+    Fit the event model to every marked peak and store the results with the rise/decay results,
+    so that the table, exports and evoked processing read them unchanged
+
+    Peaks the model does not converge for get the separate rise and decay fits instead, and
+    the number of them is reported.
+
+    Args:
+        app: Main application instance
+        no_draw: Skip drawing the fitted curves
+        progress: Progress callback (defaults to the progress bar)
+    """
+    from core.calculate_baseline import calculate_baseline
+    from core.calculate_decay import calculate_decay
+    from core.calculate_rise import calculate_rise
+
+    instrumentation = get_instrumentation(app)
+    if progress is None:
+        progress = get_progress_reporter(app, start=0.4, span=0.6)
+
+    with instrumentation.stage("event/baseline"):
+        calculate_baseline(app, window_size=int(app.last_baseline_window_size), percentile=float(app.last_baseline_percentage))
+
+    app.marked_peaks = sorted(app.marked_peaks, key=lambda peak: peak[0])
+    if not app.marked_peaks:
+        return
+    # The fits are replaced outside the click edits: undoing an older edit would bring back
+    # the replaced fits of its peaks
+    get_edit_history(app).clear()
+
+    # Windows are cut at every marked peak, but only the peaks without results are refitted
+    time_values = app.time.values
+    peak_indices = np.searchsorted(time_values, [peak[0] for peak in app.marked_peaks])
+    pending = [i for i in range(len(app.marked_peaks)) if not (app.rise_calculated[i] and app.decay_calculated[i])]
+    pre_samples = int(app.last_peak_onset_window) if app.last_peak_onset_window else 50
+
+    result = fit_events(
+        time_values, app.df_f.values, peak_indices,
+        pre_samples=pre_samples, post_samples=4 * pre_samples, subset=pending,
+        band_samples=get_trace_context(app).band_positions('decay'),
+        progress=progress, instrumentation=instrumentation
+    )
+    progress.finish()
+
+    ok = result['converged'] & np.isfinite(result['tau_rise']) & np.isfinite(result['tau_decay'])
+    n_failed = int(len(pending) - ok[pending].sum())
+    instrumentation.count("event_fit_failures", n_failed)
+
+    failed = [app.marked_peaks[i] for i in pending if not ok[i]]
+    for i in pending:
+        if not ok[i]:
+            continue
+        peak = app.marked_peaks[i]
+        app.rise_times[peak] = float(result['tau_rise'][i])
+        app.tau_values[peak] = float(result['tau_decay'][i])
+        set_tau_source(app, peak, 'rise', EVENT_MODEL)
+        set_tau_source(app, peak, 'decay', EVENT_MODEL)
+        app.amplitudes[peak] = float(peak_amplitude(result['amplitude'][i], result['tau_rise'][i], result['tau_decay'][i]))
+        app.rise_calculated[i] = True
+        app.decay_calculated[i] = True
+        if not no_draw:
+            draw_event_fit(app, peak, result, i)
+
+    if n_failed:
+        # Only the failed peaks are fitted separately, and the rise outlier pass of the
+        # separate fits leaves the event-model taus alone; the baseline is current
+        instrumentation.count("event_fit_fallbacks", n_failed)
+        with instrumentation.stage("event/fallback"):
+            calculate_rise(app, no_draw=no_draw, progress=NullProgress(), recalculate_baseline=False, peaks=failed)
+            calculate_decay(app, no_draw=no_draw, progress=NullProgress(), peaks=failed)
+        show_warning(
+            app,
+            f"The event model did not converge for {n_failed} of {len(pending)} peaks. "
+            "Their rise and decay were fitted separately.",
+            title="Event Model"
+        )
+
+    if not no_draw:
+        app.canvas.draw()
+        app.update_table()
+
+def draw_event_fit(app, peak, result, i):
+    """
+    Draw one fitted event: onset marker, rising part (green) and decaying part (magenta),
+    registered like the separate rise and decay curves
+    """
+    onset = result['onset'][i]
+    tau_rise, tau_decay = result['tau_rise'][i], result['tau_decay'][i]
+    end = app.time.values[result['stop'][i] - 1]
+    model_peak = onset + tau_rise * np.log1p(tau_decay / tau_rise)
+
+    def curve(t):
+        return result['baseline'][i] + event_model(t - onset, result['amplitude'][i], tau_rise, tau_decay)
+
+    t_rise = np.linspace(onset, min(model_peak, end), 50)
+    t_decay = np.linspace(min(model_peak, end), end, 100)
+
+    onset_marker, = app.ax.plot(onset, curve(onset), 'gx')
+    rise_line, = app.ax.plot(t_rise, curve(t_rise), color='#00FF00', linestyle='--')
+    decay_line, = app.ax.plot(t_decay, curve(t_decay), color='#FF00FF', linestyle='--')
+
+    app.rise_start_markers[peak] = onset_marker
+    app.rise_lines.append(rise_line)
+    app.rise_line_map[peak] = rise_line
+    app.decay_lines.append(decay_line)
+    app.decay_line_map[peak] = decay_line
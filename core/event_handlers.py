@@ -1,10 +1,14 @@
 import numpy as np
 from tkinter import messagebox
-from scipy.signal import find_peaks
 from core.calculate_decay import calculate_decay
 from core.calculate_rise import calculate_rise
+from core.instrumentation import get_instrumentation
+from core.edit_history import get_edit_history, neighbour_peaks, snapshot_peaks
+from core.hit_testing import time_window, find_marked_peak, nearest_marked_peak, peak_insert_position, peak_under_cursor, peak_tooltip_text
 
 def handle_canvas_click(event, app):
+    from scipy.signal import find_peaks
+
     if app.time is None or app.df_f is None:
         messagebox.showwarning(title="Warning", message="No data loaded. Please load data before interacting with the plot.")
         return
@@ -32,14 +36,14 @@ def handle_canvas_click(event, app):
                 window_size = user_window_size
             else:
                 # Fallback to default calculation when user input is absent or invalid
-                time_range = app.time.max() - app.time.min()
+                time_range = app.time.iloc[-1] - app.time.iloc[0]
                 window_size = int(time_range * 0.0008)
                 if window_size < 10:
                     window_size = 3
-            print("window_size: ", window_size)
-            window_mask = (app.time >= x_clicked - window_size) & (app.time <= x_clicked + window_size)
-            window_time = app.time[window_mask]
-            window_df_f = app.df_f[window_mask]
+            get_instrumentation(app).log(f"click window_size: {window_size}")
+            window = time_window(app.time.values, x_clicked, window_size)
+            window_time = app.time.iloc[window]
+            window_df_f = app.df_f.iloc[window]
             if len(window_time) > 1:
                 # Detect peaks within this subset, considering peak threshold if provided
                 peaks, _ = find_peaks(window_df_f)  # Adjust prominence based on data characteristics
@@ -52,20 +56,18 @@ def handle_canvas_click(event, app):
                     y_peak = window_df_f.iloc[nearest_peak_idx]
 
                     # Check if the peak is already marked
-                    if (x_peak, y_peak) not in app.marked_peaks:
-                        # Plot the peak without annotation
-                        point, = app.ax.plot(x_peak, y_peak, 'ro')
-                        app.points.append(point)
-                        app.marked_peaks.append((x_peak, y_peak))
-                        app.decay_calculated.append(False)
-                        app.rise_calculated.append(False)
-
-                        # Sort marked_peaks and synchronize other lists
-                        sorted_data = sorted(zip(app.marked_peaks, app.points, app.decay_calculated, app.rise_calculated), key=lambda x: x[0][0])
-                        app.marked_peaks, app.points, app.decay_calculated, app.rise_calculated = map(list, zip(*sorted_data))
+                    if find_marked_peak(app, (x_peak, y_peak)) is None:
+                        # State of the neighbours before their refits, for undo
+                        neighbours = neighbour_peaks(app, x_peak)
+                        before = snapshot_peaks(app, neighbours)
 
-                        # Find the index of the newly added peak in the sorted list
-                        current_peak_index = app.marked_peaks.index((x_peak, y_peak))
+                        # Plot the peak without annotation and insert it at its place in time
+                        point, = app.ax.plot(x_peak, y_peak, 'ro')
+                        current_peak_index = peak_insert_position(app, x_peak)
+                        app.points.insert(current_peak_index, point)
+                        app.marked_peaks.insert(current_peak_index, (x_peak, y_peak))
+                        app.decay_calculated.insert(current_peak_index, False)
+                        app.rise_calculated.insert(current_peak_index, False)
 
                         if (app.evoked_status == "off"):
                             # If current peak is not the first peak, find previous peak and recalculate its decay
@@ -120,6 +122,8 @@ def handle_canvas_click(event, app):
                         calculate_decay(app, single_peak=(x_peak, y_peak), no_draw=True)
                         calculate_rise(app, single_peak=(x_peak, y_peak), no_draw=True)
 
+                        get_edit_history(app).push("add peak", before, snapshot_peaks(app, (neighbours[0], (x_peak, y_peak), neighbours[1])))
+
                         app.canvas.draw()
                         app.update_table()  # Update table
                 else:
@@ -129,26 +133,16 @@ def handle_canvas_click(event, app):
 
         elif event.button == 3:  # Right click to remove the nearest point
             if app.points:
-                # Find the nearest point to the click
-                x_clicked = event.xdata
-                distances = [abs(point.get_xdata()[0] - x_clicked) for point in app.points]
-                nearest_idx = np.argmin(distances)
+                # Find the nearest point to the click; the peaks are sorted by time
+                nearest_idx = nearest_marked_peak(app, event.xdata)
                 peak_to_remove = app.marked_peaks[nearest_idx]
 
-                # To recalculate the decay of the previous peak, we need to determine the position of the current peak in the time sequence
-                # Get all peaks and sort them by time
-                sorted_peaks = sorted(app.marked_peaks, key=lambda x: x[0])
-                current_position = sorted_peaks.index(peak_to_remove)
-                
-                # Find the previous peak (if it exists)
-                prev_peak = None
-                if current_position > 0:
-                    prev_peak = sorted_peaks[current_position - 1]
-                
-                # Find the next peak (if it exists)
-                next_peak = None
-                if current_position < len(sorted_peaks) - 1:
-                    next_peak = sorted_peaks[current_position + 1]
+                # Neighbours whose decay and rise are recalculated after the deletion
+                prev_peak = app.marked_peaks[nearest_idx - 1] if nearest_idx > 0 else None
+                next_peak = app.marked_peaks[nearest_idx + 1] if nearest_idx < len(app.marked_peaks) - 1 else None
+
+                # State of the peak and its neighbours before the deletion, for undo
+                before = snapshot_peaks(app, (prev_peak, peak_to_remove, next_peak))
 
                 # Now perform the deletion operation
                 point = app.points.pop(nearest_idx)
@@ -179,6 +173,7 @@ def handle_canvas_click(event, app):
                     del app.tau_values[peak]
                 if peak in app.amplitudes:
                     del app.amplitudes[peak]
+                app.tau_source.pop(peak, None)
 
                 app.decay_calculated.pop(nearest_idx)
                 app.rise_calculated.pop(nearest_idx)
@@ -231,5 +226,35 @@ def handle_canvas_click(event, app):
                         # Recalculate next peak's rise
                         calculate_rise(app, single_peak=next_peak, no_draw=True)
 
+                get_edit_history(app).push("remove peak", before, snapshot_peaks(app, (prev_peak, next_peak)))
+
                 app.canvas.draw()
-                app.update_table()  # Update table
\ No newline at end of file
+                app.update_table()  # Update table
+
+def handle_canvas_hover(event, app):
+    """
+    Show a tooltip with the amplitude and taus of the marked peak under the cursor
+
+    The annotation is created once and only redrawn when the hovered peak changes.
+    """
+    if app.time is None or getattr(app, 'pan_start', None) is not None:
+        return
+    peak = peak_under_cursor(app, event) if event.inaxes == app.ax and event.xdata is not None else None
+    if peak == app.hovered_peak:
+        return
+    app.hovered_peak = peak
+
+    tooltip = app.hover_annotation
+    if peak is None:
+        if tooltip is not None:
+            tooltip.set_visible(False)
+    else:
+        if tooltip is None or tooltip.axes is None:
+            tooltip = app.hover_annotation = app.ax.annotate(
+                "", xy=(0, 0), xytext=(12, 12), textcoords='offset points', fontsize=8,
+                bbox=dict(boxstyle='round', facecolor='#ffffe0', edgecolor='gray', alpha=0.95)
+            )
+        tooltip.xy = peak
+        tooltip.set_text(peak_tooltip_text(app, peak))
+        tooltip.set_visible(True)
+    app.canvas.draw_idle()
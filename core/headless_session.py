@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from core.app_state import initialize_app_state
+from utils.table_operations_utils import build_table_rows
+
+class _NullCanvas:
+    def draw(self):
+        pass
+
+    def draw_idle(self):
+        pass
+
+class _NullLine:
+    """
+    Curve of a _NullAxes: keeps its data for the code reading it back, is never drawn
+    """
+    axes = None
+
+    def __init__(self, x, y):
+        self.set_data(x, y)
+
+    def get_xdata(self):
+        return self._x
+
+    def get_ydata(self):
+        return self._y
+
+    def set_data(self, x, y):
+        self._x = np.atleast_1d(np.asarray(x))
+        self._y = np.atleast_1d(np.asarray(y))
+
+    def remove(self):
+        pass
+
+class _NullAxes:
+    """
+    Axes of a session that never shows its curves: plot returns _NullLine curves instead of
+    creating artists on a figure
+    """
+    lines = ()
+
+    def plot(self, x, y, *args, **kwargs):
+        return [_NullLine(x, y)]
+
+class HeadlessSession:
+    """
+    Stand-in for the main window so that the core analysis functions can run
+    without a GUI (benchmarks and scripts). Fit curves and markers are drawn on an
+    off-screen matplotlib figure, or only their data is kept when draw is False (worker
+    processes and fallback fits, which never show them). There is no progress bar and
+    redraws are no-ops, warnings are collected in self.warnings and the table rows in
+    self.table_rows.
+    """
+    def __init__(self, time, values, baseline_window_size=50, baseline_percentage=30,
+                 peak_onset_window="", evoked_status="off", convert_to_df_f=True, draw=True):
+        initialize_app_state(self)
+
+        if draw:
+            from matplotlib.figure import Figure
+
+            self.fig = Figure()
+            self.ax = self.fig.add_subplot()
+        else:
+            self.fig = None
+            self.ax = _NullAxes()
+        self.canvas = _NullCanvas()
+        self.progress_bar = None
+        self.tree = None
+
+        self.time = pd.Series(np.asarray(time, dtype=float))
+        self.df_f = pd.Series(np.asarray(values))
+        self.raw_values = pd.Series(self.df_f.values.copy())
+        self.convert_to_df_f = convert_to_df_f
+        self.evoked_status = evoked_status
+
+        self.last_baseline_window_size = str(baseline_window_size)
+        self.last_baseline_percentage = str(baseline_percentage)
+        self.last_peak_onset_window = str(peak_onset_window) if peak_onset_window else ""
+
+        self.warnings = []
+        self.table_rows = []
+
+    def update(self):
+        pass
+
+    def after(self, ms, func=None, *args):
+        pass
+
+    def report_warning(self, title, message):
+        self.warnings.append(message)
+
+    def update_table(self):
+        self.table_rows = build_table_rows(self)
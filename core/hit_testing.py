@@ -0,0 +1,95 @@
+"""
+Hit testing on the plot
+Clicks and hovering are resolved with binary searches: the sample window around the
+cursor is a searchsorted slice of the sorted time array, and marked peaks are found by
+bisecting app.marked_peaks, which is kept sorted by time. Each lookup is O(log N).
+"""
+import bisect
+import numpy as np
+
+# Hover distance, in pixels, within which a marked peak shows its tooltip
+HOVER_PIXELS = 8
+
+def time_window(time_values, center, half_width):
+    """
+    Sample range whose times lie in [center - half_width, center + half_width]
+
+    Args:
+        time_values: Sorted sample times
+        center: Time at the middle of the window
+        half_width: Half of the window length, in time units
+
+    Returns:
+        slice: Positions of the samples in the window
+    """
+    start = np.searchsorted(time_values, center - half_width, side='left')
+    stop = np.searchsorted(time_values, center + half_width, side='right')
+    return slice(int(start), int(stop))
+
+def peak_insert_position(app, peak_time):
+    """
+    Position of the first marked peak at or after a time
+
+    (t,) sorts before every (t, value), so bisecting the (time, value) tuples with a
+    one-element tuple compares the times only.
+    """
+    return bisect.bisect_left(app.marked_peaks, (peak_time,))
+
+def find_marked_peak(app, peak):
+    """
+    Position of a peak in app.marked_peaks, None when it is not marked
+    """
+    i = peak_insert_position(app, peak[0])
+    while i < len(app.marked_peaks) and app.marked_peaks[i][0] == peak[0]:
+        if app.marked_peaks[i] == peak:
+            return i
+        i += 1
+    return None
+
+def nearest_marked_peak(app, x):
+    """
+    Position of the marked peak closest in time to x, None when there are no peaks
+    """
+    if not app.marked_peaks:
+        return None
+    i = peak_insert_position(app, x)
+    if i == len(app.marked_peaks):
+        return i - 1
+    if i > 0 and x - app.marked_peaks[i - 1][0] <= app.marked_peaks[i][0] - x:
+        return i - 1
+    return i
+
+def peak_under_cursor(app, event, pixels=HOVER_PIXELS):
+    """
+    Marked peak drawn within a few pixels of the cursor
+
+    Args:
+        app: Main application instance
+        event: Matplotlib mouse event over app.ax
+        pixels: Largest distance to the marker in pixels
+
+    Returns:
+        tuple: (time, value) of the peak, None when no marker is that close
+    """
+    i = nearest_marked_peak(app, event.xdata)
+    if i is None:
+        return None
+    peak = app.marked_peaks[i]
+    x, y = app.ax.transData.transform((peak[0], peak[1]))
+    if abs(x - event.x) <= pixels and abs(y - event.y) <= pixels:
+        return peak
+    return None
+
+def peak_tooltip_text(app, peak):
+    """
+    Tooltip of a marked peak: time, value, amplitude and the fitted taus where available
+    """
+    def number(value):
+        return f"{value:.4g}" if isinstance(value, (int, float, np.number)) else "N/A"
+
+    lines = [f"t = {peak[0]:g}", f"ΔF/F = {number(peak[1])}"]
+    if peak in app.amplitudes:
+        lines.append(f"Amplitude = {number(app.amplitudes[peak])}")
+    lines.append(f"τ rise = {number(app.rise_times.get(peak))}")
+    lines.append(f"τ decay = {number(app.tau_values.get(peak))}")
+    return "\n".join(lines)
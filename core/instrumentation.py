@@ -0,0 +1,271 @@
+import io
+import json
+import time
+import pstats
+import cProfile
+from contextlib import contextmanager
+import numpy as np
+
+class Instrumentation:
+    """
+    Per-action timing and counters for the analysis pipeline
+
+    An action (detect peaks, load file, a click on the plot ...) is split into stages
+    whose wall times are recorded together with per-peak fit times, counters such as
+    curve_fit failures and the number of artists left on the axes. Everything is a
+    no-op while disabled, so headless runs and normal sessions pay nothing.
+    """
+    def __init__(self, enabled=False, json_log_path=None):
+        self.enabled = enabled
+        self.json_log_path = json_log_path
+        self.profile_next = False
+        self.history = []
+        self.last_profile = None
+        self._current = None
+        self._depth = 0
+
+    def _new_record(self, name):
+        return {
+            'action': name,
+            'timestamp': time.time(),
+            'total_s': 0.0,
+            'idle_s': 0.0,
+            'stages': {},
+            'fit_times': {},
+            'counters': {},
+            'artists': {},
+            'messages': [],
+        }
+
+    @contextmanager
+    def action(self, name, app=None):
+        """
+        Record one user action; nested actions are merged into the outer one
+
+        Args:
+            name: Name of the action
+            app: Main application instance, used to count artists at the end
+        """
+        if not self.enabled or self._depth > 0:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self._current = self._new_record(name)
+        profiler = None
+        if self.profile_next:
+            self.profile_next = False
+            profiler = cProfile.Profile()
+
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.last_profile = profiler
+            self._depth -= 1
+            record = self._current
+            # Time spent waiting for the user is reported as a stage but not counted in the total
+            record['total_s'] = time.perf_counter() - start - record['idle_s']
+            if app is not None:
+                record['artists'] = count_artists(app)
+            if profiler is not None:
+                record['profile'] = self.profile_text(limit=25)
+            self._current = None
+            self.history.append(record)
+            self._write_json(record)
+
+    @contextmanager
+    def stage(self, name, idle=False):
+        """
+        Time one stage of the current action
+
+        Args:
+            name: Name of the stage, repeated stages are summed
+            idle: The stage waits for user input (dialogs) and is excluded from the action total
+        """
+        if not self.enabled or self._current is None:
+            yield
+            return
+        record = self._current
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            record['stages'][name] = record['stages'].get(name, 0.0) + elapsed
+            if idle:
+                record['idle_s'] += elapsed
+
+    def record_fit(self, kind, seconds):
+        """
+        Record the duration of one per-peak fit
+
+        Args:
+            kind: "rise" or "decay"
+            seconds: Duration of the fit
+        """
+        if self._current is not None:
+            self._current['fit_times'].setdefault(kind, []).append(seconds)
+
+    def count(self, name, n=1):
+        if self._current is not None:
+            counters = self._current['counters']
+            counters[name] = counters.get(name, 0) + n
+
+    def log(self, message):
+        """
+        Keep a diagnostic message with the current action (replaces ad-hoc prints)
+        """
+        if self._current is not None:
+            self._current['messages'].append(str(message))
+
+    def reset(self):
+        self.history = []
+        self.last_profile = None
+
+    def profile_text(self, limit=25, sort="cumulative"):
+        """
+        Text report of the last cProfile capture
+        """
+        if self.last_profile is None:
+            return ""
+        stream = io.StringIO()
+        pstats.Stats(self.last_profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump_profile(self, path):
+        """
+        Save the last cProfile capture in the pstats format (for snakeviz, pstats ...)
+        """
+        if self.last_profile is not None:
+            self.last_profile.dump_stats(path)
+
+    def _write_json(self, record):
+        if not self.json_log_path:
+            return
+        entry = dict(record)
+        entry['fit_times'] = {kind: summarize_fit_times(times) for kind, times in record['fit_times'].items()}
+        try:
+            # One JSON object per line so the log can be appended to across sessions
+            with open(self.json_log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError:
+            pass
+
+# Shared disabled instance for applications without instrumentation
+_DISABLED = Instrumentation(enabled=False)
+
+def get_instrumentation(app):
+    """
+    Instrumentation of the application, or a disabled instance when it has none
+
+    Args:
+        app: Main application instance (or headless session)
+    """
+    return getattr(app, 'instrumentation', None) or _DISABLED
+
+def instrumented_action(app, name, func):
+    """
+    Wrap a UI callback so that each call is recorded as one action
+
+    Args:
+        app: Main application instance
+        name: Name of the action
+        func: Callback to wrap
+    """
+    def wrapper(*args, **kwargs):
+        with get_instrumentation(app).action(name, app):
+            return func(*args, **kwargs)
+    return wrapper
+
+def count_artists(app):
+    """
+    Number of artists of each kind currently owned by the application
+    """
+    counts = {
+        'peak_markers': len(getattr(app, 'points', [])),
+        'rise_lines': len(getattr(app, 'rise_lines', [])),
+        'decay_lines': len(getattr(app, 'decay_lines', [])),
+        'rise_start_markers': len(getattr(app, 'rise_start_markers', {})),
+        'partition_lines': len(getattr(app, 'partition_lines', [])),
+        'partition_labels': len(getattr(app, 'partition_labels', [])),
+    }
+    ax = getattr(app, 'ax', None)
+    if ax is not None:
+        counts['axes_lines'] = len(ax.lines)
+        counts['axes_texts'] = len(ax.texts)
+    return counts
+
+def summarize_fit_times(times, bins=8):
+    """
+    Count, mean, max and a log-spaced histogram of per-peak fit times
+
+    Args:
+        times: Fit durations in seconds
+        bins: Number of histogram bins
+
+    Returns:
+        dict: Summary with the histogram edges in milliseconds
+    """
+    times_ms = np.asarray(times, dtype=float) * 1000
+    if times_ms.size == 0:
+        return {'count': 0}
+    low = max(times_ms.min(), 1e-3)
+    high = max(times_ms.max(), low * 1.01)
+    counts, edges = np.histogram(times_ms, bins=np.geomspace(low, high, bins + 1))
+    return {
+        'count': int(times_ms.size),
+        'mean_ms': float(times_ms.mean()),
+        'max_ms': float(times_ms.max()),
+        'total_ms': float(times_ms.sum()),
+        'histogram_counts': counts.tolist(),
+        'histogram_edges_ms': edges.tolist(),
+    }
+
+def format_record(record):
+    """
+    Human readable report of one action for the Performance panel
+    """
+    lines = [f"{record['action']}  total {record['total_s'] * 1000:.1f} ms"]
+
+    if record['stages']:
+        lines.append("  Stages:")
+        for name, seconds in record['stages'].items():
+            lines.append(f"    {name:<22}{seconds * 1000:10.1f} ms")
+        if record['idle_s']:
+            lines.append(f"    (waiting for input {record['idle_s'] * 1000:.0f} ms, not in total)")
+
+    for kind, times in record['fit_times'].items():
+        summary = summarize_fit_times(times)
+        lines.append(f"  {kind} fits: {summary['count']}  mean {summary['mean_ms']:.2f} ms  max {summary['max_ms']:.2f} ms")
+        peak_count = max(summary['histogram_counts']) or 1
+        edges = summary['histogram_edges_ms']
+        for i, count in enumerate(summary['histogram_counts']):
+            bar = "#" * int(round(20 * count / peak_count))
+            lines.append(f"    {edges[i]:8.2f}-{edges[i + 1]:<8.2f} ms {count:6d} {bar}")
+
+    if record['counters']:
+        lines.append("  Counters:")
+        for name, value in record['counters'].items():
+            lines.append(f"    {name:<28}{value:8d}")
+
+    if record['artists']:
+        lines.append("  Artists: " + ", ".join(f"{name}={value}" for name, value in record['artists'].items()))
+
+    if record['messages']:
+        lines.append(f"  Messages ({len(record['messages'])}):")
+        lines.extend(f"    {message}" for message in record['messages'][-10:])
+
+    if record.get('profile'):
+        lines.append("  Profile:")
+        lines.append(record['profile'])
+
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+import numpy as np
+from core.precision import as_float_array
+from core.trace_context import get_trace_context
+
+def segment_grid(starts, stops):
+    """
+    Sample indices of variable-length segments padded into one array
+
+    Args:
+        starts: First index of each segment
+        stops: Last index of each segment (inclusive)
+
+    Returns:
+        tuple: (index grid of shape (n_segments, max(longest, 2)), mask of the real samples);
+               padded positions repeat the last index of their segment
+    """
+    starts = np.asarray(starts, dtype=int)
+    stops = np.asarray(stops, dtype=int)
+    lengths = stops - starts + 1
+    offsets = np.arange(max(int(lengths.max()) if len(lengths) else 0, 2))
+    grid = starts[:, None] + np.minimum(offsets[None, :], lengths[:, None] - 1)
+    return grid, offsets[None, :] < lengths[:, None]
+
+def _envelope_crossings(time_values, grid, normalized, fractions):
+    """
+    First interpolated times at which monotone normalized envelopes reach the fractions
+
+    Offsetting every envelope (values in [0, 1]) by twice its row number turns all of
+    them into one sorted array, so a single searchsorted answers every (row, fraction) pair.
+
+    Returns:
+        np.ndarray: Crossing times, shape (n_rows, n_fractions), NaN where a row never reaches the fraction
+    """
+    n_rows, width = normalized.shape
+    rows = np.arange(n_rows)[:, None]
+    flat = (normalized + 2 * rows).ravel()
+
+    targets = fractions[None, :] + 2 * rows
+    positions = np.searchsorted(flat, targets.ravel(), side='left').reshape(n_rows, len(fractions))
+    positions = np.clip(positions - rows * width, 1, width - 1)
+
+    # Linear interpolation between the samples around each crossing
+    before = normalized[rows, positions - 1]
+    after = normalized[rows, positions]
+    step = after - before
+    fraction_between = np.where(step > 0, (fractions[None, :] - before) / np.where(step > 0, step, 1), 0)
+    t_before = time_values[grid[rows, positions - 1]]
+    t_after = time_values[grid[rows, positions]]
+    crossings = t_before + np.clip(fraction_between, 0, 1) * (t_after - t_before)
+
+    crossings[normalized[:, -1:] < fractions[None, :]] = np.nan
+    return crossings
+
+def rising_crossings(time_values, values, starts, stops, fractions, reference=None):
+    """
+    Interpolated times at which each rising segment first reaches fractions of its amplitude
+
+    The segments are searched on their cumulative maximum, which is monotone, so noise
+    dips after a crossing cannot move it.
+
+    Args:
+        time_values: Sample times
+        values: Trace values
+        starts: Onset index of each segment
+        stops: Peak index of each segment (inclusive)
+        fractions: Fractions of the amplitude, e.g. (0.1, 0.632, 0.9)
+        reference: Level of fraction 0 for each segment (defaults to the onset value)
+
+    Returns:
+        np.ndarray: Crossing times, shape (n_segments, n_fractions), NaN for flat segments
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    values = as_float_array(values)
+    fractions = np.asarray(fractions, dtype=float)
+    if len(starts) == 0:
+        return np.empty((0, len(fractions)))
+
+    grid, _ = segment_grid(starts, stops)
+    envelope = np.maximum.accumulate(values[grid], axis=1)
+    reference = envelope[:, 0] if reference is None else as_float_array(reference)
+    amplitudes = values[np.asarray(stops, dtype=int)] - reference
+    valid = amplitudes > 0
+
+    scale = np.where(valid, amplitudes, 1)[:, None]
+    normalized = np.clip((envelope - reference[:, None]) / scale, 0, 1)
+    crossings = _envelope_crossings(time_values, grid, normalized, fractions)
+    crossings[~valid] = np.nan
+    return crossings
+
+def falling_crossings(time_values, values, starts, stops, fractions, reference):
+    """
+    Interpolated times at which each segment, starting at a peak, first falls by fractions
+    of the peak-to-reference amplitude, searched on its cumulative minimum
+
+    Args:
+        time_values: Sample times
+        values: Trace values
+        starts: Peak index of each segment
+        stops: Last index of each segment (inclusive)
+        fractions: Fractions of the amplitude, e.g. 0.5 for the half-decay time
+        reference: Level the trace decays to (the baseline) for each segment
+
+    Returns:
+        np.ndarray: Crossing times, shape (n_segments, n_fractions), NaN when the segment
+                    ends before falling that far
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    values = as_float_array(values)
+    fractions = np.asarray(fractions, dtype=float)
+    if len(starts) == 0:
+        return np.empty((0, len(fractions)))
+
+    grid, _ = segment_grid(starts, stops)
+    envelope = np.minimum.accumulate(values[grid], axis=1)
+    peak_values = values[np.asarray(starts, dtype=int)]
+    amplitudes = peak_values - as_float_array(reference)
+    valid = amplitudes > 0
+
+    scale = np.where(valid, amplitudes, 1)[:, None]
+    normalized = np.clip((peak_values[:, None] - envelope) / scale, 0, 1)
+    crossings = _envelope_crossings(time_values, grid, normalized, fractions)
+    crossings[~valid] = np.nan
+    return crossings
+
+# Table columns of the model-free metrics, in the order of compute_kinetic_metrics
+METRIC_COLUMNS = ("10–90% rise", "Half-width", "t½ (decay)", "AUC")
+
+# Longest rising or falling edge the metrics look at, in samples
+MAX_EDGE_SAMPLES = 1000
+
+def compute_kinetic_metrics(time_values, values, baseline, peak_indices, onset_indices=None, max_samples=MAX_EDGE_SAMPLES,
+                            cumulative_area=None):
+    """
+    Model-free kinetics of all peaks in one vectorized pass, a cheap alternative to the fits
+
+    Rising edges run from the onset to the peak and falling edges from the peak to the
+    next peak (at most max_samples each); amplitudes are measured from the baseline.
+
+    Args:
+        time_values: Sample times
+        values: Trace values (float32 or float64, the times stay float64)
+        baseline: Baseline of the trace, one value per sample
+        peak_indices: Sorted peak indices
+        onset_indices: Onset index of each peak, negative where it should be searched
+                       (the lowest point since the previous peak); None to search all
+        max_samples: Longest rising or falling edge in samples
+        cumulative_area: Running trapezoidal area above the baseline, computed when None
+
+    Returns:
+        np.ndarray: Shape (n_peaks, 4) with the METRIC_COLUMNS (10–90% rise time,
+                    half-width, half-decay time, area above the baseline), NaN where undefined
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    values = as_float_array(values)
+    baseline = as_float_array(baseline)
+    peaks = np.asarray(peak_indices, dtype=int)
+    if len(peaks) == 0:
+        return np.empty((0, len(METRIC_COLUMNS)))
+
+    previous = np.concatenate(([0], peaks[:-1]))
+    following = np.concatenate((peaks[1:], [len(values) - 1]))
+
+    onsets = np.full(len(peaks), -1) if onset_indices is None else np.asarray(onset_indices, dtype=int).copy()
+    search = onsets < 0
+    if search.any():
+        search_start = np.maximum(previous[search], peaks[search] - max_samples)
+        grid, mask = segment_grid(search_start, peaks[search])
+        onsets[search] = grid[np.arange(len(grid)), np.argmin(np.where(mask, values[grid], np.inf), axis=1)]
+    decay_ends = np.minimum(following, peaks + max_samples)
+
+    levels = baseline[peaks]
+    rise = rising_crossings(time_values, values, onsets, peaks, (0.1, 0.5, 0.9), reference=levels)
+    half_decay = falling_crossings(time_values, values, peaks, decay_ends, (0.5,), reference=levels)[:, 0]
+
+    # Trapezoidal area above the baseline from the onset to the end of the falling edge
+    if cumulative_area is None:
+        residual = values - baseline
+        cumulative_area = np.concatenate(([0.0], np.cumsum(0.5 * (residual[1:] + residual[:-1]) * np.diff(time_values))))
+    area = cumulative_area[decay_ends] - cumulative_area[onsets]
+
+    return np.column_stack([
+        rise[:, 2] - rise[:, 0],
+        half_decay - rise[:, 1],
+        half_decay - time_values[peaks],
+        area,
+    ])
+
+def peak_metrics(app):
+    """
+    Model-free metrics of every marked peak, using the fitted onsets where there are any
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        dict: Peak -> tuple of the METRIC_COLUMNS values
+    """
+    if not app.marked_peaks or app.baseline_values is None or len(app.baseline_values) != len(app.df_f):
+        return {}
+
+    # The area under the whole trace only changes with the trace or its baseline
+    context = get_trace_context(app)
+    time_values = context.time_values()
+    peaks = np.searchsorted(time_values, [peak[0] for peak in app.marked_peaks])
+    onsets = np.array([
+        np.searchsorted(time_values, app.rise_start_markers[peak].get_xdata()[0]) if peak in app.rise_start_markers else -1
+        for peak in app.marked_peaks
+    ])
+    metrics = compute_kinetic_metrics(
+        time_values, context.values(), app.baseline_values, peaks, onsets, cumulative_area=context.cumulative_area()
+    )
+    return {peak: tuple(row) for peak, row in zip(app.marked_peaks, metrics)}
@@ -0,0 +1,470 @@
+"""
+Live acquisition mode
+
+A trace file that is still being written (CSV, or an .npy whose header is rewritten as rows
+are appended) is polled at a fixed frame rate. Only the new rows are read, the rolling
+percentile baseline of calculate_baseline is extended to them, and peaks and event fits
+are computed on the new tail with a bounded look-back.
+"""
+import io
+import os
+import numpy as np
+from core.event_fitting import (EVENT_MODEL, EXPONENTIAL_MODEL, decay_band_samples, fit_events, fit_separately,
+                                draw_event_fit, peak_amplitude, set_tau_source)
+from core.instrumentation import get_instrumentation
+from core.calculate_baseline import rolling_baseline
+from core.trace_context import INPUTS, get_trace_context
+from utils.overview_utils import draw_overview
+
+class GrowingArray:
+    """
+    Append-only float array with amortized O(1) appends; data is a view of the filled part
+    """
+    def __init__(self, capacity=4096):
+        self._buffer = np.empty(capacity)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        needed = self.size + len(values)
+        if needed > len(self._buffer):
+            buffer = np.empty(max(needed, 2 * len(self._buffer)))
+            buffer[:self.size] = self._buffer[:self.size]
+            self._buffer = buffer
+        self._buffer[self.size:needed] = values
+        self.size = needed
+
+    @property
+    def data(self):
+        return self._buffer[:self.size]
+
+class TraceTail:
+    """
+    Reads the rows appended to a trace file since the previous read
+
+    CSV files are followed by byte offset and only complete lines are parsed; a header
+    row selects the columns by name. .npy files are memory-mapped again at every read,
+    so the writer must keep the header shape up to date.
+    """
+    def __init__(self, path, x_col=None, y_col=None):
+        self.path = path
+        self.x_col = x_col
+        self.y_col = y_col
+        self.is_npy = path.lower().endswith('.npy')
+        self.offset = 0
+        self.rows_read = 0
+        self.columns = None
+
+    def _select(self, header):
+        if self.x_col and self.y_col:
+            for col in (self.x_col, self.y_col):
+                if col not in header:
+                    raise ValueError(f"Column '{col}' not found in the file.")
+            return header.index(self.x_col), header.index(self.y_col)
+        return 0, 1
+
+    def read_new(self):
+        """
+        Rows appended since the last call
+
+        Returns:
+            tuple: (time values, signal values), empty when nothing complete was added
+        """
+        if self.is_npy:
+            try:
+                data = np.load(self.path, mmap_mode='r')
+            except (ValueError, OSError):
+                # The writer is between appending rows and updating the header
+                return np.empty(0), np.empty(0)
+            rows = np.array(data[self.rows_read:, :2], dtype=float)
+            self.rows_read += len(rows)
+            return rows[:, 0], rows[:, 1]
+
+        if os.path.getsize(self.path) <= self.offset:
+            return np.empty(0), np.empty(0)
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+        # A partial last line is left for the next read
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return np.empty(0), np.empty(0)
+        self.offset += end
+        text = chunk[:end].decode('utf-8', errors='replace')
+
+        if self.columns is None:
+            first_line, _, rest = text.partition('\n')
+            fields = [field.strip() for field in first_line.split(',')]
+            try:
+                [float(field) for field in fields]
+                self.columns = self._select([])
+            except ValueError:
+                self.columns = self._select(fields)
+                text = rest
+        if not text.strip():
+            return np.empty(0), np.empty(0)
+
+        rows = np.loadtxt(io.StringIO(text), delimiter=',', usecols=self.columns, ndmin=2)
+        return rows[:, 0], rows[:, 1]
+
+class IncrementalBaseline:
+    """
+    Rolling-percentile baseline of calculate_baseline, extended as samples arrive
+
+    Sample i >= window uses the window before it, which is complete as soon as i arrives;
+    the first window samples use the window after them and are settled once 2·window
+    samples exist. Values equal those of calculate_baseline on the same samples.
+    """
+    def __init__(self, window_size, percentile):
+        self.window = int(window_size)
+        self.percentile = float(percentile)
+        self.values = GrowingArray()
+
+    @property
+    def final_count(self):
+        return self.values.size
+
+    def extend(self, signal):
+        """
+        Settle the baseline of every sample of signal that can be settled
+
+        Args:
+            signal: Whole signal received so far
+
+        Returns:
+            int: Number of samples with a settled baseline
+        """
+        n, w = len(signal), self.window
+        start = self.values.size
+        if n < 2 * w or n <= start:
+            return start
+
+        if start == 0:
+            # Forward windows of the first samples
+            self.values.extend(rolling_baseline(signal[:2 * w - 1], w, self.percentile)[:w])
+            start = w
+        # Backward windows: sample i uses signal[i - w:i]
+        self.values.extend(rolling_baseline(signal[start - w:n], w, self.percentile, from_start=False)[w:])
+        return self.values.size
+
+class LiveTracker:
+    """
+    Online ΔF/F, peak detection and event fits of a growing trace, without any UI
+
+    Args:
+        baseline_window: Window of the rolling baseline in samples
+        baseline_percentile: Percentile of the rolling baseline
+        peak_threshold: Minimum ΔF/F peak height
+        min_distance: Minimum distance between peaks in samples
+        convert_to_df_f: Convert the signal to ΔF/F (None: decide like load_file, from the mean)
+        lookback: Samples before the unscanned tail included in every detection pass
+        pre_samples: Samples before a peak searched for its onset
+        post_samples: Samples after a peak used for its decay
+    """
+    def __init__(self, baseline_window=50, baseline_percentile=30, peak_threshold=0.1, min_distance=4,
+                 convert_to_df_f=None, lookback=None, pre_samples=50, post_samples=200):
+        self.time = GrowingArray()
+        self.signal = GrowingArray()
+        self.df_f = GrowingArray()
+        # Raw signal baseline for the ΔF/F conversion and the Baseline column, ΔF/F baseline
+        # for the fits, band limits and metrics (app.baseline_values, as calculate_baseline sets it)
+        self.baseline = IncrementalBaseline(baseline_window, baseline_percentile)
+        self.df_f_baseline = IncrementalBaseline(baseline_window, baseline_percentile)
+        self.peak_threshold = float(peak_threshold)
+        self.min_distance = max(int(min_distance or 1), 1)
+        self.convert_to_df_f = convert_to_df_f
+        self.pre_samples = int(pre_samples)
+        self.post_samples = int(post_samples)
+        self.lookback = int(lookback) if lookback else max(self.pre_samples, self.min_distance) * 4
+
+        self.peaks = []
+        self.fits = {}
+        self.n_fallbacks = 0
+        self.scanned = 0
+
+    def append(self, time_values, signal_values):
+        """
+        Add new samples and process the tail
+
+        Returns:
+            tuple: (indices of the newly confirmed peaks, fit results of newly fitted peaks
+                    as returned by fit_events, with start/stop indices in the whole trace, the
+                    positions of the converged events in 'fitted' and of the events fitted
+                    separately in 'fallback')
+        """
+        if len(time_values) == 0:
+            return [], None
+        self.time.extend(time_values)
+        self.signal.extend(signal_values)
+
+        signal = self.signal.data
+        settled_before = self.df_f.size
+        settled = self.baseline.extend(signal)
+        if settled > settled_before:
+            if self.convert_to_df_f is None:
+                self.convert_to_df_f = signal[:settled].mean() > 3
+            tail = signal[settled_before:settled]
+            if self.convert_to_df_f:
+                baseline = self.baseline.values.data[settled_before:settled]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    tail = np.nan_to_num((tail - baseline) / baseline, nan=0.0, posinf=0.0, neginf=0.0)
+            self.df_f.extend(tail)
+            self.df_f_baseline.extend(self.df_f.data)
+
+        return self._detect(), self._fit()
+
+    def _detect(self):
+        from scipy.signal import find_peaks
+
+        df_f = self.df_f.data
+        # A peak is only confirmed once the samples that could still outgrow it have arrived
+        confirm_end = len(df_f) - self.min_distance - 1
+        if confirm_end <= self.scanned:
+            return []
+
+        low = max(0, self.scanned - self.lookback)
+        peaks, _ = find_peaks(df_f[low:], height=self.peak_threshold, distance=self.min_distance)
+        peaks = peaks + low
+        new_peaks = peaks[(peaks >= self.scanned) & (peaks < confirm_end)].tolist()
+        if self.peaks and new_peaks:
+            # The look-back can let find_peaks keep a lower peak next to an earlier confirmed one
+            new_peaks = [peak for peak in new_peaks if peak - self.peaks[-1] >= self.min_distance]
+        self.peaks.extend(new_peaks)
+        self.scanned = confirm_end
+        return new_peaks
+
+    def _fit(self):
+        n = len(self.df_f.data)
+        peaks = np.asarray(self.peaks, dtype=int)
+        # Ready: decay window complete, or cut by the next peak
+        ready = [
+            k for k, peak in enumerate(self.peaks)
+            if peak not in self.fits and (k + 1 < len(self.peaks) or peak + self.post_samples < n)
+        ]
+        if not ready:
+            return None
+
+        # Only the part of the trace the windows can reach is passed to the fitter; decays end
+        # in the baseline band of that part
+        low = max(0, peaks[ready[0]] - self.pre_samples)
+        local = np.flatnonzero(peaks >= low)
+        time_values, values = self.time.data[low:n], self.df_f.data[low:n]
+        baseline = self.df_f_baseline.values.data[low:n]
+        result = fit_events(
+            time_values, values, peaks[local] - low,
+            pre_samples=self.pre_samples, post_samples=self.post_samples,
+            subset=np.searchsorted(local, ready),
+            band_samples=decay_band_samples(values, baseline, peaks[local] - low)
+        )
+        result['start'] = result['start'] + low
+        result['stop'] = result['stop'] + low
+
+        ok = result['converged'] & np.isfinite(result['tau_rise']) & np.isfinite(result['tau_decay'])
+        fitted, fallback = [], []
+        for k, position in zip(ready, np.searchsorted(local, ready)):
+            self.fits[self.peaks[k]] = position
+            (fitted if ok[position] else fallback).append(position)
+
+        # Events the model does not converge for get the separate fits
+        if fallback:
+            tau_rise, tau_decay, _, _ = fit_separately(
+                time_values, values, baseline, peaks[local] - low, fallback, self.pre_samples
+            )
+            result['tau_rise'][fallback] = tau_rise
+            result['tau_decay'][fallback] = tau_decay
+            self.n_fallbacks += len(fallback)
+        result['fitted'] = fitted
+        result['fallback'] = fallback
+        result['peaks'] = peaks[local]
+        return result
+
+def show_live_status(app, text):
+    """
+    Show the live event count and rate next to the Live button
+    """
+    if getattr(app, 'live_status_label', None) is not None:
+        app.live_status_label.configure(text=text)
+
+def _live_frame(app):
+    """
+    One frame of the live mode: read the tail, process it and refresh the plot and table
+    """
+    import pandas as pd
+
+    live = app.live_acquisition
+    if live is None:
+        return
+    instrumentation = get_instrumentation(app)
+    tracker = live['tracker']
+
+    try:
+        with instrumentation.stage("live/read"):
+            time_values, signal_values = live['tail'].read_new()
+        with instrumentation.stage("live/process"):
+            new_peaks, fits = tracker.append(time_values, signal_values)
+    except (OSError, ValueError) as e:
+        stop_live_acquisition(app)
+        show_live_status(app, f"Live mode stopped: {e}")
+        return
+
+    n = tracker.df_f.size
+    if n > (0 if app.df_f is None else len(app.df_f)):
+        # Views of the growing buffers, no copy; the earlier samples are unchanged, so the
+        # memoized table quantities only extend over the new ones
+        grown = app.df_f is not None
+        app.time = pd.Series(tracker.time.data[:n], copy=False)
+        app.df_f = pd.Series(tracker.df_f.data, copy=False)
+        app.raw_values = pd.Series(tracker.signal.data[:n], copy=False)
+        app.baseline_values = tracker.df_f_baseline.values.data
+        app.raw_baseline = tracker.baseline.values.data[:n]
+        if grown:
+            get_trace_context(app).grow(*INPUTS)
+
+    if n > 0:
+        live['line'].set_data(tracker.time.data[:n], tracker.df_f.data)
+        t_end = tracker.time.data[n - 1]
+        t_start = max(tracker.time.data[0], t_end - live['span'])
+        app.ax.set_xlim(t_start, t_end)
+        visible = tracker.df_f.data[np.searchsorted(tracker.time.data[:n], t_start):]
+        if len(visible) > 1 and visible.max() > visible.min():
+            margin = 0.05 * (visible.max() - visible.min())
+            app.ax.set_ylim(visible.min() - margin, visible.max() + margin)
+
+    for peak_index in new_peaks:
+        peak = (app.time.iloc[peak_index], app.df_f.iloc[peak_index])
+        app.points.append(app.ax.plot(peak[0], peak[1], 'ro')[0])
+        app.marked_peaks.append(peak)
+        app.rise_calculated.append(False)
+        app.decay_calculated.append(False)
+
+    if fits is not None:
+        for position in fits['fitted']:
+            i = tracker.peaks.index(int(fits['peaks'][position]))
+            peak = app.marked_peaks[i]
+            app.rise_times[peak] = float(fits['tau_rise'][position])
+            app.tau_values[peak] = float(fits['tau_decay'][position])
+            app.amplitudes[peak] = float(peak_amplitude(fits['amplitude'][position], fits['tau_rise'][position], fits['tau_decay'][position]))
+            set_tau_source(app, peak, 'rise', EVENT_MODEL)
+            set_tau_source(app, peak, 'decay', EVENT_MODEL)
+            app.rise_calculated[i] = True
+            app.decay_calculated[i] = True
+            draw_event_fit(app, peak, fits, position)
+        for position in fits['fallback']:
+            i = tracker.peaks.index(int(fits['peaks'][position]))
+            peak = app.marked_peaks[i]
+            if np.isfinite(fits['tau_rise'][position]):
+                app.rise_times[peak] = float(fits['tau_rise'][position])
+                set_tau_source(app, peak, 'rise', EXPONENTIAL_MODEL)
+                app.rise_calculated[i] = True
+            if np.isfinite(fits['tau_decay'][position]):
+                app.tau_values[peak] = float(fits['tau_decay'][position])
+                set_tau_source(app, peak, 'decay', EXPONENTIAL_MODEL)
+                app.decay_calculated[i] = True
+        instrumentation.count("event_fit_fallbacks", len(fits['fallback']))
+        if fits['fitted'] or fits['fallback']:
+            app.update_table()
+
+    elapsed = t_end - tracker.time.data[0] if n > 0 else 0
+    rate = 60 * len(tracker.peaks) / elapsed if elapsed > 0 else 0
+    status = f"{len(tracker.peaks)} events · {rate:.1f}/min"
+    if tracker.n_fallbacks:
+        status += f" · {tracker.n_fallbacks} fitted separately"
+    show_live_status(app, status)
+    app.canvas.draw_idle()
+
+    live['job'] = app.after(live['interval_ms'], lambda: _live_frame(app))
+
+def start_live_acquisition(app):
+    """
+    Ask for the live settings and the file to follow, then start polling it
+
+    Args:
+        app: Main application instance
+    """
+    from tkinter import filedialog
+    from core.app_state import clear_plot
+    from ui.dialogs import LiveAcquisitionDialog
+
+    dialog = LiveAcquisitionDialog(
+        app,
+        x_col=app.last_x_col,
+        y_col=app.last_y_col,
+        baseline_window_size=app.last_baseline_window_size or "50",
+        baseline_percentage=app.last_baseline_percentage or "30",
+        peak_threshold=app.last_peak_threshold,
+        min_distance=app.last_min_distance,
+        frame_rate=app.last_live_frame_rate,
+        span=app.last_live_span
+    )
+    app.wait_window(dialog)
+    if dialog.user_cancelled:
+        return
+
+    file_path = filedialog.askopenfilename(filetypes=[("Trace files", "*.csv *.npy"), ("All files", "*.*")])
+    if not file_path:
+        return
+
+    app.last_x_col = dialog.x_col
+    app.last_y_col = dialog.y_col
+    app.last_baseline_window_size = dialog.baseline_window_size
+    app.last_baseline_percentage = dialog.baseline_percentage
+    app.last_peak_threshold = dialog.peak_threshold
+    app.last_min_distance = dialog.min_distance
+    app.last_live_frame_rate = dialog.frame_rate
+    app.last_live_span = dialog.span
+
+    clear_plot(app, reset_data=True)
+    app.ax.clear()
+    app.ax.grid(True)
+    line, = app.ax.plot([], [], color='black')
+    pre_samples = int(app.last_peak_onset_window) if app.last_peak_onset_window else 50
+
+    app.source_path = file_path
+    app.convert_to_df_f = True
+    app.evoked_status = "off"
+    app.live_acquisition = {
+        'tail': TraceTail(file_path, dialog.x_col or None, dialog.y_col or None),
+        'tracker': LiveTracker(
+            baseline_window=int(dialog.baseline_window_size),
+            baseline_percentile=float(dialog.baseline_percentage),
+            peak_threshold=float(dialog.peak_threshold),
+            min_distance=int(float(dialog.min_distance)) if dialog.min_distance else 4,
+            pre_samples=pre_samples,
+            post_samples=4 * pre_samples
+        ),
+        'line': line,
+        'span': float(dialog.span),
+        'interval_ms': max(int(1000 / float(dialog.frame_rate)), 10),
+        'job': None,
+    }
+    _live_frame(app)
+
+def stop_live_acquisition(app):
+    """
+    Stop polling and keep the received trace as a regular session
+
+    Args:
+        app: Main application instance
+    """
+    import pandas as pd
+
+    live = getattr(app, 'live_acquisition', None)
+    if live is None:
+        return
+    if live['job'] is not None:
+        app.after_cancel(live['job'])
+    app.live_acquisition = None
+
+    tracker = live['tracker']
+    n = tracker.df_f.size
+    if n == 0:
+        return
+    # Own copies, detached from the growing buffers
+    app.time = pd.Series(tracker.time.data[:n].copy())
+    app.df_f = pd.Series(tracker.df_f.data.copy())
+    app.raw_values = pd.Series(tracker.signal.data[:n].copy())
+    app.baseline_values = tracker.df_f_baseline.values.data.copy()
+    app.raw_baseline = tracker.baseline.values.data[:n].copy()
+    draw_overview(app)
+    app.update_table()
+    app.canvas.draw_idle()
@@ -0,0 +1,16 @@
+from tkinter import messagebox
+
+def show_warning(app, message, title="Warning"):
+    """
+    Show a warning dialog, or hand the warning to the application when it runs without a GUI
+
+    Args:
+        app: Main application instance (or a headless session defining report_warning)
+        message: Warning text
+        title: Dialog title
+    """
+    report_warning = getattr(app, 'report_warning', None)
+    if report_warning is not None:
+        report_warning(title, message)
+    else:
+        messagebox.showwarning(title=title, message=message)
@@ -0,0 +1,329 @@
+"""
+Parameter sweep over baseline and detection settings
+
+Each (window, percentile) pair re-derives the analysed trace from the raw signal
+the way Load File does, so the baseline settings change the detected peaks as they
+do in the app. Shared intermediates are computed once: one trace, baseline and
+candidate-peak cache per pair, and one rise/decay fit per distinct peak set of a
+pair (neighbouring thresholds often select the same peaks). Without a raw signal
+every pair detects on the loaded trace, which the report states. The ΔF/F statistics
+are those of the peak table's ΔF/F column (peak_delta_f_f) for each pair.
+Baselines and fits are spread over worker processes.
+"""
+import itertools
+import numpy as np
+
+# Columns of the sweep report, in order
+SWEEP_COLUMNS = (
+    "Baseline Window", "Baseline Percentile", "Peak Height", "Min Distance", "Width",
+    "Peaks", "Mean ΔF/F", "SD ΔF/F",
+    "Rise Fits", "τ (rise) Mean", "τ (rise) Median", "τ (rise) Q1", "τ (rise) Q3",
+    "Decay Fits", "τ (decay) Mean", "τ (decay) Median", "τ (decay) Q1", "τ (decay) Q3",
+    "Detection Trace",
+)
+
+# Detection Trace column: where the peaks of a combination were detected
+REDERIVED_TRACE = "Re-derived from the raw signal for this baseline"
+LOADED_TRACE = "Loaded trace (raw signal unavailable)"
+
+# Trace shared by all tasks of a worker process, set once by the pool initializer
+_worker_trace = {}
+
+def _init_worker(time_values, values, peak_onset_window, raw_signal=None, conversion=None):
+    _worker_trace['time'] = time_values
+    _worker_trace['values'] = values
+    _worker_trace['peak_onset_window'] = peak_onset_window
+    _worker_trace['raw_signal'] = raw_signal
+    _worker_trace['conversion'] = conversion or {}
+
+def _new_session(baseline_window, baseline_percentile, values=None):
+    from core.headless_session import HeadlessSession
+
+    return HeadlessSession(
+        _worker_trace['time'],
+        _worker_trace['values'] if values is None else values,
+        baseline_window_size=baseline_window,
+        baseline_percentage=baseline_percentile,
+        peak_onset_window=_worker_trace['peak_onset_window'],
+        draw=False
+    )
+
+def _baseline_task(baseline_window, baseline_percentile):
+    """
+    Trace, baseline and candidate peaks of one baseline pair
+
+    Returns:
+        tuple: (trace re-derived from the raw signal, or None when the loaded trace is used,
+                baseline of the trace, its PeakCandidates or None for the loaded trace,
+                baseline the table reads the raw signal against, None when it reads the
+                trace as ΔF/F)
+    """
+    from core.calculate_baseline import calculate_baseline
+    from core.peak_candidates import PeakCandidates
+    from core.signal_conversion import convert_trace
+
+    trace = raw_baseline = None
+    if _worker_trace['raw_signal'] is not None:
+        conversion = _worker_trace['conversion']
+        converted = convert_trace(
+            _worker_trace['raw_signal'], baseline_window, baseline_percentile,
+            keep_raw_baseline=not conversion.get('convert_to_df_f', True), **conversion
+        )
+        trace = np.asarray(converted['df_f'], dtype=float)
+        if not converted['convert_to_df_f']:
+            # As build_table_rows: the raw baseline, or the baseline of the load without one
+            raw_baseline = converted['raw_baseline'] if converted['raw_baseline'] is not None else converted['baseline_values']
+            raw_baseline = np.asarray(raw_baseline, dtype=float)
+
+    session = _new_session(baseline_window, baseline_percentile, trace)
+    calculate_baseline(session, window_size=baseline_window, percentile=baseline_percentile)
+    baseline = np.asarray(session.baseline_values, dtype=float)
+    return trace, baseline, None if trace is None else PeakCandidates(trace), raw_baseline
+
+def _fit_task(baseline_window, baseline_percentile, trace, baseline, peaks):
+    """
+    Rise and decay taus of one peak set, using the existing fitters on a headless session
+
+    Returns:
+        tuple: (peak indices kept by the fitters, rise taus, decay taus) with NaN for failed fits
+    """
+    from core.apply_threshold import mark_peaks
+    from core.calculate_rise import calculate_rise
+    from core.calculate_decay import calculate_decay
+
+    session = _new_session(baseline_window, baseline_percentile, trace)
+    session.baseline_values = baseline
+    if len(peaks) > 0:
+        mark_peaks(session, peaks)
+        calculate_rise(session, no_draw=True, recalculate_baseline=False)
+        calculate_decay(session, no_draw=True)
+
+    # calculate_rise may drop peaks whose onset cannot be found
+    peak_times = np.array([peak[0] for peak in session.marked_peaks], dtype=float)
+    kept = np.searchsorted(session.time.values, peak_times)
+    rise = [_as_tau(session.rise_times.get(peak)) for peak in session.marked_peaks]
+    decay = [_as_tau(session.tau_values.get(peak)) for peak in session.marked_peaks]
+    return kept, np.array(rise, dtype=float), np.array(decay, dtype=float)
+
+def _as_tau(value):
+    return float(value) if isinstance(value, (int, float, np.floating)) else np.nan
+
+def _parallel_map(function, arg_lists, executor, progress=None):
+    """
+    Apply the function to every argument tuple, in the worker processes when an executor is given,
+    reporting the fraction of finished calls
+    """
+    from concurrent.futures import as_completed
+
+    arg_tuples = list(zip(*arg_lists))
+    total = max(len(arg_tuples), 1)
+    if executor is None:
+        results = []
+        for args in arg_tuples:
+            results.append(function(*args))
+            if progress is not None:
+                progress(len(results) / total)
+        return results
+
+    futures = [executor.submit(function, *args) for args in arg_tuples]
+    for done, _ in enumerate(as_completed(futures), start=1):
+        if progress is not None:
+            progress(done / total)
+    return [future.result() for future in futures]
+
+def build_grid(baseline_windows, baseline_percentiles, peak_thresholds, min_distances=(None,), widths=(None,)):
+    """
+    All combinations of the swept settings
+
+    Returns:
+        list: (baseline window, baseline percentile, peak threshold, min distance, width) tuples
+    """
+    return list(itertools.product(
+        [int(w) for w in baseline_windows],
+        [float(p) for p in baseline_percentiles],
+        [float(h) for h in peak_thresholds],
+        list(min_distances) or [None],
+        list(widths) or [None],
+    ))
+
+def summarize_distribution(values):
+    """
+    Count, mean, median and quartiles of the finite values
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0, np.nan, np.nan, np.nan, np.nan
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return int(values.size), float(values.mean()), float(median), float(q1), float(q3)
+
+def run_parameter_sweep(time_values, values, grid, peak_onset_window="", max_workers=None, progress=None,
+                        raw_signal=None, conversion=None):
+    """
+    Evaluate every combination of the grid on one trace
+
+    Args:
+        time_values: Sample times
+        values: Loaded trace (ΔF/F as displayed), detected on when there is no raw signal
+        grid: Combinations returned by build_grid
+        peak_onset_window: Onset search window passed to the rise fitter
+        max_workers: Number of worker processes, 1 runs everything in this process
+        progress: Optional callback receiving the fraction of work done
+        raw_signal: Raw signal the trace was loaded from, re-derived for every baseline pair
+        conversion: Other convert_trace arguments of the load (convert_to_df_f, rfp,
+                    rfp_smoothing_window)
+
+    Returns:
+        list: One row per combination with the values of SWEEP_COLUMNS
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from core.peak_candidates import PeakCandidates
+    from utils.table_operations_utils import peak_delta_f_f
+
+    time_values = np.asarray(time_values, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if raw_signal is not None:
+        raw_signal = np.asarray(raw_signal, dtype=float)
+    detection_trace = LOADED_TRACE if raw_signal is None else REDERIVED_TRACE
+    pairs = sorted({(window, percentile) for window, percentile, *_ in grid})
+
+    executor = None
+    if max_workers != 1:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(time_values, values, peak_onset_window, raw_signal, conversion)
+        )
+    else:
+        _init_worker(time_values, values, peak_onset_window, raw_signal, conversion)
+
+    try:
+        derived = dict(zip(pairs, _parallel_map(
+            _baseline_task,
+            ([w for w, _ in pairs], [p for _, p in pairs]),
+            executor,
+            None if progress is None else lambda fraction: progress(0.3 * fraction)
+        )))
+
+        # Without a raw signal every pair detects on the loaded trace: one shared cache
+        shared_candidates = PeakCandidates(values) if raw_signal is None else None
+
+        # Distinct peak sets per baseline pair: identical sets are fitted once
+        combo_keys = []
+        fit_jobs = {}
+        for window, percentile, threshold, distance, width in grid:
+            candidates = derived[(window, percentile)][2] or shared_candidates
+            peaks = candidates.select(threshold, distance or None, width or None)
+            key = (window, percentile, peaks.tobytes())
+            fit_jobs.setdefault(key, peaks)
+            combo_keys.append(key)
+
+        jobs = list(fit_jobs.items())
+        fits = _parallel_map(
+            _fit_task,
+            (
+                [key[0] for key, _ in jobs],
+                [key[1] for key, _ in jobs],
+                [derived[key[:2]][0] for key, _ in jobs],
+                [derived[key[:2]][1] for key, _ in jobs],
+                [peaks for _, peaks in jobs],
+            ),
+            executor,
+            None if progress is None else lambda fraction: progress(0.3 + 0.7 * fraction)
+        )
+        fits = dict(zip([key for key, _ in jobs], fits))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    rows = []
+    for (window, percentile, threshold, distance, width), key in zip(grid, combo_keys):
+        kept, rise, decay = fits[key]
+        trace, _, _, raw_baseline = derived[key[:2]]
+        trace = values if trace is None else trace
+        # ΔF/F of the peaks as the table reports it; without a raw signal, the loaded trace
+        if raw_baseline is None:
+            delta_f_f = trace[kept]
+        else:
+            delta_f_f = peak_delta_f_f(trace[kept], raw_signal[kept], raw_baseline[kept], df_f_table=False)
+        rows.append((
+            window, percentile, threshold, distance, width,
+            len(kept),
+            float(delta_f_f.mean()) if delta_f_f.size else np.nan,
+            float(delta_f_f.std()) if delta_f_f.size else np.nan,
+            *summarize_distribution(rise),
+            *summarize_distribution(decay),
+            detection_trace,
+        ))
+    return rows
+
+def sweep_parameters(app):
+    """
+    Ask for a parameter grid, sweep it over the loaded trace and export the report to Excel
+
+    Args:
+        app: Main application instance
+    """
+    import pandas as pd
+    from tkinter import filedialog, messagebox
+    from ui.dialogs import ParameterSweepDialog
+    from core.progress import get_progress_reporter
+
+    raw_signal = getattr(app, 'raw_values', None)
+    raw_rfp = getattr(app, 'raw_rfp', None)
+    conversion = {
+        'convert_to_df_f': app.convert_to_df_f,
+        'rfp': None if raw_rfp is None else np.asarray(raw_rfp, dtype=float),
+        'rfp_smoothing_window': int(app.last_RFP_smoothing_window_size) if app.last_RFP_smoothing_window_size else None,
+    }
+
+    dialog = ParameterSweepDialog(
+        app,
+        rederive=raw_signal is not None,
+        baseline_windows=app.last_baseline_window_size or "50",
+        baseline_percentiles=app.last_baseline_percentage or "30",
+        peak_thresholds=app.last_peak_threshold,
+        min_distances=app.last_min_distance,
+        widths=app.last_width
+    )
+    app.wait_window(dialog)
+    if dialog.user_cancelled or dialog.grid_values is None:
+        return
+
+    values = dialog.grid_values
+    grid = build_grid(
+        values['baseline_windows'],
+        values['baseline_percentiles'],
+        values['peak_thresholds'],
+        values['min_distances'] or [None],
+        values['widths'] or [None]
+    )
+
+    progress = get_progress_reporter(app)
+    progress(0)
+    try:
+        rows = run_parameter_sweep(
+            app.time.values,
+            app.df_f.values,
+            grid,
+            peak_onset_window=app.last_peak_onset_window,
+            max_workers=dialog.max_workers,
+            progress=progress,
+            raw_signal=None if raw_signal is None else raw_signal.values,
+            conversion=conversion
+        )
+    except Exception as e:
+        messagebox.showerror(title="Error", message=f"Parameter sweep failed: {str(e)}")
+        app.progress_bar.set(0)
+        return
+    progress.finish()
+
+    file_path = filedialog.asksaveasfilename(
+        defaultextension=".xlsx",
+        filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")],
+        initialfile="parameter_sweep.xlsx"
+    )
+    if file_path:
+        pd.DataFrame(rows, columns=SWEEP_COLUMNS).to_excel(file_path, index=False)
+        messagebox.showinfo("Success", f"{len(rows)} combinations exported to {file_path}")
+    app.after(500, lambda: app.progress_bar.set(0))
@@ -0,0 +1,287 @@
+import numpy as np
+from core.calculate_rise import rise_function
+from core.calculate_decay import decay_function
+
+def peak_indices_from_times(time_values, peak_times):
+    """
+    Convert peak times into sample indices of the (ascending) time array
+
+    Args:
+        time_values: Sorted array of sample times
+        peak_times: Sequence of peak times
+
+    Returns:
+        np.ndarray: Integer index of each peak
+    """
+    time_values = np.asarray(time_values)
+    indices = np.searchsorted(time_values, np.asarray(peak_times, dtype=float))
+    return np.clip(indices, 0, len(time_values) - 1)
+
+def group_first_peaks(peak_indices, peak_num):
+    """
+    Keep the first peak of every complete group of peak_num peaks,
+    using the same grouping as the partition lines
+
+    Args:
+        peak_indices: Sorted peak indices
+        peak_num: Number of peaks per group
+
+    Returns:
+        np.ndarray: Index of the first peak of each complete group
+    """
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    n_groups = len(peak_indices) // peak_num
+    return peak_indices[:n_groups * peak_num:peak_num]
+
+def align_peak_windows(values, peak_indices, pre_samples, post_samples):
+    """
+    Cut one window per peak out of the trace in a single fancy-indexing pass
+
+    Args:
+        values: Trace values
+        peak_indices: Alignment index of each sweep
+        pre_samples: Number of samples kept before the alignment point
+        post_samples: Number of samples kept after the alignment point
+
+    Returns:
+        tuple: (offsets, sweeps) where sweeps has shape (n_peaks, pre + post + 1)
+               and samples falling outside the recording are NaN
+    """
+    values = np.asarray(values, dtype=float)
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    offsets = np.arange(-int(pre_samples), int(post_samples) + 1)
+
+    index_grid = peak_indices[:, None] + offsets[None, :]
+    inside = (index_grid >= 0) & (index_grid < len(values))
+
+    sweeps = np.full(index_grid.shape, np.nan)
+    sweeps[inside] = values[index_grid[inside]]
+    return offsets, sweeps
+
+def robust_zscores(sweeps):
+    """
+    Robust z-score of every sweep based on its RMS distance to the median sweep
+
+    Args:
+        sweeps: Array of shape (n_sweeps, n_samples)
+
+    Returns:
+        np.ndarray: One score per sweep (0 when the spread is degenerate)
+    """
+    median_sweep = np.nanmedian(sweeps, axis=0)
+    distances = np.sqrt(np.nanmean((sweeps - median_sweep) ** 2, axis=1))
+
+    median_distance = np.nanmedian(distances)
+    mad = np.nanmedian(np.abs(distances - median_distance))
+    if not np.isfinite(mad) or mad == 0:
+        return np.zeros(len(sweeps))
+
+    # 0.6745 makes the MAD consistent with the standard deviation of a normal distribution
+    return 0.6745 * (distances - median_distance) / mad
+
+def _fit_tau(function, t_data, y_data):
+    """
+    Fit a single-exponential tau with the normalization used by calculate_rise / calculate_decay
+    """
+    from scipy.optimize import curve_fit
+
+    t_range = t_data - t_data[0]
+    t_scale = t_range.max()
+    if t_scale <= 0 or len(t_range) < 3:
+        return np.nan
+
+    y_scale = max(np.max(y_data) - np.min(y_data), 0.01)
+    y0_norm = y_data[0] / y_scale
+
+    try:
+        popt, _ = curve_fit(
+            lambda t, tau_norm: function(t * t_scale, tau_norm * t_scale, y0_norm),
+            t_range / t_scale,
+            y_data / y_scale,
+            p0=[0.5],
+            bounds=(0.0001, np.inf)
+        )
+    except (RuntimeError, ValueError):
+        return np.nan
+    return popt[0] * t_scale
+
+def average_kinetics(time_offsets, mean_trace, pre_samples):
+    """
+    Amplitude, rise tau and decay tau of the averaged event
+
+    Args:
+        time_offsets: Time of each sample relative to the alignment point
+        mean_trace: Averaged trace
+        pre_samples: Index of the alignment point within the trace
+
+    Returns:
+        dict: amplitude, baseline, onset_time, tau_rise and tau_decay, all NaN when the
+              average has no finite value up to the alignment point
+    """
+    pre_samples = int(pre_samples)
+    if not np.isfinite(mean_trace[:pre_samples + 1]).any():
+        # Nothing was averaged before the alignment point (every sweep rejected)
+        return dict.fromkeys(('amplitude', 'baseline', 'onset_time', 'tau_rise', 'tau_decay'), np.nan)
+    peak_value = mean_trace[pre_samples]
+
+    # Onset is the lowest point before the alignment point, as in the per-peak rise search
+    onset = int(np.nanargmin(mean_trace[:pre_samples + 1]))
+    baseline = np.nanmean(mean_trace[:onset + 1])
+
+    # Rise: the exponential growth model needs a positive start value
+    rise_y = np.array(mean_trace[onset:pre_samples + 1], dtype=float)
+    if len(rise_y) > 0 and rise_y[0] <= 0:
+        rise_y = rise_y + abs(rise_y[0]) + 0.001
+    tau_rise = _fit_tau(rise_function, time_offsets[onset:pre_samples + 1], rise_y) if len(rise_y) > 2 else np.nan
+
+    # Decay: from the alignment point to the end of the window
+    decay_y = np.array(mean_trace[pre_samples:], dtype=float)
+    if len(decay_y) > 0 and (np.isnan(decay_y[0]) or decay_y[0] == 0):
+        decay_y[0] = 0.001
+    decay_y = np.nan_to_num(decay_y, nan=baseline)
+    tau_decay = _fit_tau(decay_function, time_offsets[pre_samples:], decay_y) if len(decay_y) > 2 else np.nan
+
+    return {
+        'amplitude': peak_value - baseline,
+        'baseline': baseline,
+        'onset_time': time_offsets[onset],
+        'tau_rise': tau_rise,
+        'tau_decay': tau_decay,
+    }
+
+def peak_triggered_average(time_values, values, peak_indices, pre_samples, post_samples, outlier_z=None):
+    """
+    Peak-triggered average of a trace with optional robust outlier rejection
+
+    Args:
+        time_values: Sample times (used for the sample interval)
+        values: Trace values
+        peak_indices: Alignment index of each sweep
+        pre_samples: Number of samples before the alignment point
+        post_samples: Number of samples after the alignment point
+        outlier_z: Reject sweeps whose robust z-score exceeds this value (None disables rejection)
+
+    Returns:
+        dict: Aligned sweeps, keep mask, mean/SEM trace and kinetics of the average (NaN
+              when every sweep is rejected), or None when there is nothing to average
+    """
+    peak_indices = np.asarray(peak_indices, dtype=int)
+    if peak_indices.size == 0:
+        return None
+
+    offsets, sweeps = align_peak_windows(values, peak_indices, pre_samples, post_samples)
+
+    if outlier_z is not None and len(sweeps) >= 3:
+        z_scores = robust_zscores(sweeps)
+        keep = np.abs(z_scores) <= outlier_z
+    else:
+        z_scores = np.zeros(len(sweeps))
+        keep = np.ones(len(sweeps), dtype=bool)
+
+    kept = sweeps[keep]
+    if len(kept):
+        mean_trace = np.nanmean(kept, axis=0)
+        counts = np.sum(~np.isnan(kept), axis=0)
+        sem_trace = np.nanstd(kept, axis=0) / np.sqrt(np.maximum(counts, 1))
+    else:
+        # Every sweep was rejected: no average, and kinetics left NaN
+        mean_trace = np.full(sweeps.shape[1], np.nan)
+        sem_trace = np.full(sweeps.shape[1], np.nan)
+
+    sample_interval = np.median(np.diff(np.asarray(time_values, dtype=float))) if len(time_values) > 1 else 1.0
+    time_offsets = offsets * sample_interval
+
+    return {
+        'peak_indices': peak_indices,
+        'offsets': offsets,
+        'time_offsets': time_offsets,
+        'sweeps': sweeps,
+        'z_scores': z_scores,
+        'keep': keep,
+        'mean': mean_trace,
+        'sem': sem_trace,
+        'kinetics': average_kinetics(time_offsets, mean_trace, pre_samples),
+    }
+
+def compute_peak_average(app, pre_samples, post_samples, align="peak", peak_num=None, outlier_z=None):
+    """
+    Peak-triggered average of the loaded trace, aligned on the marked peaks
+
+    Args:
+        app: Main application instance
+        pre_samples: Number of samples before each peak
+        post_samples: Number of samples after each peak
+        align: "peak" to align on every peak, "group" to align on the first peak of each group
+        peak_num: Number of peaks per group (required when align is "group")
+        outlier_z: Robust z-score cutoff for sweep rejection (None disables rejection)
+
+    Returns:
+        dict: Result of peak_triggered_average, also stored in app.peak_average
+    """
+    peak_times = sorted(peak[0] for peak in app.marked_peaks)
+    peak_indices = peak_indices_from_times(app.time.values, peak_times)
+    if align == "group":
+        peak_indices = group_first_peaks(peak_indices, int(peak_num))
+
+    app.peak_average = peak_triggered_average(
+        app.time.values, app.df_f.values, peak_indices, pre_samples, post_samples, outlier_z
+    )
+    return app.peak_average
+
+def draw_peak_average(app):
+    """
+    Draw the current peak-triggered average in an inset of the main axes
+
+    Args:
+        app: Main application instance
+    """
+    from matplotlib.collections import LineCollection
+
+    result = getattr(app, 'peak_average', None)
+    if result is None:
+        remove_peak_average(app)
+        return
+
+    if getattr(app, 'average_ax', None) is None:
+        app.average_ax = app.ax.inset_axes([0.66, 0.58, 0.32, 0.38])
+    ax = app.average_ax
+    ax.clear()
+
+    t = result['time_offsets']
+    keep = result['keep']
+
+    # All sweeps go into two collections so that redrawing is independent of the sweep count
+    kept_segments = [np.column_stack([t, sweep]) for sweep in result['sweeps'][keep]]
+    rejected_segments = [np.column_stack([t, sweep]) for sweep in result['sweeps'][~keep]]
+    ax.add_collection(LineCollection(kept_segments, colors='#bbbbbb', linewidths=0.6))
+    if rejected_segments:
+        ax.add_collection(LineCollection(rejected_segments, colors='#ff9999', linewidths=0.6))
+
+    ax.fill_between(t, result['mean'] - result['sem'], result['mean'] + result['sem'], color='black', alpha=0.15, linewidth=0)
+    ax.plot(t, result['mean'], color='black', linewidth=1.5)
+    ax.axvline(0, color='r', linestyle=':', linewidth=0.8)
+    ax.autoscale_view()
+
+    kinetics = result['kinetics']
+    ax.set_title(
+        "n={0}/{1}  A={2:.3g}  τr={3:.3g}  τd={4:.3g}".format(
+            int(keep.sum()), len(keep), kinetics['amplitude'], kinetics['tau_rise'], kinetics['tau_decay']
+        ),
+        fontsize=7
+    )
+    ax.tick_params(labelsize=6)
+    ax.patch.set_alpha(0.9)
+
+    app.canvas.draw()
+
+def remove_peak_average(app):
+    """
+    Remove the peak-triggered average inset and forget the last result
+
+    Args:
+        app: Main application instance
+    """
+    if getattr(app, 'average_ax', None) is not None:
+        app.average_ax.remove()
+        app.average_ax = None
+    app.peak_average = None
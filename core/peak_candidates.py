@@ -0,0 +1,132 @@
+import numpy as np
+from core.precision import as_float_array
+
+class PeakCandidates:
+    """
+    Every local maximum of a trace with the properties find_peaks filters on
+
+    find_peaks runs once without any condition; heights, prominences and widths
+    only depend on the trace and the peak itself, so any combination of height,
+    distance and width can then be answered from the cache with masks, giving
+    the same peaks as running find_peaks with those conditions.
+    """
+    def __init__(self, values):
+        from scipy.signal import find_peaks, peak_prominences, peak_widths
+
+        self.source = values
+        values = as_float_array(values)
+        self.peaks, _ = find_peaks(values)
+        self.heights = values[self.peaks]
+        prominence_data = peak_prominences(values, self.peaks)
+        self.prominences = prominence_data[0]
+        # Same relative height as the width condition of find_peaks
+        self.widths = peak_widths(values, self.peaks, rel_height=0.5, prominence_data=prominence_data)[0]
+
+    def select(self, peak_threshold, min_distance=None, width=None):
+        """
+        Peaks satisfying the conditions, in the order find_peaks applies them:
+        height, then distance, then width
+
+        Args:
+            peak_threshold: Minimum peak height, a scalar or one value per sample
+            min_distance: Minimum distance between peaks in samples (None to disable)
+            width: Minimum peak width in samples (None to disable)
+
+        Returns:
+            np.ndarray: Indices of the selected peaks
+        """
+        threshold = np.asarray(peak_threshold, dtype=float)
+        if threshold.ndim > 0:
+            threshold = threshold[self.peaks]
+        keep = self.heights >= threshold
+
+        if min_distance:
+            if min_distance < 1:
+                raise ValueError("`distance` must be greater or equal to 1")
+            selected = np.flatnonzero(keep)
+            kept_by_distance = select_by_distance(self.peaks[selected], self.heights[selected], min_distance)
+            keep[selected[~kept_by_distance]] = False
+
+        if width:
+            keep &= self.widths >= width
+
+        return self.peaks[keep]
+
+def select_by_distance(peaks, priority, distance):
+    """
+    Greedy distance selection of find_peaks: the highest peaks are kept first and
+    every lower peak closer than the distance to a kept one is dropped
+
+    Args:
+        peaks: Sorted peak indices
+        priority: Height of each peak
+        distance: Minimum distance in samples
+
+    Returns:
+        np.ndarray: Boolean mask of the peaks kept
+    """
+    try:
+        # Compiled loop used by find_peaks itself; private scipy API, so any change of its
+        # name, signature or result falls back to the loop below
+        from scipy.signal._peak_finding_utils import _select_by_peak_distance
+        keep = np.asarray(_select_by_peak_distance(
+            np.ascontiguousarray(peaks, dtype=np.intp), np.ascontiguousarray(priority, dtype=np.float64), float(distance)
+        ), dtype=bool)
+        if keep.shape == (len(peaks),):
+            return keep
+    except (ImportError, AttributeError, TypeError, ValueError):
+        pass
+
+    distance = np.ceil(distance)
+    keep = np.ones(len(peaks), dtype=bool)
+    # Same ordering as find_peaks, so that ties between equal heights resolve identically
+    for i in np.argsort(priority)[::-1]:
+        if not keep[i]:
+            continue
+        # Drop the lower neighbours on both sides within the distance
+        left = np.searchsorted(peaks, peaks[i] - distance, side='right')
+        right = np.searchsorted(peaks, peaks[i] + distance, side='left')
+        keep[left:i] = False
+        keep[i + 1:right] = False
+    return keep
+
+def get_peak_candidates(app):
+    """
+    Cached candidates of the loaded trace, rebuilt when a new trace is loaded
+
+    Args:
+        app: Main application instance
+    """
+    candidates = getattr(app, 'peak_candidates', None)
+    if candidates is None or candidates.source is not app.df_f:
+        candidates = PeakCandidates(app.df_f)
+        app.peak_candidates = candidates
+    return candidates
+
+def show_peak_preview(app, peaks):
+    """
+    Show the peaks that would be detected as one marker line, updated in place
+
+    Args:
+        app: Main application instance
+        peaks: Indices of the previewed peaks
+    """
+    x = app.time.values[peaks]
+    y = app.df_f.values[peaks]
+    if getattr(app, 'preview_line', None) is None:
+        app.preview_line, = app.ax.plot(x, y, 'o', color='orange', markerfacecolor='none', markersize=6)
+    else:
+        app.preview_line.set_data(x, y)
+    app.canvas.draw_idle()
+
+def remove_peak_preview(app):
+    """
+    Remove the preview markers
+
+    Args:
+        app: Main application instance
+    """
+    if getattr(app, 'preview_line', None) is not None:
+        if app.preview_line in app.ax.lines:
+            app.preview_line.remove()
+        app.preview_line = None
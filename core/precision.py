@@ -0,0 +1,25 @@
+"""
+Precision of the trace arrays
+
+In float32 mode the loaded signal, its copies and its baselines are stored and processed
+as float32, halving their memory and bandwidth. Time stamps stay float64 (they identify the
+peaks and must resolve single samples in long recordings), and sums that accumulate over
+many samples (means, cumulative sums, fit normal equations) are carried out in float64.
+"""
+import numpy as np
+
+PRECISIONS = ("float64", "float32")
+
+def precision_dtype(precision):
+    """
+    NumPy dtype of a precision setting ("float64" or "float32")
+    """
+    return np.float32 if precision == "float32" else np.float64
+
+def as_float_array(values):
+    """
+    Values as a float array without changing the precision: float32 stays float32 and
+    anything else becomes float64, copying only when a conversion is needed
+    """
+    values = np.asarray(values)
+    return values if values.dtype == np.float32 else values.astype(np.float64, copy=False)
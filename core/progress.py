@@ -0,0 +1,79 @@
+import time
+
+# Progress is pushed to the GUI at most this many times per second
+MAX_UPDATE_RATE = 20
+
+class NullProgress:
+    """
+    Progress callback that ignores every report (headless runs, single-peak recalculation)
+    """
+    def __call__(self, fraction):
+        pass
+
+    def finish(self):
+        pass
+
+class ThrottledProgress:
+    """
+    Progress callback that forwards reports on a time interval instead of on every call
+
+    The loops report a fraction of their own work (0-1); it is mapped onto
+    [start, start + span] of the overall progress. Reports arriving faster than
+    the interval are coalesced and only the latest one is kept until finish().
+    """
+    def __init__(self, callback, start=0.0, span=1.0, pump=None, max_rate=MAX_UPDATE_RATE):
+        """
+        Args:
+            callback: Receives the overall progress fraction
+            start: Overall progress at the start of the loop
+            span: Share of the overall progress covered by the loop
+            pump: Optional function called after each forwarded report (e.g. processing GUI events)
+            max_rate: Maximum number of forwarded reports per second
+        """
+        self.callback = callback
+        self.start = start
+        self.span = span
+        self.pump = pump
+        self.min_interval = 1.0 / max_rate
+        self._last_time = None
+        self._pending = None
+
+    def __call__(self, fraction):
+        now = time.perf_counter()
+        self._pending = fraction
+        if self._last_time is not None and now - self._last_time < self.min_interval:
+            return
+        self._last_time = now
+        self._forward()
+
+    def finish(self):
+        """
+        Forward the last coalesced report, if any
+        """
+        if self._pending is not None:
+            self._forward()
+
+    def _forward(self):
+        fraction, self._pending = self._pending, None
+        self.callback(self.start + self.span * min(max(fraction, 0.0), 1.0))
+        if self.pump is not None:
+            self.pump()
+
+def get_progress_reporter(app, start=0.0, span=1.0):
+    """
+    Progress callback for a core loop running on the application
+
+    Args:
+        app: Main application instance (or headless session)
+        start: Overall progress at the start of the loop
+        span: Share of the overall progress covered by the loop
+
+    Returns:
+        ThrottledProgress driving the progress bar, or NullProgress when the
+        application has no progress bar
+    """
+    progress_bar = getattr(app, 'progress_bar', None)
+    if progress_bar is None:
+        return NullProgress()
+    # update() keeps the window responsive while the loop runs
+    return ThrottledProgress(progress_bar.set, start, span, pump=app.update)
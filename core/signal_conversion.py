@@ -0,0 +1,115 @@
+"""
+ΔF/F and ΔR/R conversion
+
+Load File turns the raw signal (and the reference channel in dual-channel mode) into the
+analysed trace in a few fused passes on plain arrays: the reference is smoothed with a
+cumulative-sum moving average, the ratio is written over the smoothed array and normalized
+in place, so no stage allocates more than one trace-sized temporary. The same functions
+serve headless scripts and the chunked pipeline.
+"""
+import numpy as np
+from core.calculate_baseline import percentile_baseline
+from core.precision import as_float_array
+
+def centered_moving_average(values, window_size):
+    """
+    Centred moving average in O(N) from one cumulative sum, the edges averaging the samples
+    available (pandas rolling(window_size, center=True, min_periods=1).mean())
+
+    Args:
+        values: Trace values
+        window_size: Window length in samples
+
+    Returns:
+        np.ndarray: Smoothed values, a new array in the precision of values
+    """
+    values = as_float_array(values)
+    n, w = len(values), int(window_size)
+    half = w // 2
+    cumulative = np.empty(n + 1)
+    cumulative[0] = 0.0
+    # The running sum is float64 whatever the precision, its differences lose no digits
+    np.cumsum(values, out=cumulative[1:], dtype=np.float64)
+
+    # Sample i averages [i - half, i + w - half), complete windows in one slice operation
+    smoothed = np.empty(n, dtype=values.dtype)
+    interior = max(n - w + 1, 0)
+    np.subtract(cumulative[w:w + interior], cumulative[:interior], out=smoothed[half:half + interior])
+    smoothed[half:half + interior] /= w
+
+    edges = np.r_[0:min(half, n), max(half + interior, half):n]
+    low = np.clip(edges - half, 0, n)
+    high = np.clip(edges + w - half, 0, n)
+    smoothed[edges] = (cumulative[high] - cumulative[low]) / (high - low)
+    return smoothed
+
+def normalize_to_baseline(values, baseline, out=None):
+    """
+    (values - baseline) / baseline with non-finite results set to 0, like the replace(inf)
+    and fillna(0) of Load File but in place
+
+    Args:
+        values: Trace values
+        baseline: Baseline of every sample
+        out: Array receiving the result (may be values itself), a new array by default
+
+    Returns:
+        np.ndarray: Normalized values
+    """
+    out = np.subtract(values, baseline, out=out)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(out, baseline, out=out)
+    return np.nan_to_num(out, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+def convert_trace(signal, baseline_window=50, baseline_percentile=30, convert_to_df_f=True, rfp=None,
+                  rfp_smoothing_window=None, keep_raw_baseline=True):
+    """
+    Convert a raw trace as Load File does
+
+    - ΔR/R (rfp given): signal / smoothed rfp, normalized to its own rolling baseline
+    - ΔF/F (convert_to_df_f and a mean signal above 3): normalized to the raw baseline
+    - otherwise the signal is kept as is, with the raw baseline
+
+    Args:
+        signal: Raw signal
+        baseline_window: Window of the rolling baselines in samples
+        baseline_percentile: Percentile of the rolling baselines
+        convert_to_df_f: Whether ΔF/F was asked for
+        rfp: Reference channel for ΔR/R, None in single-channel mode
+             (signal and rfp are processed in the precision of signal, float32 or float64)
+        rfp_smoothing_window: Window of the reference smoothing, None or 1 for none
+        keep_raw_baseline: Compute the raw-signal baseline in ΔR/R mode, where only the
+                           Baseline table column uses it
+
+    Returns:
+        dict: 'df_f' (analysed trace), 'baseline_values' (baseline of the last normalization),
+              'raw_baseline' (None when skipped) and 'convert_to_df_f' (whether the trace is
+              read as ΔF/F, which includes traces loaded already normalized)
+    """
+    signal = as_float_array(signal)
+
+    raw_baseline = None
+    if rfp is None or keep_raw_baseline:
+        raw_baseline = percentile_baseline(signal, baseline_window, baseline_percentile)
+
+    if rfp is not None:
+        if rfp_smoothing_window and int(rfp_smoothing_window) > 1:
+            ratio = centered_moving_average(np.asarray(rfp, dtype=signal.dtype), int(rfp_smoothing_window))
+        else:
+            ratio = np.array(rfp, dtype=signal.dtype)
+        np.divide(signal, ratio, out=ratio)
+        baseline_values = percentile_baseline(ratio, baseline_window, baseline_percentile)
+        df_f = normalize_to_baseline(ratio, baseline_values, out=ratio)
+    elif convert_to_df_f and np.nanmean(signal, dtype=np.float64) > 3:
+        baseline_values = raw_baseline
+        df_f = normalize_to_baseline(signal, raw_baseline)
+    else:
+        baseline_values = raw_baseline
+        df_f = signal
+
+    return {
+        'df_f': df_f,
+        'baseline_values': baseline_values,
+        'raw_baseline': raw_baseline,
+        'convert_to_df_f': bool(convert_to_df_f) or 0 <= np.nanmean(df_f, dtype=np.float64) <= 3,
+    }
@@ -0,0 +1,176 @@
+import numpy as np
+from core.app_state import clear_plot
+from core.instrumentation import get_instrumentation
+from core.apply_threshold import mark_peaks
+
+def event_template(sample_interval, tau_rise, tau_decay, n_tau=5):
+    """
+    Event shape of the rise and decay models: exponential growth y0·e^{t/τ_rise}
+    up to the peak, then exponential decay e^{-t/τ_decay}
+
+    Args:
+        sample_interval: Time between samples
+        tau_rise: Rise time constant (as fitted by calculate_rise)
+        tau_decay: Decay time constant (as fitted by calculate_decay)
+        n_tau: Length of each phase in time constants
+
+    Returns:
+        tuple: (template normalized to a peak of 1, index of the peak in the template)
+    """
+    rise_samples = max(int(np.ceil(n_tau * tau_rise / sample_interval)), 1)
+    decay_samples = max(int(np.ceil(n_tau * tau_decay / sample_interval)), 2)
+    t = np.arange(-rise_samples, decay_samples + 1) * sample_interval
+    template = np.where(t < 0, np.exp(t / tau_rise), np.exp(-t / tau_decay))
+    return template, rise_samples
+
+def deconvolve(values, template, cutoff):
+    """
+    FFT deconvolution of the trace by the event template (Pernía-Andrade et al. 2012)
+
+    Every event becomes a narrow pulse at its onset, so overlapping events are separated.
+    A Gaussian low-pass filter keeps the division from amplifying high-frequency noise.
+    The cost is that of a few FFTs, O(N log N).
+
+    Args:
+        values: Trace values
+        template: Event template
+        cutoff: Standard deviation of the Gaussian filter in cycles per sample
+
+    Returns:
+        np.ndarray: Deconvolved trace, one value per sample
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+
+    # Zero padding (after removing the resting level) avoids wrapping events around the end
+    n_fft = 1 << int(np.ceil(np.log2(n + len(template))))
+    spectrum = np.fft.rfft(values - np.median(values), n_fft)
+    template_spectrum = np.fft.rfft(template, n_fft)
+    frequencies = np.fft.rfftfreq(n_fft)
+    low_pass = np.exp(-0.5 * (frequencies / cutoff) ** 2)
+
+    return np.fft.irfft(spectrum / template_spectrum * low_pass, n_fft)[:n]
+
+def detect_template_events(time_values, values, tau_rise, tau_decay, k=4.0, cutoff_hz=None):
+    """
+    Detect events whose shape matches the rise/decay template
+
+    Args:
+        time_values: Sample times
+        values: Trace values
+        tau_rise: Rise time constant of the template
+        tau_decay: Decay time constant of the template
+        k: Detection threshold in robust standard deviations of the deconvolved trace
+        cutoff_hz: Low-pass cutoff of the deconvolution in 1/time units (defaults to 1 / (4π·τ_rise))
+
+    Returns:
+        tuple: (peak indices in the trace, event amplitudes)
+    """
+    from scipy.signal import find_peaks
+    from core.auto_threshold import MAD_TO_SIGMA
+
+    time_values = np.asarray(time_values, dtype=float)
+    values = np.asarray(values, dtype=float)
+    sample_interval = float(np.median(np.diff(time_values))) if len(time_values) > 1 else 1.0
+
+    template, peak_offset = event_template(sample_interval, tau_rise, tau_decay)
+    if len(template) >= len(values):
+        return np.array([], dtype=int), np.array([])
+
+    if cutoff_hz is None:
+        cutoff_hz = 1 / (4 * np.pi * tau_rise)
+    cutoff = min(cutoff_hz * sample_interval, 0.5)
+    deconvolved = deconvolve(values, template, cutoff)
+
+    # The deconvolved trace is mostly noise, so its spread is estimated robustly
+    center = np.median(deconvolved)
+    sigma = MAD_TO_SIGMA * np.median(np.abs(deconvolved - center))
+    pulse_radius = max(int(np.ceil(3 / (2 * np.pi * cutoff))), 1)
+    onsets, _ = find_peaks(deconvolved, height=center + k * sigma, distance=pulse_radius)
+
+    # Amplitude: area of each pulse (the low-pass filter preserves the area of a unit pulse)
+    cumsum = np.concatenate(([0.0], np.cumsum(deconvolved - center)))
+    low = np.clip(onsets - pulse_radius, 0, len(values))
+    high = np.clip(onsets + pulse_radius + 1, 0, len(values))
+    amplitudes = cumsum[high] - cumsum[low]
+
+    # Snap each event to the maximum of the trace around the template peak,
+    # so that markers sit on data points like the threshold detector's
+    radius = max(peak_offset // 2, 1)
+    centers = onsets + peak_offset
+    offsets = np.arange(-radius, radius + 1)
+    index_grid = np.clip(centers[:, None] + offsets[None, :], 0, len(values) - 1)
+    peaks = index_grid[np.arange(len(centers)), np.argmax(values[index_grid], axis=1)]
+
+    # Snapping can merge neighbouring detections
+    peaks, unique = np.unique(peaks, return_index=True)
+    return peaks, amplitudes[unique]
+
+def fitted_taus(app):
+    """
+    Median rise and decay taus of the current fits, None when there are none
+    """
+    def median_tau(taus):
+        values = [tau for tau in taus.values() if isinstance(tau, (int, float, np.floating)) and np.isfinite(tau) and tau > 0]
+        return float(np.median(values)) if values else None
+
+    return median_tau(app.rise_times), median_tau(app.tau_values)
+
+def apply_template_matching(app):
+    """
+    Ask for the template settings and replace the marked peaks by the template detections
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        bool: True when events were detected and marked
+    """
+    from tkinter import messagebox
+    from ui.dialogs import TemplateMatchDialog
+
+    instrumentation = get_instrumentation(app)
+    tau_rise, tau_decay = fitted_taus(app)
+    dialog = TemplateMatchDialog(
+        app,
+        tau_rise=app.last_template_tau_rise or ("" if tau_rise is None else f"{tau_rise:.4g}"),
+        tau_decay=app.last_template_tau_decay or ("" if tau_decay is None else f"{tau_decay:.4g}"),
+        k=app.last_template_k
+    )
+    with instrumentation.stage("dialog", idle=True):
+        app.wait_window(dialog)
+    if dialog.user_cancelled:
+        return False
+
+    app.last_template_tau_rise = dialog.tau_rise
+    app.last_template_tau_decay = dialog.tau_decay
+    app.last_template_k = dialog.k
+
+    with instrumentation.stage("clear"):
+        clear_plot(app, reset_data=False)
+
+    with instrumentation.stage("template_match"):
+        peaks, amplitudes = detect_template_events(
+            app.time.values,
+            app.df_f.values,
+            float(dialog.tau_rise),
+            float(dialog.tau_decay),
+            k=float(dialog.k)
+        )
+    instrumentation.count("peaks_detected", len(peaks))
+
+    if len(peaks) == 0:
+        messagebox.showinfo("Info", "No events matched the template.")
+        return False
+
+    with instrumentation.stage("mark_peaks"):
+        mark_peaks(app, peaks)
+    # Deconvolved amplitude of every event
+    for peak, amplitude in zip(app.marked_peaks, amplitudes):
+        app.amplitudes[peak] = float(amplitude)
+
+    with instrumentation.stage("table"):
+        app.update_table()
+    with instrumentation.stage("draw"):
+        app.canvas.draw()
+    return True
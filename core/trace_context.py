@@ -0,0 +1,340 @@
+"""
+Per-trace analysis context
+Quantities derived from the loaded trace (baseline, baseline statistics and bands, local
+minima, derivative, decimation pyramid, sample indices) are computed on first use and
+memoized. Each one records the versions of the inputs it was computed from (app.time,
+app.df_f, app.baseline_values) together with its parameters, so it is recomputed only
+once one of them is replaced by a new object.
+"""
+import numpy as np
+from core.precision import as_float_array
+
+# App attribute behind each input of the derived quantities
+INPUTS = {
+    'time': 'time',
+    'trace': 'df_f',
+    'baseline': 'baseline_values',
+}
+
+# Finest bin count kept in the decimation pyramid, about the pixel width of a plot
+PYRAMID_MIN_BINS = 2000
+
+def rise_band(baseline_mean, baseline_std, mean_peak_value):
+    """
+    Baseline band an onset is searched in: up to the baseline mean, or two σ above it
+    when the peaks stand out clearly from the noise
+    """
+    ratio = (mean_peak_value - baseline_mean) / baseline_std
+    upper = baseline_mean if ratio <= 10 else baseline_mean + 2 * baseline_std
+    return baseline_mean - 8 * baseline_std, upper
+
+def decay_band(baseline_mean, baseline_std, mean_peak_value):
+    """
+    Baseline band that ends a decay: the band widens with the peak-to-noise ratio
+    """
+    ratio = (mean_peak_value - baseline_mean) / baseline_std
+    if ratio <= 5:
+        upper = baseline_mean
+    elif ratio <= 10:
+        upper = baseline_mean + baseline_std
+    else:
+        upper = baseline_mean + 2 * baseline_std
+    return baseline_mean - 2 * baseline_std, upper
+
+BAND_RULES = {
+    'rise': rise_band,
+    'decay': decay_band,
+}
+
+def sample_moments(values):
+    """
+    Sample count, mean and sum of squared deviations of an array
+    """
+    values = as_float_array(values)
+    mean = float(np.mean(values, dtype=np.float64)) if len(values) else 0.0
+    return len(values), mean, float(np.sum((values - mean) ** 2, dtype=np.float64))
+
+def merge_moments(first, second):
+    """
+    Moments of two arrays joined, from the sample_moments of each
+    """
+    count, mean, squares = first
+    other_count, other_mean, other_squares = second
+    total = count + other_count
+    if total == 0:
+        return first
+    delta = other_mean - mean
+    return (
+        total, mean + delta * other_count / total,
+        squares + other_squares + delta ** 2 * count * other_count / total
+    )
+
+def moments_stats(moments):
+    """
+    Mean and standard deviation from sample_moments
+    """
+    count, mean, squares = moments
+    return mean, float(np.sqrt(squares / count)) if count else 0.0
+
+def decimation_pyramid(values, min_bins=PYRAMID_MIN_BINS):
+    """
+    Min/max envelopes of a trace at successively halved resolutions
+
+    Level k holds the minimum and maximum of bins of 2^(k+1) samples (the last bin may be
+    shorter); halving stops before a level would have fewer than min_bins bins.
+
+    Args:
+        values: Trace values
+        min_bins: Fewest bins of a level
+
+    Returns:
+        list: (bin starts, bin minima, bin maxima) per level, finest first, NaN samples ignored
+    """
+    levels = []
+    starts = np.arange(len(values))
+    minima = maxima = values
+    while len(starts) >= 2 * min_bins:
+        pairs = np.arange(0, len(starts), 2)
+        starts = starts[pairs]
+        minima = np.fmin.reduceat(minima, pairs)
+        maxima = np.fmax.reduceat(maxima, pairs)
+        levels.append((starts, minima, maxima))
+    return levels
+
+class TraceContext:
+    """
+    Memoized quantities derived from the loaded trace
+
+    An input gets a new version whenever the app attribute holds a different object than
+    the last time it was looked at. Every quantity is stored with the versions and
+    parameters it was computed from and returned as is while they are unchanged, so the
+    inputs must be replaced by new arrays, never changed in place. Inputs that only grew
+    by appended samples (see grow) let the quantities that support it extend their
+    previous value.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._sources = {}
+        self._versions = {}
+        self._growth_base = {}
+        self._memo = {}
+        # (baseline mean, baseline std, mean peak value) the bands use instead of the app's,
+        # when a part of a trace is analysed with the statistics of the whole (chunked pipeline)
+        self.band_statistics = None
+
+    def version(self, name):
+        """
+        Current version of an input of INPUTS
+        """
+        source = getattr(self.app, INPUTS[name], None)
+        if name not in self._sources or self._sources[name] is not source:
+            # The source itself is kept, so that its id cannot be reused by a new object
+            self._sources[name] = source
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._growth_base.pop(name, None)
+        return self._versions[name]
+
+    def grow(self, *names):
+        """
+        Give inputs a new version after samples were appended to them, the earlier samples
+        unchanged (live acquisition)
+
+        Args:
+            names: Input names from INPUTS whose app attribute now holds the longer array
+        """
+        for name in names:
+            previous = self._versions.get(name) if name in self._sources else None
+            base = self._growth_base.get(name, previous)
+            self._sources.pop(name, None)
+            self.version(name)
+            if base is not None:
+                # Every version from base on is the previous one with samples appended
+                self._growth_base[name] = base
+
+    def _grew_from(self, cached_key, key, inputs):
+        for name, old, new in zip(inputs, cached_key, key):
+            if old != new and not self._growth_base.get(name, new) <= old < new:
+                return False
+        return cached_key[len(inputs):] == key[len(inputs):]
+
+    def _memoized(self, quantity, inputs, params, compute, extend=None):
+        key = tuple(self.version(name) for name in inputs) + tuple(params)
+        cached = self._memo.get(quantity)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if cached is not None and extend is not None and self._grew_from(cached[0], key, inputs):
+            value = extend(cached[1])
+        else:
+            value = compute()
+        self._memo[quantity] = (key, value)
+        return value
+
+    def time_values(self):
+        """
+        Sample times as a float array
+        """
+        return self._memoized('time_values', ('time',), (), lambda: np.asarray(self.app.time, dtype=float))
+
+    def values(self):
+        """
+        Trace values as a float array, in their own precision
+        """
+        return self._memoized('values', ('trace',), (), lambda: as_float_array(self.app.df_f))
+
+    def sample_index(self, sample_time):
+        """
+        Position of the sample taken at a time, found by binary search in the sorted times
+
+        Raises:
+            IndexError: If no sample was taken at that time
+        """
+        time_values = self.time_values()
+        i = int(np.searchsorted(time_values, sample_time))
+        if i == len(time_values) or time_values[i] != sample_time:
+            raise IndexError(f"No sample at time {sample_time}")
+        return i
+
+    def baseline(self, window_size, percentile):
+        """
+        Rolling-percentile baseline of the trace for the given settings
+        """
+        from core.calculate_baseline import percentile_baseline
+
+        window_size, percentile = int(window_size), float(percentile)
+        return self._memoized(
+            'baseline', ('trace',), (window_size, percentile),
+            lambda: percentile_baseline(self.app.df_f, window_size, percentile)
+        )
+
+    def baseline_moments(self):
+        """
+        Sample count, mean and sum of squared deviations of app.baseline_values, extended
+        with the moments of the appended samples when the baseline grew
+        """
+        def extend(previous):
+            return merge_moments(previous, sample_moments(self.app.baseline_values[previous[0]:]))
+        return self._memoized('baseline_moments', ('baseline',), (), lambda: sample_moments(self.app.baseline_values), extend)
+
+    def baseline_stats(self):
+        """
+        Mean and standard deviation of app.baseline_values
+        """
+        return self._memoized('baseline_stats', ('baseline',), (), lambda: moments_stats(self.baseline_moments()))
+
+    def band_limits(self, kind):
+        """
+        Lower and upper limit of the baseline band of a kind of BAND_RULES
+
+        The band depends on the mean value of the marked peaks, which is part of its key.
+        """
+        if self.band_statistics is not None:
+            return BAND_RULES[kind](*self.band_statistics)
+        mean_peak_value = float(np.mean([peak[1] for peak in self.app.marked_peaks]))
+        return self._memoized(
+            f'band_limits/{kind}', ('baseline',), (mean_peak_value,),
+            lambda: BAND_RULES[kind](*self.baseline_stats(), mean_peak_value)
+        )
+
+    def band_positions(self, kind, local_minima=False):
+        """
+        Sorted positions of the samples inside the baseline band of a kind
+
+        Args:
+            kind: Band kind from BAND_RULES
+            local_minima: Only keep the local minima inside the band
+        """
+        lower, upper = self.band_limits(kind)
+
+        def compute():
+            values = self.values()
+            inside = (values >= lower) & (values <= upper)
+            if local_minima:
+                inside &= self.local_min_mask()
+            return np.flatnonzero(inside)
+        return self._memoized(f'band_positions/{kind}/{local_minima}', ('trace',), (lower, upper), compute)
+
+    def differences(self):
+        """
+        Difference of every sample with the previous one (length N - 1)
+        """
+        return self._memoized('differences', ('trace',), (), lambda: np.diff(self.values()))
+
+    def derivative(self):
+        """
+        Slope between consecutive samples, in value units per time unit (length N - 1)
+        """
+        def compute():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self.differences() / np.diff(self.time_values())
+        return self._memoized('derivative', ('trace', 'time'), (), compute)
+
+    def local_min_mask(self):
+        """
+        Samples strictly below both neighbours; the first and last samples are never minima
+        """
+        def compute():
+            differences = self.differences()
+            mask = np.zeros(len(differences) + 1, dtype=bool)
+            mask[1:-1] = (differences[:-1] < 0) & (differences[1:] > 0)
+            return mask
+        return self._memoized('local_min_mask', ('trace',), (), compute)
+
+    def local_min_positions(self):
+        """
+        Sorted positions of the local minima
+        """
+        return self._memoized('local_min_positions', ('trace',), (), lambda: np.flatnonzero(self.local_min_mask()))
+
+    def cumulative_area(self):
+        """
+        Running trapezoidal area of the trace above app.baseline_values, 0 at the first sample
+        """
+        def area(start):
+            residual = self.values()[start:] - as_float_array(self.app.baseline_values[start:])
+            return np.cumsum(0.5 * (residual[1:] + residual[:-1]) * np.diff(self.time_values()[start:]))
+
+        def extend(previous):
+            # Only the intervals from the last sample of the previous area on are new
+            if len(previous) == 0:
+                return np.concatenate(([0.0], area(0)))
+            return np.concatenate((previous, previous[-1] + area(len(previous) - 1)))
+        return self._memoized('cumulative_area', ('trace', 'baseline', 'time'), (), lambda: np.concatenate(([0.0], area(0))), extend)
+
+    def decimation_pyramid(self):
+        """
+        Min/max pyramid of the trace, see decimation_pyramid
+        """
+        return self._memoized('decimation_pyramid', ('trace',), (), lambda: decimation_pyramid(self.values()))
+
+    def envelope(self, n_bins):
+        """
+        Min/max envelope of the trace with at least n_bins bins (and fewer than 2 n_bins),
+        taken from the pyramid
+
+        Args:
+            n_bins: Fewest bins wanted, at most PYRAMID_MIN_BINS
+
+        Returns:
+            tuple: (bin times, bin minima, bin maxima), the samples themselves for short traces
+        """
+        time_values = self.time_values()
+        levels = [level for level in self.decimation_pyramid() if len(level[0]) >= n_bins]
+        if not levels:
+            values = self.values()
+            return time_values, values, values
+        starts, minima, maxima = levels[-1]
+        stops = np.append(starts[1:], len(time_values))
+        return time_values[(starts + stops - 1) // 2], minima, maxima
+
+def get_trace_context(app):
+    """
+    Analysis context of the application, created on first use
+
+    Args:
+        app: Main application instance (or headless session)
+    """
+    context = getattr(app, 'trace_context', None)
+    if context is None:
+        context = TraceContext(app)
+        app.trace_context = context
+    return context
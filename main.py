@@ -1,9 +1,12 @@
+import multiprocessing
 from app.CaFire import App
 
 def main():
     """
     Application entry point
     """
+    # Needed by the parameter sweep worker processes in the frozen executable
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
 
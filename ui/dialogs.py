@@ -1,13 +1,16 @@
+import os
 import numpy as np
-import pandas as pd
 import customtkinter
 from tkinter import filedialog, messagebox
 from utils.image_utils import load_svg_image
 from ui.widgets import Tooltip
 from ui.window import set_window_style, set_window_icon
+from core.peak_averaging import compute_peak_average, draw_peak_average, remove_peak_average
+from utils.navigation_utils import update_annotations
+from core.artist_registry import clear_artist_groups
 
 class LoadFileDialog(customtkinter.CTkToplevel):
-    def __init__(self, parent, default_sheet_name="", default_x_col="", default_y_col="", default_RFP_col="", default_RFP_smoothing_window_size="", default_baseline_window_size="", default_baseline_percentage=""):
+    def __init__(self, parent, default_sheet_name="", default_x_col="", default_y_col="", default_RFP_col="", default_RFP_smoothing_window_size="", default_baseline_window_size="", default_baseline_percentage="", default_keep_raw_baseline="on", default_precision="float64"):
         super().__init__(parent)
         self.parent = parent  # Save parent window reference
         self.parent.bind('<Destroy>', self.on_parent_destroy) # Listen for parent window close event
@@ -34,6 +37,8 @@ class LoadFileDialog(customtkinter.CTkToplevel):
         self.evoked_status = None
         self.convert_to_df_f = False
         self.convert_to_dr_r = False
+        self.keep_raw_baseline = default_keep_raw_baseline
+        self.precision = default_precision
 
         # Create title label
         self.title_label = customtkinter.CTkLabel(
@@ -101,6 +106,26 @@ class LoadFileDialog(customtkinter.CTkToplevel):
         self.entry_RFP_smoothing_window_size_col.pack_forget()
         self.label_RFP_smoothing_window_size_col.pack_forget()
 
+        # The raw-signal baseline only feeds the Baseline table column in DR/R mode
+        self.keep_raw_baseline_var = customtkinter.StringVar(value=default_keep_raw_baseline or "on")
+        self.keep_raw_baseline_checkbox = customtkinter.CTkCheckBox(
+            self,
+            text="raw baseline column",
+            variable=self.keep_raw_baseline_var,
+            onvalue="on",
+            offvalue="off",
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.keep_raw_baseline_checkbox.pack_forget()
+        Tooltip(self.keep_raw_baseline_checkbox, "Off: skip the baseline of Channel #1; the Baseline column then shows the DR/R baseline")
+
         # Baseline window size
         self.label_baseline_window_size = customtkinter.CTkLabel(
             self, text="Baseline Window Size",
@@ -175,6 +200,26 @@ class LoadFileDialog(customtkinter.CTkToplevel):
         )
         self.mini_checkbox.pack(side="left")
 
+        # Store and process the trace as float32 (half the memory) instead of float64
+        self.precision_var = customtkinter.StringVar(value=default_precision or "float64")
+        self.precision_checkbox = customtkinter.CTkCheckBox(
+            self.checkbox_frame,
+            text="float32",
+            variable=self.precision_var,
+            onvalue="float32",
+            offvalue="float64",
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.precision_checkbox.pack(side="left", padx=(3, 0))
+        Tooltip(self.precision_checkbox, "Half the memory for long recordings; results agree with float64 to about 6 digits")
+
         convert_dr_r_icon = load_svg_image('assets/convert.svg', width=24, height=24)
         convert_dr_r_icon_ctk = customtkinter.CTkImage(
             light_image=convert_dr_r_icon,
@@ -266,6 +311,7 @@ class LoadFileDialog(customtkinter.CTkToplevel):
         self.baseline_window_size = self.entry_baseline_window_size.get().strip()
         self.baseline_percentage = self.entry_baseline_percentage.get().strip()
         self.evoked_status = self.evoked_var.get()
+        self.precision = self.precision_var.get()
         if not self.sheet_name or not self.x_col or not self.y_col:
             messagebox.showwarning(title="Warning", message="All fields must be filled out.", parent=self)
             return
@@ -337,6 +383,7 @@ class LoadFileDialog(customtkinter.CTkToplevel):
             # 1. display RFP smoothing related widgets
             self.label_RFP_smoothing_window_size_col.pack(padx=20, anchor="w")
             self.entry_RFP_smoothing_window_size_col.pack(pady=(0, 10), padx=20)
+            self.keep_raw_baseline_checkbox.pack(pady=(0, 10), padx=20, anchor="w")
 
             # 2. display baseline related widgets
             self.label_baseline_window_size.pack(padx=20, anchor="w")
@@ -354,6 +401,7 @@ class LoadFileDialog(customtkinter.CTkToplevel):
             # hide all DR/R related widgets
             self.label_RFP_smoothing_window_size_col.pack_forget()
             self.entry_RFP_smoothing_window_size_col.pack_forget()
+            self.keep_raw_baseline_checkbox.pack_forget()
             self.checkbox_frame.pack_forget()
             self.convert_dr_r_button.pack_forget()
             self.convert_button.pack_forget()
@@ -381,6 +429,7 @@ class LoadFileDialog(customtkinter.CTkToplevel):
         self.convert_to_dr_r = True
         self.RFP_col = self.entry_RFP_col.get().strip()
         self.RFP_smoothing_window_size = self.entry_RFP_smoothing_window_size_col.get().strip()
+        self.keep_raw_baseline = self.keep_raw_baseline_var.get()
         self.on_confirm()
 
     def on_evoked_changed(self):
@@ -413,11 +462,11 @@ class LoadFileDialog(customtkinter.CTkToplevel):
             self.destroy()
 
 class PartitionEvokedDialog(customtkinter.CTkToplevel):
-    def __init__(self, parent, default_peak_num="", default_interval_size="", default_offset=""):
+    def __init__(self, parent, default_peak_num="", default_interval_size="", default_offset="", default_pre_samples="", default_post_samples="", default_outlier_z="", default_align_group="off"):
         super().__init__(parent)
         self.parent = parent
         self.title("Partition Parameters")
-        self.geometry("200x600")  # Increase height to accommodate new buttons
+        self.geometry("280x640")  # Fits the taller Partition tab
 
         set_window_style(self)
         set_window_icon(self)
@@ -432,14 +481,21 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
         self.offset = None
         self.user_cancelled = False
 
+        # Partitioning and the peak-triggered average each get a tab, so the dialog
+        # stays as tall as one of them
+        self.tabview = customtkinter.CTkTabview(self)
+        self.tabview.pack(pady=(0, 10), padx=10, fill="both", expand=True)
+        partition_tab = self.tabview.add("Partition")
+        average_tab = self.tabview.add("Average")
+
         self.title_label = customtkinter.CTkLabel(
-            self, 
+            partition_tab, 
             text="Partition Specifications",
             font=("Helvetica", 14, "bold")
         )
         self.title_label.pack(pady=(20, 5), padx=20)
         self.title_desc = customtkinter.CTkLabel(
-            self,
+            partition_tab,
             text="Applicable only to evoked data",
             font=customtkinter.CTkFont(size=10),
             text_color="gray",
@@ -448,51 +504,51 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
         self.title_desc.pack(pady=(0, 0), padx=20, anchor="w")
 
         self.label_peak_num = customtkinter.CTkLabel(
-            self, 
+            partition_tab, 
             text="Peak Num",
             font=customtkinter.CTkFont(size=12),
             anchor="w"
         )
         self.label_peak_num.pack(pady=(10, 0), padx=20, anchor="w")
         self.label_peak_num_desc = customtkinter.CTkLabel(
-            self,
+            partition_tab,
             text="Number of peaks per interval",
             font=customtkinter.CTkFont(size=10),
             text_color="gray",
             anchor="w"
         )
         self.label_peak_num_desc.pack(pady=(0, 0), padx=20, anchor="w")
-        self.entry_peak_num = customtkinter.CTkEntry(self, width=200)
+        self.entry_peak_num = customtkinter.CTkEntry(partition_tab, width=200)
         self.entry_peak_num.insert(0, default_peak_num)  # Pre-fill with default value
         self.entry_peak_num.pack(pady=(5, 10), padx=20, fill="x", anchor="w")
 
         self.label_interval_length = customtkinter.CTkLabel(
-            self, 
+            partition_tab, 
             text="Interval Length",
             font=customtkinter.CTkFont(size=12),
             anchor="w"
         )
         self.label_interval_length.pack(pady=(7, 0), padx=20, anchor="w")
-        self.entry_interval_length = customtkinter.CTkEntry(self, width=200)
+        self.entry_interval_length = customtkinter.CTkEntry(partition_tab, width=200)
         self.entry_interval_length.insert(0, default_interval_size)  # Pre-fill with default value
         self.entry_interval_length.pack(pady=(5, 10), padx=20, fill="x", anchor="w")
 
         self.label_offset = customtkinter.CTkLabel(
-            self, 
+            partition_tab, 
             text="Offset",
             font=customtkinter.CTkFont(size=12),
             anchor="w"
         )
         self.label_offset.pack(pady=(7, 0), padx=20, anchor="w")
         self.label_offset_desc = customtkinter.CTkLabel(
-            self,
+            partition_tab,
             text="Offset from interval start",
             font=customtkinter.CTkFont(size=10),
             text_color="gray",
             anchor="w"
         )
         self.label_offset_desc.pack(pady=(0, 0), padx=20, anchor="w")
-        self.entry_offset = customtkinter.CTkEntry(self, width=200)
+        self.entry_offset = customtkinter.CTkEntry(partition_tab, width=200)
         self.entry_offset.insert(0, default_offset)  # Pre-fill with default value
         self.entry_offset.pack(pady=(5, 10), padx=20, fill="x", anchor="w")
 
@@ -506,7 +562,7 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
             size=(20, 20)
         )
         self.partition_button = customtkinter.CTkButton(
-            self,
+            partition_tab,
             image=partition_icon_ctk,
             compound="left",
             fg_color="#dbdbdb", 
@@ -526,7 +582,7 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
             size=(20, 20)
         )
         self.export_button = customtkinter.CTkButton(
-            self,
+            partition_tab,
             image=export_icon_ctk,
             compound="left",
             fg_color="#dbdbdb", 
@@ -546,7 +602,7 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
             size=(20, 20)
         )
         self.clear_button = customtkinter.CTkButton(
-            self,
+            partition_tab,
             image=clear_icon_ctk,
             compound="left",
             fg_color="#dbdbdb", 
@@ -559,9 +615,168 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
         )
         self.clear_button.pack(pady=button_pady)        
 
+        # Peak-triggered average
+        self.average_title_label = customtkinter.CTkLabel(
+            average_tab,
+            text="Peak-Triggered Average",
+            font=("Helvetica", 14, "bold")
+        )
+        self.average_title_label.pack(pady=(15, 0), padx=20)
+
+        self.label_pre_samples = customtkinter.CTkLabel(
+            average_tab,
+            text="Pre / Post Samples",
+            font=customtkinter.CTkFont(size=12),
+            anchor="w"
+        )
+        self.label_pre_samples.pack(pady=(7, 0), padx=20, anchor="w")
+        self.label_pre_samples_desc = customtkinter.CTkLabel(
+            average_tab,
+            text="Samples kept around each peak",
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="w"
+        )
+        self.label_pre_samples_desc.pack(pady=(0, 0), padx=20, anchor="w")
+
+        self.samples_frame = customtkinter.CTkFrame(average_tab, fg_color="transparent")
+        self.samples_frame.pack(pady=(5, 10), padx=20, fill="x")
+        self.entry_pre_samples = customtkinter.CTkEntry(self.samples_frame, width=75, placeholder_text="pre")
+        if default_pre_samples:
+            self.entry_pre_samples.insert(0, default_pre_samples)
+        self.entry_pre_samples.pack(side="left")
+        self.entry_post_samples = customtkinter.CTkEntry(self.samples_frame, width=75, placeholder_text="post")
+        if default_post_samples:
+            self.entry_post_samples.insert(0, default_post_samples)
+        self.entry_post_samples.pack(side="right")
+
+        self.label_outlier_z = customtkinter.CTkLabel(
+            average_tab,
+            text="Outlier Z",
+            font=customtkinter.CTkFont(size=12),
+            anchor="w"
+        )
+        self.label_outlier_z.pack(pady=(7, 0), padx=20, anchor="w")
+        self.label_outlier_z_desc = customtkinter.CTkLabel(
+            average_tab,
+            text="Robust z-score cutoff (blank = keep all)",
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="w"
+        )
+        self.label_outlier_z_desc.pack(pady=(0, 0), padx=20, anchor="w")
+        self.entry_outlier_z = customtkinter.CTkEntry(average_tab, width=200)
+        self.entry_outlier_z.insert(0, default_outlier_z)
+        self.entry_outlier_z.pack(pady=(5, 10), padx=20, fill="x", anchor="w")
+
+        self.align_group_var = customtkinter.StringVar(value=default_align_group or "off")
+        self.align_group_checkbox = customtkinter.CTkCheckBox(
+            average_tab,
+            text="align on group start",
+            variable=self.align_group_var,
+            onvalue="on",
+            offvalue="off",
+            command=self.schedule_average_update,
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.align_group_checkbox.pack(pady=(0, 5), padx=20, anchor="w")
+        Tooltip(self.align_group_checkbox, "Align on the first peak of each group of Peak Num peaks (Partition tab)")
+
+        average_icon = load_svg_image('assets/average.svg', width=24, height=24)
+        average_icon_ctk = customtkinter.CTkImage(
+            light_image=average_icon,
+            dark_image=average_icon,
+            size=(20, 20)
+        )
+        self.average_button = customtkinter.CTkButton(
+            average_tab,
+            image=average_icon_ctk,
+            compound="left",
+            fg_color="#dbdbdb", 
+            hover_color="#d5d9df",
+            text="Average",
+            text_color="black",
+            font=customtkinter.CTkFont(size=12, weight="bold"),
+            command=self.on_average,
+            height=40 
+        )
+        self.average_button.pack(pady=button_pady)
+
+        # Keep the average live while its parameters are edited
+        self._average_job = None
+        for entry in (self.entry_peak_num, self.entry_pre_samples, self.entry_post_samples, self.entry_outlier_z):
+            entry.bind('<KeyRelease>', self.schedule_average_update)
+
         # Handle window close event
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
+    def read_average_params(self, show_warnings=True):
+        """Parse the averaging entries, returning None when they are incomplete or invalid"""
+        try:
+            pre_samples = int(self.entry_pre_samples.get())
+            post_samples = int(self.entry_post_samples.get())
+            outlier_z = self.entry_outlier_z.get().strip()
+            outlier_z = float(outlier_z) if outlier_z else None
+            align_group = self.align_group_var.get() == "on"
+            peak_num = int(self.entry_peak_num.get()) if align_group else None
+            if pre_samples < 0 or post_samples < 1 or (peak_num is not None and peak_num < 1):
+                raise ValueError
+        except ValueError:
+            if show_warnings:
+                messagebox.showwarning(title="Warning", message="Pre/Post samples must be integers (and Peak Num when aligning on group start).", parent=self)
+            return None
+        # A cutoff of 0 or below rejects every sweep
+        if outlier_z is not None and not outlier_z > 0:
+            if show_warnings:
+                messagebox.showwarning(title="Warning", message="Outlier z must be greater than 0 (leave it empty to keep all sweeps).", parent=self)
+            return None
+        return pre_samples, post_samples, outlier_z, align_group, peak_num
+
+    def on_average(self):
+        params = self.read_average_params()
+        if params is None:
+            return
+        pre_samples, post_samples, outlier_z, align_group, peak_num = params
+
+        # Store the last used values
+        self.parent.last_pre_samples = str(pre_samples)
+        self.parent.last_post_samples = str(post_samples)
+        self.parent.last_outlier_z = "" if outlier_z is None else str(outlier_z)
+        self.parent.last_align_group = "on" if align_group else "off"
+
+        result = compute_peak_average(
+            self.parent, pre_samples, post_samples,
+            align="group" if align_group else "peak",
+            peak_num=peak_num,
+            outlier_z=outlier_z
+        )
+        if result is None:
+            messagebox.showwarning(title="Warning", message="No complete peak group to average.", parent=self)
+            return
+        draw_peak_average(self.parent)
+        if not result['keep'].any():
+            messagebox.showwarning(title="Warning", message=f"All {len(result['keep'])} sweeps were rejected as outliers, raise Outlier z.", parent=self)
+
+    def schedule_average_update(self, event=None):
+        # Only refresh an average that is already displayed, and only once typing pauses
+        if getattr(self.parent, 'peak_average', None) is None:
+            return
+        if self._average_job is not None:
+            self.after_cancel(self._average_job)
+        self._average_job = self.after(300, self.update_average)
+
+    def update_average(self):
+        self._average_job = None
+        if self.read_average_params(show_warnings=False) is not None:
+            self.on_average()
+
     def on_calculate(self):
         peak_num = self.entry_peak_num.get()
         interval_length = self.entry_interval_length.get()
@@ -612,12 +827,8 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
 
     def clear_partition_lines(self):
         # Clear all partition lines and labels
-        for line in self.parent.partition_lines:
-            line.remove()
-        for label in self.parent.partition_labels:
-            label.remove()
-        self.parent.partition_lines.clear()
-        self.parent.partition_labels.clear()
+        clear_artist_groups(self.parent, 'partition_lines', 'partition_labels')
+        remove_peak_average(self.parent)
         self.parent.canvas.draw()
     
     def do_partition(self, peak_num, interval_size, offset):
@@ -627,12 +838,7 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
         self.parent.last_offset = str(offset)
 
         # Clear the previous partition lines and labels
-        for line in self.parent.partition_lines:
-            line.remove()
-        for label in self.parent.partition_labels:
-            label.remove() 
-        self.parent.partition_lines.clear()
-        self.parent.partition_labels.clear()
+        clear_artist_groups(self.parent, 'partition_lines', 'partition_labels')
 
         # Group the peaks by peak_num
         valid_groups = []
@@ -662,19 +868,13 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
                 self.parent.partition_labels.append(label)
 
         # Update visibility
-        xlims = self.parent.ax.get_xlim()
-        for line, label in zip(self.parent.partition_lines, self.parent.partition_labels):
-            x = line.get_xdata()[0]
-            if xlims[0] <= x <= xlims[1]:
-                line.set_visible(True)
-                label.set_visible(True)
-            else:
-                line.set_visible(False)
-                label.set_visible(False)
+        update_annotations(self.parent)
 
         self.parent.canvas.draw()
 
     def export_stats(self):
+        import pandas as pd
+
         if self.parent.time is None or not self.parent.marked_peaks:
             messagebox.showwarning(title="Warning", message="No stats to export.")
             return
@@ -724,7 +924,21 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
                 file_path = filedialog.asksaveasfilename(defaultextension='.xlsx',
                                                        filetypes=[("Excel files", "*.xlsx")])
                 if file_path:
-                    df.to_excel(file_path, index=False, engine='openpyxl')
+                    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+                        df.to_excel(writer, index=False)
+
+                        # Add the peak-triggered average when one has been computed
+                        peak_average = getattr(self.parent, 'peak_average', None)
+                        if peak_average is not None:
+                            keep = peak_average['keep']
+                            average_data = {'Time': peak_average['time_offsets']}
+                            for i, sweep in enumerate(peak_average['sweeps']):
+                                status = "" if keep[i] else " (rejected)"
+                                average_data[f'Sweep_{i+1}{status}'] = sweep
+                            average_data['Mean'] = peak_average['mean']
+                            average_data['SEM'] = peak_average['sem']
+                            pd.DataFrame(average_data).to_excel(writer, sheet_name='Peak Average', index=False)
+                            pd.DataFrame([peak_average['kinetics']]).to_excel(writer, sheet_name='Average Kinetics', index=False)
                     messagebox.showinfo("Success", f"Data exported successfully to:\n{file_path}")
             else:
                 messagebox.showwarning("Warning", "No partition data found.")
@@ -733,10 +947,12 @@ class PartitionEvokedDialog(customtkinter.CTkToplevel):
             messagebox.showerror("Error", f"Error exporting data:\n{str(e)}")
 
 class DetectPeaksDialog(customtkinter.CTkToplevel):
-    def __init__(self, parent, peak_threshold="", min_distance="", width="", peak_onset_window=""):
+    def __init__(self, parent, peak_threshold="", min_distance="", width="", peak_onset_window="",
+                 auto_threshold="off", threshold_k="4", on_preview=None, height_range=None, event_model="off",
+                 skip_fits="off"):
         super().__init__(parent)
         self.title("Peak Detection")  # Modify dialog title
-        self.geometry("250x530")
+        self.geometry("250x800" if on_preview is not None else "250x700")
 
         set_window_style(self)
         set_window_icon(self)
@@ -750,9 +966,15 @@ class DetectPeaksDialog(customtkinter.CTkToplevel):
         self.min_distance = None
         self.width = None
         self.peak_onset_window = None
+        self.auto_threshold = None
+        self.threshold_k = None
+        self.event_model = None
+        self.skip_fits = None
         self.user_cancelled = False
+        self.on_preview = on_preview
+        self._preview_job = None
 
-        # Peak Height (Required)
+        # Peak Height (Required unless the threshold is automatic)
         self.label_threshold = customtkinter.CTkLabel(
             self, 
             text="Peak Height *",
@@ -774,6 +996,57 @@ class DetectPeaksDialog(customtkinter.CTkToplevel):
         self.entry_threshold.insert(0, peak_threshold)
         self.entry_threshold.pack(pady=(5, 10), padx=20, anchor="w")
 
+        # Height slider spanning the candidate peak heights, only with a live preview
+        self.height_slider = None
+        if on_preview is not None and height_range is not None and height_range[1] > height_range[0]:
+            self.height_slider = customtkinter.CTkSlider(
+                self,
+                from_=height_range[0],
+                to=height_range[1],
+                width=200,
+                command=self.on_height_slider
+            )
+            try:
+                self.height_slider.set(float(peak_threshold))
+            except ValueError:
+                self.height_slider.set(height_range[1])
+            self.height_slider.pack(pady=(0, 10), padx=20, anchor="w")
+
+        # Automatic threshold: baseline + k·σ with σ from a rolling MAD
+        self.auto_threshold_var = customtkinter.StringVar(value=auto_threshold or "off")
+        self.auto_threshold_checkbox = customtkinter.CTkCheckBox(
+            self,
+            text="auto threshold (k·σ)",
+            variable=self.auto_threshold_var,
+            onvalue="on",
+            offvalue="off",
+            command=self.on_auto_threshold_changed,
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.auto_threshold_checkbox.pack(pady=(0, 0), padx=20, anchor="w")
+        Tooltip(self.auto_threshold_checkbox, "Threshold follows the local noise: baseline + k × robust σ")
+
+        self.label_threshold_k_desc = customtkinter.CTkLabel(
+            self,
+            text="k: noise standard deviations above baseline",
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="w"
+        )
+        self.label_threshold_k_desc.pack(pady=(0, 0), padx=20, anchor="w")
+
+        self.entry_threshold_k = customtkinter.CTkEntry(self, width=200)
+        self.entry_threshold_k.insert(0, threshold_k)
+        self.entry_threshold_k.pack(pady=(5, 10), padx=20, anchor="w")
+        self.on_auto_threshold_changed()
+
         # Min Distance
         self.label_distance = customtkinter.CTkLabel(
             self, 
@@ -839,6 +1112,79 @@ class DetectPeaksDialog(customtkinter.CTkToplevel):
         self.entry_peak_onset_window = customtkinter.CTkEntry(self, width=200)
         self.entry_peak_onset_window.insert(0, peak_onset_window)
         self.entry_peak_onset_window.pack(pady=(5, 10), padx=20, anchor="w")
+
+        # Kinetics: separate rise/decay exponentials, or one double-exponential model per event
+        self.event_model_var = customtkinter.StringVar(value=event_model or "off")
+        self.event_model_checkbox = customtkinter.CTkCheckBox(
+            self,
+            text="double-exponential event fit",
+            variable=self.event_model_var,
+            onvalue="on",
+            offvalue="off",
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.event_model_checkbox.pack(pady=(0, 5), padx=20, anchor="w")
+        Tooltip(self.event_model_checkbox, "Fit onset, amplitude, rise and decay of each event together")
+
+        # Screening: only the model-free metrics (10–90% rise, half-width, t½, AUC), no curve fits
+        self.skip_fits_var = customtkinter.StringVar(value=skip_fits or "off")
+        self.skip_fits_checkbox = customtkinter.CTkCheckBox(
+            self,
+            text="metrics only (skip fits)",
+            variable=self.skip_fits_var,
+            onvalue="on",
+            offvalue="off",
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.skip_fits_checkbox.pack(pady=(0, 10), padx=20, anchor="w")
+        Tooltip(self.skip_fits_checkbox, "Skip the exponential fits and only measure 10–90% rise, half-width, t½ and area")
+
+        # Live preview: matching peaks are shown on the plot while the parameters are edited
+        self.preview_var = customtkinter.StringVar(value="on" if on_preview is not None else "off")
+        if on_preview is not None:
+            self.preview_checkbox = customtkinter.CTkCheckBox(
+                self,
+                text="live preview",
+                variable=self.preview_var,
+                onvalue="on",
+                offvalue="off",
+                command=self.schedule_preview,
+                checkbox_width=18,
+                checkbox_height=18,
+                corner_radius=0,
+                border_width=2,
+                fg_color="#dbdbdb",
+                hover_color="#d5d9df",
+                checkmark_color="black",
+                border_color="black"
+            )
+            self.preview_checkbox.pack(pady=(0, 0), padx=20, anchor="w")
+
+            self.label_preview_count = customtkinter.CTkLabel(
+                self,
+                text="",
+                font=customtkinter.CTkFont(size=10),
+                text_color="gray",
+                anchor="w"
+            )
+            self.label_preview_count.pack(pady=(0, 0), padx=20, anchor="w")
+
+            for entry in (self.entry_threshold, self.entry_threshold_k, self.entry_distance, self.entry_width):
+                entry.bind("<KeyRelease>", self.schedule_preview)
         
         detect_peaks_icon = load_svg_image('assets/magnifier.svg', width=24, height=24)
         detect_peaks_icon_ctk = customtkinter.CTkImage(
@@ -861,16 +1207,692 @@ class DetectPeaksDialog(customtkinter.CTkToplevel):
         self.detect_peaks_button.pack(pady=(10, 20), padx=20)
 
         self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.schedule_preview()
+
+    def on_auto_threshold_changed(self):
+        # The absolute height is ignored while the threshold is automatic
+        if self.auto_threshold_var.get() == "on":
+            self.entry_threshold.configure(state="disabled")
+            self.entry_threshold_k.configure(state="normal")
+        else:
+            self.entry_threshold.configure(state="normal")
+            self.entry_threshold_k.configure(state="disabled")
+        self.schedule_preview()
+
+    def on_height_slider(self, value):
+        if self.auto_threshold_var.get() == "on":
+            return
+        self.entry_threshold.delete(0, "end")
+        self.entry_threshold.insert(0, f"{value:.4g}")
+        self.schedule_preview()
+
+    def read_preview_params(self):
+        """Parse the detection entries for the preview, returning None when they are incomplete or invalid"""
+        try:
+            auto_threshold = self.auto_threshold_var.get() == "on"
+            threshold_k = float(self.entry_threshold_k.get()) if auto_threshold else None
+            peak_threshold = None if auto_threshold else float(self.entry_threshold.get())
+            min_distance = float(self.entry_distance.get()) if self.entry_distance.get() else None
+            width = float(self.entry_width.get()) if self.entry_width.get() else None
+            if (threshold_k is not None and threshold_k <= 0) or (min_distance is not None and min_distance < 1):
+                raise ValueError
+        except ValueError:
+            return None
+        return peak_threshold, min_distance, width, auto_threshold, threshold_k
+
+    def schedule_preview(self, event=None):
+        # Only preview once typing pauses; the slider reuses the same debounce
+        if getattr(self, 'on_preview', None) is None or not hasattr(self, 'label_preview_count'):
+            return
+        if self._preview_job is not None:
+            self.after_cancel(self._preview_job)
+        self._preview_job = self.after(150, self.update_preview)
+
+    def update_preview(self):
+        self._preview_job = None
+        params = self.read_preview_params() if self.preview_var.get() == "on" else None
+        peak_count = self.on_preview(params)
+        if peak_count is None:
+            self.label_preview_count.configure(text="")
+        else:
+            self.label_preview_count.configure(text=f"{peak_count} peaks")
+
+    def cancel_preview(self):
+        if self._preview_job is not None:
+            self.after_cancel(self._preview_job)
+            self._preview_job = None
 
     def on_confirm(self):
         self.peak_threshold = self.entry_threshold.get()
         self.min_distance = self.entry_distance.get()
         self.width = self.entry_width.get()
         self.peak_onset_window = self.entry_peak_onset_window.get()
-
-        if not self.peak_threshold:
+        self.auto_threshold = self.auto_threshold_var.get()
+        self.threshold_k = self.entry_threshold_k.get()
+        self.event_model = self.event_model_var.get()
+        self.skip_fits = self.skip_fits_var.get()
+
+        if self.auto_threshold == "on":
+            try:
+                if float(self.threshold_k) <= 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showwarning(title="Warning", message="k must be a positive number.", parent=self)
+                return
+        elif not self.peak_threshold:
             messagebox.showwarning(title="Warning", message="Peak height is required.", parent=self)
             return
+        self.cancel_preview()
+        self.grab_release()
+        self.destroy()
+
+    def on_close(self):
+        self.cancel_preview()
+        self.user_cancelled = True
+        self.grab_release()
+        self.destroy()
+
+class PerformanceDialog(customtkinter.CTkToplevel):
+    def __init__(self, parent, instrumentation):
+        super().__init__(parent)
+        self.title("Performance")
+        self.geometry("560x520")
+
+        set_window_style(self)
+        set_window_icon(self)
+
+        # Set window position to the right of the main window
+        parent_x = parent.winfo_x()
+        parent_y = parent.winfo_y()
+        self.geometry(f"+{parent_x + parent.winfo_width() + 10}+{parent_y}")
+
+        self.instrumentation = instrumentation
+        self.refresh_job = None
+        self.shown_records = -1
+
+        # Controls
+        self.control_frame = customtkinter.CTkFrame(self, fg_color="transparent")
+        self.control_frame.pack(fill="x", padx=20, pady=(20, 5))
+
+        self.enabled_var = customtkinter.StringVar(value="on" if instrumentation.enabled else "off")
+        self.enabled_switch = customtkinter.CTkSwitch(
+            self.control_frame,
+            text="Record actions",
+            variable=self.enabled_var,
+            onvalue="on",
+            offvalue="off",
+            command=self.on_toggle_enabled
+        )
+        self.enabled_switch.pack(side="left")
+
+        self.profile_next_var = customtkinter.StringVar(value="on" if instrumentation.profile_next else "off")
+        self.profile_next_checkbox = customtkinter.CTkCheckBox(
+            self.control_frame,
+            text="Profile next action",
+            variable=self.profile_next_var,
+            onvalue="on",
+            offvalue="off",
+            command=self.on_toggle_profile_next
+        )
+        self.profile_next_checkbox.pack(side="left", padx=(20, 0))
+
+        # JSON log
+        self.log_frame = customtkinter.CTkFrame(self, fg_color="transparent")
+        self.log_frame.pack(fill="x", padx=20, pady=5)
+
+        self.label_log = customtkinter.CTkLabel(
+            self.log_frame,
+            text="JSON log: " + (instrumentation.json_log_path or "off"),
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="w"
+        )
+        self.label_log.pack(side="left", fill="x", expand=True)
+
+        self.log_button = customtkinter.CTkButton(
+            self.log_frame,
+            text="Set Log File",
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            text_color="black",
+            width=90,
+            command=self.on_choose_log
+        )
+        self.log_button.pack(side="right")
+
+        # Report of the recorded actions, newest first
+        self.report_textbox = customtkinter.CTkTextbox(
+            self,
+            font=customtkinter.CTkFont(family="Consolas", size=11),
+            wrap="none"
+        )
+        self.report_textbox.pack(fill="both", expand=True, padx=20, pady=5)
+
+        self.button_frame = customtkinter.CTkFrame(self, fg_color="transparent")
+        self.button_frame.pack(fill="x", padx=20, pady=(5, 20))
+
+        for text, command in (("Refresh", self.refresh), ("Reset", self.on_reset), ("Save Profile", self.on_save_profile)):
+            button = customtkinter.CTkButton(
+                self.button_frame,
+                text=text,
+                fg_color="#dbdbdb",
+                hover_color="#d5d9df",
+                text_color="black",
+                font=customtkinter.CTkFont(size=12, weight="bold"),
+                width=110,
+                command=command
+            )
+            button.pack(side="left", padx=(0, 10))
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.refresh()
+        self.schedule_refresh()
+
+    def on_toggle_enabled(self):
+        self.instrumentation.enabled = self.enabled_var.get() == "on"
+        self.shown_records = -1
+        self.refresh()
+
+    def on_toggle_profile_next(self):
+        self.instrumentation.profile_next = self.profile_next_var.get() == "on"
+
+    def on_choose_log(self):
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".jsonl",
+            filetypes=[("JSON Lines", "*.jsonl"), ("All files", "*.*")],
+            parent=self
+        )
+        # Cancelling the dialog turns the log off
+        self.instrumentation.json_log_path = file_path or None
+        self.label_log.configure(text="JSON log: " + (file_path or "off"))
+
+    def on_reset(self):
+        self.instrumentation.reset()
+        self.refresh()
+
+    def on_save_profile(self):
+        if self.instrumentation.last_profile is None:
+            messagebox.showinfo("Info", "No profile recorded yet. Tick 'Profile next action' and run an action.", parent=self)
+            return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".prof",
+            filetypes=[("Profile", "*.prof"), ("All files", "*.*")],
+            parent=self
+        )
+        if file_path:
+            self.instrumentation.dump_profile(file_path)
+
+    def refresh(self):
+        from core.instrumentation import format_record
+
+        history = self.instrumentation.history
+        # The checkbox is cleared once the profiled action has run
+        self.profile_next_var.set("on" if self.instrumentation.profile_next else "off")
+        if len(history) == self.shown_records:
+            return
+        self.shown_records = len(history)
+
+        if history:
+            report = "\n\n".join(format_record(record) for record in reversed(history[-20:]))
+        elif self.instrumentation.enabled:
+            report = "No actions recorded yet."
+        else:
+            report = "Recording is off. Switch on 'Record actions' and run an action."
+
+        self.report_textbox.configure(state="normal")
+        self.report_textbox.delete("1.0", "end")
+        self.report_textbox.insert("1.0", report)
+        self.report_textbox.configure(state="disabled")
+
+    def schedule_refresh(self):
+        self.refresh()
+        self.refresh_job = self.after(1000, self.schedule_refresh)
+
+    def on_close(self):
+        if self.refresh_job is not None:
+            self.after_cancel(self.refresh_job)
+            self.refresh_job = None
+        self.destroy()
+
+class ParameterSweepDialog(customtkinter.CTkToplevel):
+    def __init__(self, parent, baseline_windows="", baseline_percentiles="", peak_thresholds="", min_distances="", widths="", rederive=True):
+        super().__init__(parent)
+        self.title("Parameter Sweep")
+        self.geometry("300x620")
+
+        set_window_style(self)
+        set_window_icon(self)
+
+        # Set window position to the left of the main window
+        parent_x = parent.winfo_x()
+        parent_y = parent.winfo_y()
+        self.geometry(f"+{parent_x - 540}+{parent_y}")
+
+        self.grid_values = None
+        self.max_workers = None
+        self.user_cancelled = False
+
+        # (attribute, label, description, default)
+        fields = [
+            ("baseline_windows", "Baseline Windows *", "Comma separated, e.g. 25, 50, 100", baseline_windows),
+            ("baseline_percentiles", "Baseline Percentiles *", "Comma separated, e.g. 20, 30", baseline_percentiles),
+            ("peak_thresholds", "Peak Heights *", "Comma separated, e.g. 0.1, 0.2, 0.3", peak_thresholds),
+            ("min_distances", "Min Distances", "Comma separated, empty for none", min_distances),
+            ("widths", "Widths", "Comma separated, empty for none", widths),
+        ]
+        self.entries = {}
+        for name, label, description, default in fields:
+            customtkinter.CTkLabel(
+                self,
+                text=label,
+                font=customtkinter.CTkFont(size=12),
+                anchor="w"
+            ).pack(pady=(5, 0), padx=20, anchor="w")
+            customtkinter.CTkLabel(
+                self,
+                text=description,
+                font=customtkinter.CTkFont(size=10),
+                text_color="gray",
+                anchor="w"
+            ).pack(pady=(0, 0), padx=20, anchor="w")
+            entry = customtkinter.CTkEntry(self, width=260)
+            entry.insert(0, default)
+            entry.pack(pady=(5, 5), padx=20, anchor="w")
+            self.entries[name] = entry
+
+        # Which trace the peaks are detected on, also given per row of the report
+        if rederive:
+            detection_note = "Each baseline window/percentile re-derives the trace from the raw signal as Load File does, so it changes the detected peaks too."
+        else:
+            detection_note = "No raw signal is loaded: every baseline detects on the loaded trace, only the ΔF/F statistics and fits change."
+        customtkinter.CTkLabel(
+            self,
+            text=detection_note,
+            font=customtkinter.CTkFont(size=10),
+            text_color="gray",
+            anchor="w",
+            justify="left",
+            wraplength=260
+        ).pack(pady=(5, 0), padx=20, anchor="w")
+
+        customtkinter.CTkLabel(
+            self,
+            text="Worker Processes",
+            font=customtkinter.CTkFont(size=12),
+            anchor="w"
+        ).pack(pady=(5, 0), padx=20, anchor="w")
+        self.entry_workers = customtkinter.CTkEntry(self, width=260)
+        self.entry_workers.insert(0, str(os.cpu_count() or 1))
+        self.entry_workers.pack(pady=(5, 10), padx=20, anchor="w")
+
+        self.run_button = customtkinter.CTkButton(
+            self,
+            text="Run Sweep",
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            text_color="black",
+            font=customtkinter.CTkFont(size=12, weight="bold"),
+            command=self.on_confirm,
+            height=40
+        )
+        self.run_button.pack(pady=(10, 20), padx=20)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_confirm(self):
+        try:
+            grid_values = {name: parse_number_list(entry.get()) for name, entry in self.entries.items()}
+            max_workers = int(self.entry_workers.get()) if self.entry_workers.get().strip() else None
+        except ValueError:
+            messagebox.showwarning(title="Warning", message="Every field must be a comma separated list of numbers.", parent=self)
+            return
+        if not grid_values['baseline_windows'] or not grid_values['baseline_percentiles'] or not grid_values['peak_thresholds']:
+            messagebox.showwarning(title="Warning", message="Baseline windows, percentiles and peak heights are required.", parent=self)
+            return
+        if any(d < 1 for d in grid_values['min_distances']):
+            messagebox.showwarning(title="Warning", message="Min distances must be at least 1.", parent=self)
+            return
+
+        self.grid_values = grid_values
+        self.max_workers = max_workers
+        self.grab_release()
+        self.destroy()
+
+    def on_close(self):
+        self.user_cancelled = True
+        self.grab_release()
+        self.destroy()
+
+def parse_number_list(text):
+    """Parse a comma separated list of numbers, an empty text gives an empty list"""
+    return [float(item) for item in text.replace(";", ",").split(",") if item.strip()]
+
+class TemplateMatchDialog(customtkinter.CTkToplevel):
+    def __init__(self, parent, tau_rise="", tau_decay="", k="4"):
+        super().__init__(parent)
+        self.title("Template Matching")
+        self.geometry("250x380")
+
+        set_window_style(self)
+        set_window_icon(self)
+
+        # Set window position to the left of the main window
+        parent_x = parent.winfo_x()
+        parent_y = parent.winfo_y()
+        self.geometry(f"+{parent_x - 490}+{parent_y}")
+
+        self.tau_rise = None
+        self.tau_decay = None
+        self.k = None
+        self.user_cancelled = False
+
+        # (attribute, label, description, default)
+        fields = [
+            ("tau_rise", "τ (rise) *", "Template rise constant (median fit by default)", tau_rise),
+            ("tau_decay", "τ (decay) *", "Template decay constant (median fit by default)", tau_decay),
+            ("k", "Threshold (k·σ) *", "Robust SDs of the deconvolved trace", k),
+        ]
+        self.entries = {}
+        for name, label, description, default in fields:
+            customtkinter.CTkLabel(
+                self,
+                text=label,
+                font=customtkinter.CTkFont(size=12),
+                anchor="w"
+            ).pack(pady=(5, 0), padx=20, anchor="w")
+            customtkinter.CTkLabel(
+                self,
+                text=description,
+                font=customtkinter.CTkFont(size=10),
+                text_color="gray",
+                anchor="w"
+            ).pack(pady=(0, 0), padx=20, anchor="w")
+            entry = customtkinter.CTkEntry(self, width=200)
+            entry.insert(0, default)
+            entry.pack(pady=(5, 10), padx=20, anchor="w")
+            self.entries[name] = entry
+
+        detect_icon = load_svg_image('assets/magnifier.svg', width=24, height=24)
+        detect_icon_ctk = customtkinter.CTkImage(
+            light_image=detect_icon,
+            dark_image=detect_icon,
+            size=(20, 20)
+        )
+        self.detect_button = customtkinter.CTkButton(
+            self,
+            image=detect_icon_ctk,
+            compound="left",
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            text="Detect",
+            text_color="black",
+            font=customtkinter.CTkFont(size=12, weight="bold"),
+            command=self.on_confirm,
+            height=40
+        )
+        self.detect_button.pack(pady=(10, 20), padx=20)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_confirm(self):
+        values = {name: entry.get().strip() for name, entry in self.entries.items()}
+        try:
+            if any(float(value) <= 0 for value in values.values()):
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning(
+                title="Warning",
+                message="τ (rise), τ (decay) and k must be positive numbers. Fit some peaks first to get default taus.",
+                parent=self
+            )
+            return
+
+        self.tau_rise = values['tau_rise']
+        self.tau_decay = values['tau_decay']
+        self.k = values['k']
+        self.grab_release()
+        self.destroy()
+
+    def on_close(self):
+        self.user_cancelled = True
+        self.grab_release()
+        self.destroy()
+
+class LiveAcquisitionDialog(customtkinter.CTkToplevel):
+    def __init__(self, parent, x_col="", y_col="", baseline_window_size="", baseline_percentage="",
+                 peak_threshold="", min_distance="", frame_rate="5", span="30"):
+        super().__init__(parent)
+        self.title("Live Acquisition")
+        self.geometry("250x720")
+
+        set_window_style(self)
+        set_window_icon(self)
+
+        # Set window position to the left of the main window
+        parent_x = parent.winfo_x()
+        parent_y = parent.winfo_y()
+        self.geometry(f"+{parent_x - 490}+{parent_y}")
+
+        self.x_col = None
+        self.y_col = None
+        self.baseline_window_size = None
+        self.baseline_percentage = None
+        self.peak_threshold = None
+        self.min_distance = None
+        self.frame_rate = None
+        self.span = None
+        self.user_cancelled = False
+
+        # (attribute, label, description, default)
+        fields = [
+            ("x_col", "Time column", "CSV column name (first column by default)", x_col),
+            ("y_col", "Signal column", "CSV column name (second column by default)", y_col),
+            ("baseline_window_size", "Baseline window *", "Trailing samples of the running baseline", baseline_window_size),
+            ("baseline_percentage", "Baseline percentile *", "Percentile of the window (0-100)", baseline_percentage),
+            ("peak_threshold", "Peak height *", "Minimum ΔF/F of a detected event", peak_threshold),
+            ("min_distance", "Min distance", "Samples between events, confirmation delay", min_distance),
+            ("frame_rate", "Refresh rate (Hz) *", "Plot and table updates per second", frame_rate),
+            ("span", "Visible span (s) *", "Trailing time shown while following", span),
+        ]
+        self.entries = {}
+        for name, label, description, default in fields:
+            customtkinter.CTkLabel(
+                self,
+                text=label,
+                font=customtkinter.CTkFont(size=12),
+                anchor="w"
+            ).pack(pady=(5, 0), padx=20, anchor="w")
+            customtkinter.CTkLabel(
+                self,
+                text=description,
+                font=customtkinter.CTkFont(size=10),
+                text_color="gray",
+                anchor="w"
+            ).pack(pady=(0, 0), padx=20, anchor="w")
+            entry = customtkinter.CTkEntry(self, width=200)
+            entry.insert(0, default)
+            entry.pack(pady=(5, 10), padx=20, anchor="w")
+            self.entries[name] = entry
+
+        start_icon = load_svg_image('assets/live.svg', width=24, height=24)
+        start_icon_ctk = customtkinter.CTkImage(
+            light_image=start_icon,
+            dark_image=start_icon,
+            size=(20, 20)
+        )
+        self.start_button = customtkinter.CTkButton(
+            self,
+            image=start_icon_ctk,
+            compound="left",
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            text="Start",
+            text_color="black",
+            font=customtkinter.CTkFont(size=12, weight="bold"),
+            command=self.on_confirm,
+            height=40
+        )
+        self.start_button.pack(pady=(10, 20), padx=20)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_confirm(self):
+        values = {name: entry.get().strip() for name, entry in self.entries.items()}
+        try:
+            if int(values['baseline_window_size']) <= 0:
+                raise ValueError
+            if not 0 <= float(values['baseline_percentage']) <= 100:
+                raise ValueError
+            float(values['peak_threshold'])
+            if values['min_distance'] and float(values['min_distance']) < 1:
+                raise ValueError
+            if float(values['frame_rate']) <= 0 or float(values['span']) <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning(
+                title="Warning",
+                message="Please enter a positive baseline window, a percentile between 0 and 100, a peak height, "
+                        "and a positive refresh rate and span.",
+                parent=self
+            )
+            return
+
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.grab_release()
+        self.destroy()
+
+    def on_close(self):
+        self.user_cancelled = True
+        self.grab_release()
+        self.destroy()
+
+class LargeFileDialog(customtkinter.CTkToplevel):
+    def __init__(self, parent, sheet_name="", x_col="", y_col="", baseline_window_size="", baseline_percentage="",
+                 peak_threshold="", min_distance="", width="", peak_onset_window="", chunk_samples="1000000",
+                 convert_to_df_f="on"):
+        super().__init__(parent)
+        self.title("Analyze Large File")
+        self.geometry("250x880")
+
+        set_window_style(self)
+        set_window_icon(self)
+
+        # Set window position to the left of the main window
+        parent_x = parent.winfo_x()
+        parent_y = parent.winfo_y()
+        self.geometry(f"+{parent_x - 490}+{parent_y}")
+
+        self.sheet_name = None
+        self.x_col = None
+        self.y_col = None
+        self.baseline_window_size = None
+        self.baseline_percentage = None
+        self.peak_threshold = None
+        self.min_distance = None
+        self.width = None
+        self.peak_onset_window = None
+        self.chunk_samples = None
+        self.convert_to_df_f = None
+        self.user_cancelled = False
+
+        # (attribute, label, description, default)
+        fields = [
+            ("sheet_name", "Sheet name", "Excel only, the active sheet by default", sheet_name),
+            ("x_col", "Time column", "Header (column number for .npy)", x_col),
+            ("y_col", "Signal column", "Header (column number for .npy)", y_col),
+            ("baseline_window_size", "Baseline window *", "Samples of the rolling baseline", baseline_window_size),
+            ("baseline_percentage", "Baseline percentile *", "Percentile of the window (0-100)", baseline_percentage),
+            ("peak_threshold", "Peak height *", "Detect peaks above this threshold", peak_threshold),
+            ("min_distance", "Min distance", "Minimum samples between peaks", min_distance),
+            ("width", "Width", "Minimum peak width in samples", width),
+            ("peak_onset_window", "Peak onset window", "Samples before a peak searched for its onset", peak_onset_window),
+            ("chunk_samples", "Chunk size *", "Samples analysed at once, bounds the memory use", chunk_samples),
+        ]
+        self.entries = {}
+        for name, label, description, default in fields:
+            customtkinter.CTkLabel(
+                self,
+                text=label,
+                font=customtkinter.CTkFont(size=12),
+                anchor="w"
+            ).pack(pady=(5, 0), padx=20, anchor="w")
+            customtkinter.CTkLabel(
+                self,
+                text=description,
+                font=customtkinter.CTkFont(size=10),
+                text_color="gray",
+                anchor="w"
+            ).pack(pady=(0, 0), padx=20, anchor="w")
+            entry = customtkinter.CTkEntry(self, width=200)
+            entry.insert(0, default)
+            entry.pack(pady=(5, 10), padx=20, anchor="w")
+            self.entries[name] = entry
+
+        self.convert_var = customtkinter.StringVar(value=convert_to_df_f or "on")
+        self.convert_checkbox = customtkinter.CTkCheckBox(
+            self,
+            text="convert to ΔF/F",
+            variable=self.convert_var,
+            onvalue="on",
+            offvalue="off",
+            checkbox_width=18,
+            checkbox_height=18,
+            corner_radius=0,
+            border_width=2,
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            checkmark_color="black",
+            border_color="black"
+        )
+        self.convert_checkbox.pack(pady=(0, 5), padx=20, anchor="w")
+        Tooltip(self.convert_checkbox, "Like Convert and Load: only applied when the mean signal is above 3")
+
+        analyze_icon = load_svg_image('assets/large_file.svg', width=24, height=24)
+        analyze_icon_ctk = customtkinter.CTkImage(
+            light_image=analyze_icon,
+            dark_image=analyze_icon,
+            size=(20, 20)
+        )
+        self.analyze_button = customtkinter.CTkButton(
+            self,
+            image=analyze_icon_ctk,
+            compound="left",
+            fg_color="#dbdbdb",
+            hover_color="#d5d9df",
+            text="Analyze",
+            text_color="black",
+            font=customtkinter.CTkFont(size=12, weight="bold"),
+            command=self.on_confirm,
+            height=40
+        )
+        self.analyze_button.pack(pady=(10, 20), padx=20)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_confirm(self):
+        values = {name: entry.get().strip() for name, entry in self.entries.items()}
+        try:
+            if int(values['baseline_window_size']) <= 0 or int(values['chunk_samples']) <= 0:
+                raise ValueError
+            if not 0 <= float(values['baseline_percentage']) <= 100:
+                raise ValueError
+            float(values['peak_threshold'])
+            for name in ('min_distance', 'width', 'peak_onset_window'):
+                if values[name] and float(values[name]) <= 0:
+                    raise ValueError
+        except ValueError:
+            messagebox.showwarning(
+                title="Warning",
+                message="Please enter a positive baseline window and chunk size, a percentile between 0 and 100 "
+                        "and a peak height; the optional values must be positive.",
+                parent=self
+            )
+            return
+
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.convert_to_df_f = self.convert_var.get()
         self.grab_release()
         self.destroy()
 
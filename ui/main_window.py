@@ -9,7 +9,11 @@ from utils.file_utils import load_file
 from utils.image_utils import load_svg_image
 from ui.widgets import Tooltip, SegmentedProgressBar
 from ui.window import set_window_style, set_window_icon
-from core.event_handlers import handle_canvas_click
+from core.event_handlers import handle_canvas_click, handle_canvas_hover
+from core.instrumentation import instrumented_action
+from utils.table_operations_utils import TABLE_COLUMNS
+from utils.overview_utils import setup_overview
+from utils.navigation_utils import NAVIGATION_KEYS, on_navigation_key, on_scroll, on_pan_press, on_pan_motion, on_pan_release
 
 def setup_ui(app):
     """
@@ -81,6 +85,15 @@ def setup_ui(app):
     # Bind events to handle window restore
     app.bind('<Map>', on_window_map)
     app.bind('<Configure>', on_window_configure)
+
+    # Undo/redo of manual peak edits
+    app.bind('<Control-z>', app.undo_edit)
+    app.bind('<Control-y>', app.redo_edit)
+    app.bind('<Control-Shift-Z>', app.redo_edit)
+
+    # Keyboard navigation: arrows and Page Up/Down page, +/- zoom, Home/End jump to the ends
+    for keysym in NAVIGATION_KEYS:
+        app.bind(f'<KeyPress-{keysym}>', lambda event: on_navigation_key(app, event))
     
 def setup_button_frame(app):
     """Set up the top button frame with control buttons"""
@@ -108,6 +121,55 @@ def setup_button_frame(app):
         dark_image=app.partition_evoked_icon,
         size=(20, 20)
     )
+
+    app.template_icon = load_svg_image('assets/template_match.svg', width=24, height=24)
+    app.template_icon_ctk = customtkinter.CTkImage(
+        light_image=app.template_icon,
+        dark_image=app.template_icon,
+        size=(20, 20)
+    )
+
+    app.sweep_icon = load_svg_image('assets/sweep.svg', width=24, height=24)
+    app.sweep_icon_ctk = customtkinter.CTkImage(
+        light_image=app.sweep_icon,
+        dark_image=app.sweep_icon,
+        size=(20, 20)
+    )
+
+    app.save_session_icon = load_svg_image('assets/save_session.svg', width=24, height=24)
+    app.save_session_icon_ctk = customtkinter.CTkImage(
+        light_image=app.save_session_icon,
+        dark_image=app.save_session_icon,
+        size=(20, 20)
+    )
+
+    app.open_session_icon = load_svg_image('assets/open_session.svg', width=24, height=24)
+    app.open_session_icon_ctk = customtkinter.CTkImage(
+        light_image=app.open_session_icon,
+        dark_image=app.open_session_icon,
+        size=(20, 20)
+    )
+
+    app.live_icon = load_svg_image('assets/live.svg', width=24, height=24)
+    app.live_icon_ctk = customtkinter.CTkImage(
+        light_image=app.live_icon,
+        dark_image=app.live_icon,
+        size=(20, 20)
+    )
+
+    app.large_file_icon = load_svg_image('assets/large_file.svg', width=24, height=24)
+    app.large_file_icon_ctk = customtkinter.CTkImage(
+        light_image=app.large_file_icon,
+        dark_image=app.large_file_icon,
+        size=(20, 20)
+    )
+
+    app.performance_icon = load_svg_image('assets/performance.svg', width=24, height=24)
+    app.performance_icon_ctk = customtkinter.CTkImage(
+        light_image=app.performance_icon,
+        dark_image=app.performance_icon,
+        size=(20, 20)
+    )
     
     # Create buttons
     app.load_file_button = customtkinter.CTkButton(
@@ -119,7 +181,7 @@ def setup_button_frame(app):
         text="Load File",
         text_color="black",
         font=customtkinter.CTkFont(size=12, weight="bold"),
-        command=lambda: load_file(app)
+        command=instrumented_action(app, "load_file", lambda: load_file(app))
     )
     app.load_file_button.pack(side="left", padx=5, pady=5)
     
@@ -135,6 +197,93 @@ def setup_button_frame(app):
         command=app.detect_peaks
     )
     app.detect_peaks_button.pack(side="left", padx=5, pady=5)
+
+    app.template_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.template_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Template Match",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.detect_events
+    )
+    app.template_button.pack(side="left", padx=5, pady=5)
+
+    app.sweep_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.sweep_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Sweep",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.sweep_parameters
+    )
+    app.sweep_button.pack(side="left", padx=5, pady=5)
+
+    app.save_session_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.save_session_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Save Session",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.save_session
+    )
+    app.save_session_button.pack(side="left", padx=5, pady=5)
+
+    app.open_session_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.open_session_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Open Session",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.open_session
+    )
+    app.open_session_button.pack(side="left", padx=5, pady=5)
+
+    app.large_file_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.large_file_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Large File",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.analyze_large_file
+    )
+    app.large_file_button.pack(side="left", padx=5, pady=5)
+
+    app.live_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.live_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Live",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        command=app.toggle_live_acquisition
+    )
+    app.live_button.pack(side="left", padx=5, pady=5)
+
+    # Event count and rate while the live mode runs
+    app.live_status_label = customtkinter.CTkLabel(
+        app.button_frame,
+        text="",
+        font=customtkinter.CTkFont(size=10),
+        text_color="gray"
+    )
+    app.live_status_label.pack(side="left", padx=5, pady=5)
     
     app.partition_evoked_button = customtkinter.CTkButton(
         app.button_frame,
@@ -159,6 +308,20 @@ def setup_button_frame(app):
     )
     app.progress_bar.pack(side="right", padx=20)
 
+    app.performance_button = customtkinter.CTkButton(
+        app.button_frame,
+        image=app.performance_icon_ctk,
+        compound="left",
+        fg_color="transparent", 
+        hover_color="#d5d9df",
+        text="Performance",
+        text_color="black",
+        font=customtkinter.CTkFont(size=12, weight="bold"),
+        width=30,
+        command=app.show_performance_panel
+    )
+    app.performance_button.pack(side="right", padx=5, pady=5)
+
 def setup_canvas_frame(app):
     """Set up the canvas frame with matplotlib figure and navigation controls"""
     # Create canvas frame
@@ -176,7 +339,17 @@ def setup_canvas_frame(app):
     # Add mouse events
     app.canvas.mpl_connect('axes_enter_event', app.on_enter_axes)
     app.canvas.mpl_connect('axes_leave_event', app.on_leave_axes)
-    app.canvas.mpl_connect('button_press_event', lambda event: handle_canvas_click(event, app))
+    app.canvas.mpl_connect('button_press_event', instrumented_action(app, "canvas_click", lambda event: handle_canvas_click(event, app)))
+    # Wheel zoom around the cursor and middle-button panning
+    app.canvas.mpl_connect('scroll_event', lambda event: on_scroll(app, event))
+    app.canvas.mpl_connect('button_press_event', lambda event: on_pan_press(app, event))
+    app.canvas.mpl_connect('motion_notify_event', lambda event: on_pan_motion(app, event))
+    app.canvas.mpl_connect('button_release_event', lambda event: on_pan_release(app, event))
+    # Tooltip of the marked peak under the cursor
+    app.canvas.mpl_connect('motion_notify_event', lambda event: handle_canvas_hover(event, app))
+
+    # Overview of the whole recording under the plot
+    setup_overview(app, app.canvas_frame, row=1)
     
     # Load navigation icons
     zoom_in_image = load_svg_image('assets/zoom_in.svg', width=24, height=24)
@@ -294,7 +467,8 @@ def setup_canvas_frame(app):
         border_width=0,
         corner_radius=0
     )
-    app.click_window_size_frame.place(relx=1.0, rely=1.0, x=-5, y=5, anchor="se")
+    # Placed on the plot itself, so that it stays above the overview strip
+    app.click_window_size_frame.place(in_=app.canvas_widget, relx=1.0, rely=1.0, x=-5, y=5, anchor="se")
 
     app.click_window_size_label = customtkinter.CTkLabel(
         app.click_window_size_frame,
@@ -404,7 +578,7 @@ def setup_table_frame(app):
     # Create treeview
     app.tree = ttk.Treeview(
         app.tree_frame,
-        columns=("Time", "ΔF/F", "τ (rise)", "τ (decay)", "Raw Peak Value", "Baseline"),
+        columns=TABLE_COLUMNS,
         show="tree headings",
         height=8,
         selectmode="extended"
@@ -427,7 +601,7 @@ def setup_table_frame(app):
     
     # Create context menu
     app.context_menu = tkinter.Menu(app, tearoff=0, font=("tahoma", 15, "normal"))
-    app.context_menu.add_command(label="recalculate", command=app.recalculate_column)
+    app.context_menu.add_command(label="recalculate", command=instrumented_action(app, "recalculate_column", app.recalculate_column))
     
     # Create scrollbar
     scrollbar = ttk.Scrollbar(app.table_frame, orient="vertical", command=app.tree.yview)
@@ -51,18 +51,20 @@ class SegmentedProgressBar(customtkinter.CTkFrame):
             )
             segment.pack(side="left", padx=1.3)  # Keep small square spacing
             self.segments.append(segment)
+        self.active_segments = 0
             
     def set(self, value):
         """
         Set progress, value range is 0-1
         """
         total_segments = len(self.segments)
-        active_segments = int(value * total_segments)
+        active_segments = min(max(int(value * total_segments), 0), total_segments)
         
-        # Update segments display
-        for i in range(total_segments):
+        # Only reconfigure the segments whose state changed
+        for i in range(min(active_segments, self.active_segments), max(active_segments, self.active_segments)):
             if i < active_segments:
                 self.segments[i].configure(fg_color="black")  # Activated segment turns black
             else:
                 self.segments[i].configure(fg_color="#dddddd")  # Inactive segment remains white
+        self.active_segments = active_segments
                 
@@ -1,11 +1,216 @@
-import openpyxl
+import os
 import traceback
 import numpy as np
-import pandas as pd
 from tkinter import filedialog, messagebox
-from ui.dialogs import LoadFileDialog
 from core.app_state import clear_plot
-from core.calculate_baseline import calculate_baseline
+from core.signal_conversion import convert_trace
+from core.precision import precision_dtype
+from utils.overview_utils import draw_overview
+from core.instrumentation import get_instrumentation
+from core.progress import get_progress_reporter
+
+def read_excel_columns(file_path, sheet_name, x_col, y_col, rfp_col=None, progress=None):
+    """
+    Read the time, signal and optional reference columns of one worksheet
+    
+    Args:
+        file_path: Path of the Excel file
+        sheet_name: Name of the worksheet
+        x_col: Header of the time column
+        y_col: Header of the signal column
+        rfp_col: Header of the reference (RFP) column, None in single-channel mode
+        progress: Optional callback receiving the progress fraction
+    
+    Returns:
+        tuple: (time_values, signal_values, rfp_values) lists, rfp_values is None without rfp_col
+    
+    Raises:
+        ValueError: If the sheet or one of the columns does not exist
+    """
+    import openpyxl
+
+    if progress is not None:
+        progress(0.1)
+
+    # Use the read-only mode to open the Excel file
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if progress is not None:
+            progress(0.2)
+
+        # Get the specified sheet
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"Sheet '{sheet_name}' not found in the workbook.")
+        ws = wb[sheet_name]
+        
+        # Get the header row and convert the column names to strings
+        header_row = next(ws.rows)
+        header = [str(cell.value) for cell in header_row]
+        
+        # Find the indices of the requested columns
+        column_indices = []
+        for col in [x_col, y_col] + ([rfp_col] if rfp_col else []):
+            if col not in header:
+                raise ValueError(f"Column '{col}' not found in the sheet.")
+            column_indices.append(header.index(col))
+        x_idx, y_idx = column_indices[:2]
+        rfp_idx = column_indices[2] if rfp_col else None
+        
+        # Prepare data lists
+        time_values = []
+        signal_values = []
+        rfp_values = [] if rfp_col else None
+
+        # Get the total number of rows estimate (cannot directly get the number of rows in read-only mode)
+        # Using ws.max_row may be inaccurate, but can be used as a reference for the progress bar
+        total_rows_estimate = max((ws.max_row or 1) - 1, 1)  # Subtract the header row
+        
+        # Read data rows
+        row_count = 0
+        for row in ws.rows:
+            row_count += 1
+            if row_count == 1:  # Skip the header row
+                continue
+            
+            # Get the x and y values
+            try:
+                x_val = row[x_idx].value
+                y_val = row[y_idx].value
+                
+                # if DR/R mode, get the RFP value
+                if rfp_col:
+                    rfp_val = row[rfp_idx].value
+                    if x_val is not None and y_val is not None and rfp_val is not None and float(rfp_val) != 0:
+                        time_values.append(float(x_val))
+                        signal_values.append(float(y_val))
+                        rfp_values.append(float(rfp_val))
+                else:
+                    if x_val is not None and y_val is not None:
+                        time_values.append(float(x_val))
+                        signal_values.append(float(y_val))
+            except (IndexError, TypeError, ValueError):
+                # Skip problematic rows
+                continue
+            
+            # Update the progress every 1000 rows
+            if progress is not None and row_count % 1000 == 0:
+                progress(min(0.2 + 0.7 * row_count / total_rows_estimate, 0.9))
+    finally:
+        # Close the workbook
+        wb.close()
+
+    return time_values, signal_values, rfp_values
+
+def iter_trace_blocks(file_path, x_col=None, y_col=None, sheet_name=None, block_samples=100_000):
+    """
+    Read the time and signal columns of a trace file in blocks of bounded size
+    
+    Excel rows are skipped like read_excel_columns does; CSV and .npy rows with a missing
+    or non-numeric value are skipped too. .npy files are (n_samples, n_columns) arrays,
+    read through a memory map, with x_col and y_col as column numbers (0 and 1 by default).
+    
+    Args:
+        file_path: Path of an .xlsx, .csv or .npy file
+        x_col: Header (number for .npy) of the time column, the first column by default
+        y_col: Header (number for .npy) of the signal column, the second column by default
+        sheet_name: Worksheet of an Excel file, the active sheet by default
+        block_samples: Rows per block
+    
+    Yields:
+        tuple: (time_values, signal_values) float arrays of at most block_samples rows
+    
+    Raises:
+        ValueError: If the sheet or one of the columns does not exist
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+
+    if extension == '.npy':
+        data = np.load(file_path, mmap_mode='r')
+        x_idx = int(x_col) if x_col not in (None, "") else 0
+        y_idx = int(y_col) if y_col not in (None, "") else 1
+        for start in range(0, len(data), block_samples):
+            block = np.array(data[start:start + block_samples, [x_idx, y_idx]], dtype=float)
+            block = block[np.isfinite(block).all(axis=1)]
+            yield block[:, 0], block[:, 1]
+        return
+
+    if extension == '.csv':
+        import pandas as pd
+
+        columns = [x_col, y_col] if x_col and y_col else [0, 1]
+        try:
+            reader = pd.read_csv(file_path, usecols=columns, chunksize=block_samples)
+        except ValueError as e:
+            raise ValueError(f"Columns not found in the file: {e}")
+        for chunk in reader:
+            chunk = chunk.apply(pd.to_numeric, errors='coerce').dropna()
+            names = [x_col, y_col] if x_col and y_col else chunk.columns[:2]
+            yield chunk[names[0]].to_numpy(dtype=float), chunk[names[1]].to_numpy(dtype=float)
+        return
+
+    import openpyxl
+
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name and sheet_name not in wb.sheetnames:
+            raise ValueError(f"Sheet '{sheet_name}' not found in the workbook.")
+        ws = wb[sheet_name] if sheet_name else wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = [str(value) for value in next(rows)]
+        column_indices = []
+        for col, default in ((x_col, 0), (y_col, 1)):
+            if not col:
+                column_indices.append(default)
+            elif col not in header:
+                raise ValueError(f"Column '{col}' not found in the sheet.")
+            else:
+                column_indices.append(header.index(col))
+        x_idx, y_idx = column_indices
+
+        time_values, signal_values = [], []
+        for row in rows:
+            try:
+                x_val, y_val = row[x_idx], row[y_idx]
+                if x_val is not None and y_val is not None:
+                    x_val, y_val = float(x_val), float(y_val)
+                    time_values.append(x_val)
+                    signal_values.append(y_val)
+            except (IndexError, TypeError, ValueError):
+                # Skip problematic rows
+                continue
+            if len(time_values) >= block_samples:
+                yield np.array(time_values), np.array(signal_values)
+                time_values, signal_values = [], []
+        if time_values:
+            yield np.array(time_values), np.array(signal_values)
+    finally:
+        wb.close()
+
+def draw_trace(app):
+    """
+    Draw the loaded trace, and its baseline when the trace is not ΔF/F, on a cleared axis
+    
+    Args:
+        app: The main application instance
+    """
+    app.ax.clear()
+    app.ax.plot(app.time, app.df_f, color='black')
+    app.ax.set_ylim(np.min(app.df_f), np.max(app.df_f))
+    app.ax.grid(True)
+
+    if (not app.convert_to_df_f) and hasattr(app, 'baseline_values') and app.baseline_values is not None:
+        # clear old baseline
+        if hasattr(app, 'baseline_line') and app.baseline_line is not None:
+            try:
+                app.baseline_line.remove()
+            except Exception:
+                pass
+            app.baseline_line = None
+    
+        app.baseline_line, = app.ax.plot(app.time, app.baseline_values, color='deepskyblue', linestyle='--', linewidth=1.5, alpha=0.8, label='Baseline')
+        app.ax.legend(loc='best')
+
+    draw_overview(app)
 
 def load_file(app):
     """
@@ -17,6 +222,12 @@ def load_file(app):
     Returns:
         bool: If the file is successfully loaded, return True, otherwise return False
     """
+    # pandas is only needed once a file is actually loaded
+    import pandas as pd
+    from ui.dialogs import LoadFileDialog
+
+    instrumentation = get_instrumentation(app)
+
     try:
 
         # Create and display the input dialog, using the last input as the default value
@@ -27,7 +238,9 @@ def load_file(app):
             default_y_col=app.last_y_col,
             default_RFP_col=app.last_RFP_col,
             default_baseline_window_size=app.last_baseline_window_size,
-            default_baseline_percentage=app.last_baseline_percentage
+            default_baseline_percentage=app.last_baseline_percentage,
+            default_keep_raw_baseline=app.last_keep_raw_baseline,
+            default_precision=app.last_precision
         )
 
         try:
@@ -38,7 +251,8 @@ def load_file(app):
                     load_file_dialog.destroy()
             
             app.bind('<Destroy>', handle_destroy)
-            app.wait_window(load_file_dialog)  # Wait for the dialog to close
+            with instrumentation.stage("dialog", idle=True):
+                app.wait_window(load_file_dialog)  # Wait for the dialog to close
             app.unbind('<Destroy>')
         except Exception as e:
             # Ignore binding related errors when the window is closed
@@ -73,11 +287,15 @@ def load_file(app):
         app.last_sheet_name = sheet_name
         app.last_x_col = x_col
         app.last_y_col = y_col
+        app.last_RFP_smoothing_window_size = RFP_smoothing_window_size
         app.last_baseline_window_size = baseline_window_size
         app.last_baseline_percentage = baseline_percentage
+        app.last_keep_raw_baseline = load_file_dialog.keep_raw_baseline
+        app.last_precision = load_file_dialog.precision
 
         # Use the file dialog to select a file
-        file_path = filedialog.askopenfilename()
+        with instrumentation.stage("choose_file", idle=True):
+            file_path = filedialog.askopenfilename()
 
         if not file_path:
             messagebox.showwarning(title="Warning", message="No file selected.")
@@ -90,99 +308,26 @@ def load_file(app):
             # Set the progress bar to 0
             app.progress_bar.set(0)
             
-            # Use the read-only mode to load the Excel file
-            app.progress_bar.set(0.1)
-            
-            # Use the read-only mode to open the Excel file
-            wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-            app.progress_bar.set(0.2)
-            
-            # Get the specified sheet
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-            else:
-                messagebox.showerror(title="Error", message=f"Sheet '{sheet_name}' not found in the workbook.")
-                app.progress_bar.set(0)
-                return False
-            
-            # Get the header row
-            header_row = next(ws.rows)
-            header = [cell.value for cell in header_row]
-            
-            # Convert the column names to strings
-            header = [str(col) for col in header]
-            
-            # Find the indices of the x and y columns
-            try:
-                x_idx = header.index(x_col)
-            except ValueError:
-                error_msg = f"Column '{x_col}' not found in the sheet."
-                messagebox.showerror(title="Error", message=error_msg)
-                app.progress_bar.set(0)
-                return False
-                
+            # Read the selected columns from the workbook
+            report_progress = get_progress_reporter(app)
+
             try:
-                y_idx = header.index(y_col)
-            except ValueError:
-                error_msg = f"Column '{y_col}' not found in the sheet."
-                messagebox.showerror(title="Error", message=error_msg)
+                with instrumentation.stage("read"):
+                    time_values, signal_values, rfp_values = read_excel_columns(
+                        file_path,
+                        sheet_name,
+                        x_col,
+                        y_col,
+                        rfp_col=RFP_col if convert_to_dr_r else None,
+                        progress=report_progress
+                    )
+            except ValueError as e:
+                messagebox.showerror(title="Error", message=str(e))
                 app.progress_bar.set(0)
                 return False
-                
-            # if DR/R mode, find the index of the RFP column
-            if convert_to_dr_r and RFP_col:
-                try:
-                    rfp_idx = header.index(RFP_col)
-                except ValueError:
-                    error_msg = f"Column '{RFP_col}' not found in the sheet."
-                    messagebox.showerror(title="Error", message=error_msg)
-                    app.progress_bar.set(0)
-                    return False
-            
-            # Prepare data lists
-            app.time = []
-            app.df_f = []
-            rfp_values = [] if convert_to_dr_r else None
-
-            # Get the total number of rows estimate (cannot directly get the number of rows in read-only mode)
-            # Using ws.max_row may be inaccurate, but can be used as a reference for the progress bar
-            total_rows_estimate = ws.max_row - 1  # Subtract the header row
-            
-            # Read data rows
-            row_count = 0
-            for row in ws.rows:
-                row_count += 1
-                if row_count == 1:  # Skip the header row
-                    continue
-                
-                # Get the x and y values
-                try:
-                    x_val = row[x_idx].value
-                    y_val = row[y_idx].value
-                    
-                    # if DR/R mode, get the RFP value
-                    if convert_to_dr_r:
-                        rfp_val = row[rfp_idx].value
-                        if x_val is not None and y_val is not None and rfp_val is not None and float(rfp_val) != 0:
-                            app.time.append(float(x_val))
-                            app.df_f.append(float(y_val))
-                            rfp_values.append(float(rfp_val))
-                    else:
-                        if x_val is not None and y_val is not None:
-                            app.time.append(float(x_val))
-                            app.df_f.append(float(y_val))
-                except (IndexError, TypeError, ValueError) as e:
-                    # Skip problematic rows
-                    continue
-                
-                # Update the progress bar
-                if row_count % 1000 == 0:  # Update the progress bar every 1000 rows
-                    progress = min(0.2 + 0.7 * row_count / total_rows_estimate, 0.9)
-                    app.progress_bar.set(progress)
-                    app.update()  # Force update GUI
-            
-            # Close the workbook
-            wb.close()
+            app.time = time_values
+            app.df_f = signal_values
+            app.source_path = file_path
             
             # Check if the data was successfully read
             if not app.time or not app.df_f:
@@ -190,66 +335,35 @@ def load_file(app):
                 app.progress_bar.set(0)
                 return False
             
-            # Convert to pandas Series
+            # Smoothing, ratio, baselines and normalization on plain arrays, then wrapped once.
+            # The values (and everything computed from them) take the selected precision,
+            # the times stay float64
+            dtype = precision_dtype(app.last_precision)
+            with instrumentation.stage("convert"):
+                signal_values = np.asarray(app.df_f, dtype=dtype)
+                rfp = np.asarray(rfp_values, dtype=dtype) if convert_to_dr_r else None
+                converted = convert_trace(
+                    signal_values,
+                    baseline_window=int(baseline_window_size),
+                    baseline_percentile=float(baseline_percentage),
+                    convert_to_df_f=app.convert_to_df_f,
+                    rfp=rfp,
+                    rfp_smoothing_window=int(RFP_smoothing_window_size) if RFP_smoothing_window_size else None,
+                    keep_raw_baseline=app.last_keep_raw_baseline == "on"
+                )
             app.time = pd.Series(app.time)
-            app.df_f = pd.Series(app.df_f)
-            app.raw_values = pd.Series(app.df_f.values.copy())
-
-            calculate_baseline(app, window_size=int(baseline_window_size), percentile=float(baseline_percentage))
-            if getattr(app, 'baseline_values', None) is not None:
-                app.raw_baseline = app.baseline_values.copy()
-            else:
-                app.raw_baseline = None
-            
-            # handle DR/R case
-            if convert_to_dr_r:
-                rfp_values = pd.Series(rfp_values)
-
-                # if RFP smoothing window size is not empty, perform smoothing
-                if RFP_smoothing_window_size and int(RFP_smoothing_window_size) > 1:
-                    rfp_values = rfp_values.rolling(window=int(RFP_smoothing_window_size), center=True, min_periods=1).mean()
-
-                app.df_f = app.df_f / rfp_values
-                calculate_baseline(app, window_size=int(baseline_window_size), percentile=float(baseline_percentage))
-                
-                # calculate final DR/R
-                app.df_f = (app.df_f - app.baseline_values) / app.baseline_values
-                app.df_f = app.df_f.replace([np.inf, -np.inf], np.nan)
-                app.df_f = app.df_f.fillna(0)
-                app.progress_bar.set(0.98)
-            # handle DF/F case
-            elif app.convert_to_df_f and app.df_f.mean() > 3:
-                # calculate baseline
-                # calculate_baseline(app, window_size=int(baseline_window_size), percentile=float(baseline_percentage))
-                
-                # calculate DF/F
-                app.df_f = (app.df_f - app.baseline_values) / app.baseline_values
-                app.df_f = app.df_f.replace([np.inf, -np.inf], np.nan)
-                app.df_f = app.df_f.fillna(0)
-                app.progress_bar.set(0.98)
-            
-            if 0 <= app.df_f.mean() <= 3:
-                app.convert_to_df_f = True    
+            app.raw_values = pd.Series(signal_values)
+            app.raw_rfp = rfp
+            app.df_f = pd.Series(converted['df_f'].copy() if converted['df_f'] is signal_values else converted['df_f'])
+            app.baseline_values = converted['baseline_values']
+            app.raw_baseline = converted['raw_baseline']
+            app.convert_to_df_f = converted['convert_to_df_f']
+            app.progress_bar.set(0.98)
 
             # Draw the chart
-            app.ax.clear()
-            app.ax.plot(app.time, app.df_f, color='black')
-            app.ax.set_ylim(np.min(app.df_f), np.max(app.df_f))
-            app.ax.grid(True)
-
-            if (not app.convert_to_df_f) and hasattr(app, 'baseline_values') and app.baseline_values is not None:
-                # clear old baseline
-                if hasattr(app, 'baseline_line') and app.baseline_line is not None:
-                    try:
-                        app.baseline_line.remove()
-                    except Exception:
-                        pass
-                    app.baseline_line = None
-                
-                app.baseline_line, = app.ax.plot(app.time, app.baseline_values, color='deepskyblue', linestyle='--', linewidth=1.5, alpha=0.8, label='Baseline')
-                app.ax.legend(loc='best')
-
-            app.canvas.draw()
+            with instrumentation.stage("plot"):
+                draw_trace(app)
+                app.canvas.draw()
             
             # Complete
             app.progress_bar.set(1.0)
@@ -1,24 +1,121 @@
 import io
 import os
 import sys
-import cairosvg
+import glob
+import hashlib
 from PIL import Image
 
-def load_svg_image(filename, width=None, height=None):
+# Rasterized icons already loaded in this process, keyed by (path, width, height)
+_image_cache = {}
+
+def get_base_path():
     if getattr(sys, 'frozen', False):
-        base_path = sys._MEIPASS
-    else:
-        base_path = os.path.abspath(".")
-    svg_path = os.path.join(base_path, filename)
-    
+        return sys._MEIPASS
+    return os.path.abspath(".")
+
+def get_bundled_cache_dir():
+    """
+    Directory of prebuilt icon rasters shipped with the application
+    """
+    return os.path.join(get_base_path(), 'assets', 'icon_cache')
+
+def get_user_cache_dir():
+    """
+    Per-user directory where icons rasterized on a cache miss are kept between launches
+    """
+    base_dir = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, 'CaFire', 'icon_cache')
+
+def get_cache_key(svg_data, width=None, height=None):
+    """
+    Cache key of one raster: the SVG content hash plus the output size,
+    so an edited SVG never reuses a stale raster
+    """
+    digest = hashlib.sha1(svg_data).hexdigest()
+    return f"{digest}_{width}x{height}"
+
+def rasterize_svg(svg_data, width=None, height=None):
+    """
+    Convert SVG data into PNG bytes (cairosvg is only imported here, on a cache miss)
+    """
+    import cairosvg
+    return cairosvg.svg2png(bytestring=svg_data, output_width=width, output_height=height)
+
+def _open_png(png_path):
+    image = Image.open(png_path)
+    image.load()  # Read now so the file handle is released
+    return image
+
+def _write_png(png_path, png_data):
+    try:
+        os.makedirs(os.path.dirname(png_path), exist_ok=True)
+        # Write to a temporary file first so a concurrent launch never reads a partial PNG
+        tmp_path = f"{png_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as png_file:
+            png_file.write(png_data)
+        os.replace(tmp_path, png_path)
+    except OSError:
+        # The cache is only an optimization, a read-only location is not an error
+        pass
+
+def load_svg_image(filename, width=None, height=None):
+    svg_path = os.path.join(get_base_path(), filename)
+
+    memory_key = (svg_path, width, height)
+    if memory_key in _image_cache:
+        return _image_cache[memory_key]
+
     # Read SVG file
     with open(svg_path, 'rb') as svg_file:
         svg_data = svg_file.read()
 
-    # Convert SVG into PNG
-    png_data = cairosvg.svg2png(bytestring=svg_data, output_width=width, output_height=height)
+    png_name = get_cache_key(svg_data, width, height) + '.png'
+
+    # Look for a prebuilt raster first, then for one cached by a previous launch
+    image = None
+    for cache_dir in (get_bundled_cache_dir(), get_user_cache_dir()):
+        png_path = os.path.join(cache_dir, png_name)
+        if os.path.exists(png_path):
+            try:
+                image = _open_png(png_path)
+                break
+            except OSError:
+                continue
+
+    if image is None:
+        # Convert SVG into PNG and keep it for the next launch
+        png_data = rasterize_svg(svg_data, width, height)
+        _write_png(os.path.join(get_user_cache_dir(), png_name), png_data)
+
+        # Load PNG data into PIL Image
+        image = Image.open(io.BytesIO(png_data))
+        image.load()
+
+    _image_cache[memory_key] = image
+    return image
+
+def prebuild_icon_cache(width=24, height=24, cache_dir=None):
+    """
+    Rasterize every SVG in assets/ into the bundled icon cache so that
+    packaged builds never need cairosvg at startup
+
+    Args:
+        width: Output width of the rasters
+        height: Output height of the rasters
+        cache_dir: Target directory (defaults to assets/icon_cache)
 
-    # Load PNG data into PIL Image
-    image = Image.open(io.BytesIO(png_data))
+    Returns:
+        int: Number of rasters written
+    """
+    cache_dir = cache_dir or get_bundled_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
 
-    return image
\ No newline at end of file
+    written = 0
+    for svg_path in sorted(glob.glob(os.path.join(get_base_path(), 'assets', '*.svg'))):
+        with open(svg_path, 'rb') as svg_file:
+            svg_data = svg_file.read()
+        png_path = os.path.join(cache_dir, get_cache_key(svg_data, width, height) + '.png')
+        if not os.path.exists(png_path):
+            _write_png(png_path, rasterize_svg(svg_data, width, height))
+            written += 1
+    return written
@@ -1,8 +1,77 @@
 """
 Navigation and zooming tool functions
 This module contains functions for chart navigation and zooming
+
+Navigation does not redraw right away: every step updates a pending target view and
+schedules one idle callback that applies it with draw_idle, so a burst of clicks, key
+repeats, wheel steps or drag motions only draws the view it ends on.
 """
 
+# Scale of the visible range per mouse-wheel step
+WHEEL_ZOOM = 0.8
+
+def current_xlim(app):
+    """
+    X-limits the plot is heading to: the pending target, otherwise the current limits
+    """
+    pending = getattr(app, 'pending_xlim', None)
+    return pending if pending is not None else app.ax.get_xlim()
+
+def current_ylim(app):
+    pending = getattr(app, 'pending_ylim', None)
+    return pending if pending is not None else app.ax.get_ylim()
+
+def request_view(app, xlim=None, ylim=None):
+    """
+    Set a new target view and schedule its drawing once the pending input events are handled
+
+    Args:
+        app: The application instance
+        xlim: New x-limits, None to keep them
+        ylim: New y-limits, None to keep them
+    """
+    if xlim is not None:
+        app.pending_xlim = (xlim[0], xlim[1])
+    if ylim is not None:
+        app.pending_ylim = (ylim[0], ylim[1])
+    if app.navigation_job is None:
+        app.navigation_job = app.after_idle(lambda: _run_pending_view(app))
+
+def _run_pending_view(app):
+    app.navigation_job = None
+    apply_pending_view(app)
+
+def apply_pending_view(app):
+    """
+    Apply the target view now, and only the latest one: intermediate targets are never drawn
+    
+    Args:
+        app: The application instance
+    """
+    if app.navigation_job is not None:
+        app.after_cancel(app.navigation_job)
+        app.navigation_job = None
+    if app.pending_xlim is None and app.pending_ylim is None:
+        return
+    if app.pending_xlim is not None:
+        app.ax.set_xlim(app.pending_xlim)
+    if app.pending_ylim is not None:
+        app.ax.set_ylim(app.pending_ylim)
+    app.pending_xlim = None
+    app.pending_ylim = None
+    update_annotations(app)
+    app.canvas.draw_idle()
+
+def cancel_pending_view(app):
+    """
+    Forget the target view, e.g. when the trace it refers to is cleared
+    """
+    if getattr(app, 'navigation_job', None) is not None:
+        app.after_cancel(app.navigation_job)
+    app.navigation_job = None
+    app.pending_xlim = None
+    app.pending_ylim = None
+
 def next_page(app):
     """
     Move the chart to the right by one page
@@ -11,12 +80,10 @@ def next_page(app):
         app: The application instance
     """
     if app.time is not None:
-        xlims = app.ax.get_xlim()
+        xlims = current_xlim(app)
         range_width = xlims[1] - xlims[0]
         new_xlims = [xlims[0] + range_width, xlims[1] + range_width]
-        app.ax.set_xlim(new_xlims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, xlim=new_xlims)
 
 def prev_page(app):
     """
@@ -26,12 +93,10 @@ def prev_page(app):
         app: The application instance
     """
     if app.time is not None:
-        xlims = app.ax.get_xlim()
+        xlims = current_xlim(app)
         range_width = xlims[1] - xlims[0]
         new_xlims = [xlims[0] - range_width, xlims[1] - range_width]
-        app.ax.set_xlim(new_xlims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, xlim=new_xlims)
 
 def move_up(app):
     """
@@ -41,13 +106,11 @@ def move_up(app):
         app: The application instance
     """
     if app.time is not None:
-        ylims = app.ax.get_ylim()
+        ylims = current_ylim(app)
         range_height = ylims[1] - ylims[0]
         shift = range_height * 0.1  # Shift up by 10% of the current range
         new_ylims = [ylims[0] + shift, ylims[1] + shift]
-        app.ax.set_ylim(new_ylims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, ylim=new_ylims)
 
 def move_down(app):
     """
@@ -57,13 +120,11 @@ def move_down(app):
         app: The application instance
     """
     if app.time is not None:
-        ylims = app.ax.get_ylim()
+        ylims = current_ylim(app)
         range_height = ylims[1] - ylims[0]
         shift = range_height * 0.1  # Shift down by 10% of the current range
         new_ylims = [ylims[0] - shift, ylims[1] - shift]
-        app.ax.set_ylim(new_ylims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, ylim=new_ylims)
 
 def zoom_in_x(app):
     """
@@ -73,11 +134,9 @@ def zoom_in_x(app):
         app: The application instance
     """
     if app.time is not None:
-        xlims = app.ax.get_xlim()
+        xlims = current_xlim(app)
         new_xlims = [xlims[0] + (xlims[1] - xlims[0]) * 0.1, xlims[1] - (xlims[1] - xlims[0]) * 0.1]
-        app.ax.set_xlim(new_xlims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, xlim=new_xlims)
 
 def zoom_out_x(app):
     """
@@ -87,11 +146,9 @@ def zoom_out_x(app):
         app: The application instance
     """
     if app.time is not None:
-        xlims = app.ax.get_xlim()
+        xlims = current_xlim(app)
         new_xlims = [xlims[0] - (xlims[1] - xlims[0]) * 0.1, xlims[1] + (xlims[1] - xlims[0]) * 0.1]
-        app.ax.set_xlim(new_xlims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, xlim=new_xlims)
 
 def zoom_in_y(app):
     """
@@ -101,11 +158,9 @@ def zoom_in_y(app):
         app: The application instance
     """
     if app.df_f is not None:
-        ylims = app.ax.get_ylim()
+        ylims = current_ylim(app)
         new_ylims = [ylims[0] + (ylims[1] - ylims[0]) * 0.1, ylims[1] - (ylims[1] - ylims[0]) * 0.1]
-        app.ax.set_ylim(new_ylims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, ylim=new_ylims)
 
 def zoom_out_y(app):
     """
@@ -115,39 +170,126 @@ def zoom_out_y(app):
         app: The application instance
     """
     if app.df_f is not None:
-        ylims = app.ax.get_ylim()
+        ylims = current_ylim(app)
         new_ylims = [ylims[0] - (ylims[1] - ylims[0]) * 0.1, ylims[1] + (ylims[1] - ylims[0]) * 0.1]
-        app.ax.set_ylim(new_ylims)
-        update_annotations(app)
-        app.canvas.draw()
+        request_view(app, ylim=new_ylims)
 
 def update_annotations(app):
     """
-    Update the annotations on the chart, showing or hiding them based on the current view range
+    Update the annotations on the chart, showing the markers, fit curves and partition
+    lines overlapping the current time range and hiding the others
+    
+    Args:
+        app: The application instance
+    """
+    from utils.viewport_index import get_viewport_index
+
+    x0, x1 = sorted(app.ax.get_xlim())
+    get_viewport_index(app).cull(x0, x1)
+
+def _pixel_to_data(app, axis, pixel, limits):
+    """
+    Data coordinate under a pixel for the given limits (the target view, which may not be drawn yet)
+    """
+    bbox = app.ax.bbox
+    if axis == 'x':
+        fraction = (pixel - bbox.x0) / bbox.width
+    else:
+        fraction = (pixel - bbox.y0) / bbox.height
+    return limits[0] + fraction * (limits[1] - limits[0])
+
+def on_scroll(app, event):
+    """
+    Zoom the X-axis around the cursor with the mouse wheel, the Y-axis with Shift held
+    
+    Args:
+        app: The application instance
+        event: Matplotlib scroll event
+    """
+    if app.time is None or event.inaxes != app.ax:
+        return
+    scale = WHEEL_ZOOM ** event.step
+    if event.key == 'shift':
+        ylims = current_ylim(app)
+        y = _pixel_to_data(app, 'y', event.y, ylims)
+        request_view(app, ylim=[y - (y - ylims[0]) * scale, y + (ylims[1] - y) * scale])
+    else:
+        xlims = current_xlim(app)
+        x = _pixel_to_data(app, 'x', event.x, xlims)
+        request_view(app, xlim=[x - (x - xlims[0]) * scale, x + (xlims[1] - x) * scale])
+
+def on_pan_press(app, event):
+    """
+    Start panning with the middle mouse button (left and right clicks mark and unmark peaks)
+    """
+    if app.time is None or event.inaxes != app.ax or event.button != 2:
+        return
+    apply_pending_view(app)
+    app.pan_start = (event.x, event.y, app.ax.get_xlim(), app.ax.get_ylim())
+
+def on_pan_motion(app, event):
+    """
+    Move the view with the cursor; the shift is measured in pixels from the press, so
+    it does not depend on which intermediate views were actually drawn
+    """
+    if getattr(app, 'pan_start', None) is None:
+        return
+    x_start, y_start, (x0, x1), (y0, y1) = app.pan_start
+    dx = (event.x - x_start) / app.ax.bbox.width * (x1 - x0)
+    dy = (event.y - y_start) / app.ax.bbox.height * (y1 - y0)
+    request_view(app, xlim=[x0 - dx, x1 - dx], ylim=[y0 - dy, y1 - dy])
+
+def on_pan_release(app, event):
+    if getattr(app, 'pan_start', None) is not None:
+        app.pan_start = None
+        apply_pending_view(app)
+
+def go_to_start(app):
+    """
+    Show the beginning of the recording, keeping the visible range
+    """
+    if app.time is not None:
+        xlims = current_xlim(app)
+        start = app.time.iloc[0]
+        request_view(app, xlim=[start, start + xlims[1] - xlims[0]])
+
+def go_to_end(app):
+    """
+    Show the end of the recording, keeping the visible range
+    """
+    if app.time is not None:
+        xlims = current_xlim(app)
+        end = app.time.iloc[-1]
+        request_view(app, xlim=[end - (xlims[1] - xlims[0]), end])
+
+# Keyboard navigation: key symbol -> navigation function
+NAVIGATION_KEYS = {
+    'Left': prev_page,
+    'Right': next_page,
+    'Prior': prev_page,
+    'Next': next_page,
+    'Up': move_up,
+    'Down': move_down,
+    'plus': zoom_in_x,
+    'KP_Add': zoom_in_x,
+    'minus': zoom_out_x,
+    'KP_Subtract': zoom_out_x,
+    'Home': go_to_start,
+    'End': go_to_end,
+}
+
+def on_navigation_key(app, event):
+    """
+    Navigate with the keyboard, except while typing in an entry or moving in the table
     
     Args:
         app: The application instance
+        event: Tk key event
     """
-    xlims = app.ax.get_xlim()
-    ylims = app.ax.get_ylim()
-
-    for point, text in zip(app.points, app.texts):
-        x, y = point.get_xdata()[0], point.get_ydata()[0]
-        if xlims[0] <= x <= xlims[1] and ylims[0] <= y <= ylims[1]:  # Check if the point is within the current view range
-            point.set_visible(True)
-            text.set_visible(True)
-        else:
-            point.set_visible(False)
-            text.set_visible(False)
-
-    for line, label in zip(app.partition_lines, app.partition_labels):
-        x = line.get_xdata()[0]
-        if xlims[0] <= x <= xlims[1]:
-            line.set_visible(True)
-            label.set_visible(True)
-        else:
-            line.set_visible(False)
-            label.set_visible(False)
+    if event.widget.winfo_class() in ('Entry', 'Treeview'):
+        return
+    NAVIGATION_KEYS[event.keysym](app)
+    return "break"
 
 def apply_navigation_operations(app_class):
     """
@@ -163,4 +305,6 @@ def apply_navigation_operations(app_class):
     app_class.zoom_in_x = zoom_in_x
     app_class.zoom_in_y = zoom_in_y
     app_class.zoom_out_x = zoom_out_x
-    app_class.zoom_out_y = zoom_out_y
\ No newline at end of file
+    app_class.zoom_out_y = zoom_out_y
+    app_class.go_to_start = go_to_start
+    app_class.go_to_end = go_to_end
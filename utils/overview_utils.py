@@ -0,0 +1,155 @@
+"""
+Overview strip module
+Draws the whole recording once, as a min/max envelope, in a small figure under the main
+plot. A viewport rectangle shows the visible time range; dragging it (or its edges) sets
+the x-limits of the main plot, and clicking elsewhere centers the view there.
+"""
+import numpy as np
+from core.trace_context import get_trace_context
+from utils.navigation_utils import request_view, apply_pending_view
+
+# Fewest envelope bins, about the pixel width of the strip
+OVERVIEW_BINS = 2000
+
+# Distance in pixels within which a press grabs an edge of the viewport
+EDGE_GRAB_PIXELS = 6
+
+def setup_overview(app, master, row):
+    """
+    Create the overview figure and its canvas, gridded under the main plot
+
+    Args:
+        app: Main application instance
+        master: Frame holding the main canvas
+        row: Grid row of the strip in master
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+    # Same horizontal margins as the main axes, so the strip lines up with the plot
+    app.overview_fig = Figure(figsize=(6, 0.6))
+    app.overview_fig.subplots_adjust(left=app.fig.subplotpars.left, right=app.fig.subplotpars.right, bottom=0.05, top=0.95)
+    app.overview_ax = app.overview_fig.add_subplot()
+    app.overview_canvas = FigureCanvasTkAgg(app.overview_fig, master=master)
+    app.overview_widget = app.overview_canvas.get_tk_widget()
+    app.overview_widget.configure(height=60)
+    app.overview_widget.grid(row=row, column=0, sticky="ew")
+
+    app.overview_viewport = None
+    app.overview_drag = None
+    _clear_overview_axes(app)
+
+    app.overview_canvas.mpl_connect('button_press_event', lambda event: on_overview_press(app, event))
+    app.overview_canvas.mpl_connect('motion_notify_event', lambda event: on_overview_motion(app, event))
+    app.overview_canvas.mpl_connect('button_release_event', lambda event: on_overview_release(app, event))
+    # Every redraw of the main plot, whatever moved it, brings the viewport along
+    app.canvas.mpl_connect('draw_event', lambda event: sync_overview_viewport(app))
+    app.overview_canvas.draw()
+
+def _clear_overview_axes(app):
+    app.overview_ax.clear()
+    app.overview_ax.set_xticks([])
+    app.overview_ax.set_yticks([])
+    app.overview_viewport = None
+
+def draw_overview(app):
+    """
+    Draw the envelope of the loaded trace and the viewport of the main plot
+
+    Args:
+        app: Main application instance
+    """
+    from matplotlib.patches import Rectangle
+
+    if getattr(app, 'overview_ax', None) is None:
+        return
+    _clear_overview_axes(app)
+    if app.time is None or app.df_f is None or len(app.df_f) == 0:
+        app.overview_canvas.draw_idle()
+        return
+
+    # Taken from the trace's decimation pyramid, built once per trace
+    times, minima, maxima = get_trace_context(app).envelope(OVERVIEW_BINS)
+    app.overview_ax.fill_between(times, minima, maxima, color='black', linewidth=0.5)
+    app.overview_ax.set_xlim(times[0], times[-1])
+    low, high = np.nanmin(minima), np.nanmax(maxima)
+    if high > low:
+        app.overview_ax.set_ylim(low, high)
+
+    x0, x1 = app.ax.get_xlim()
+    app.overview_viewport = Rectangle(
+        (x0, 0), x1 - x0, 1, transform=app.overview_ax.get_xaxis_transform(),
+        facecolor='#3b8ed0', edgecolor='#1f6aa5', alpha=0.3, linewidth=1.5
+    )
+    app.overview_ax.add_patch(app.overview_viewport)
+    app.overview_canvas.draw_idle()
+
+def sync_overview_viewport(app):
+    """
+    Move the viewport to the current x-limits of the main plot
+    """
+    viewport = getattr(app, 'overview_viewport', None)
+    if viewport is None or app.overview_drag is not None:
+        return
+    x0, x1 = app.ax.get_xlim()
+    if (viewport.get_x(), viewport.get_width()) != (x0, x1 - x0):
+        viewport.set_x(x0)
+        viewport.set_width(x1 - x0)
+        app.overview_canvas.draw_idle()
+
+def on_overview_press(app, event):
+    """
+    Start dragging the viewport or one of its edges; a press outside centers the view there
+    """
+    viewport = app.overview_viewport
+    if viewport is None or event.inaxes != app.overview_ax or event.button != 1:
+        return
+
+    x0, width = viewport.get_x(), viewport.get_width()
+    # Edge distances in pixels, so the edges stay grabbable at any zoom level
+    to_pixels = app.overview_ax.transData.transform
+    left_px, right_px = to_pixels([(x0, 0), (x0 + width, 0)])[:, 0]
+    if abs(event.x - left_px) <= EDGE_GRAB_PIXELS:
+        app.overview_drag = ('left', x0 + width)
+    elif abs(event.x - right_px) <= EDGE_GRAB_PIXELS:
+        app.overview_drag = ('right', x0)
+    else:
+        if not x0 <= event.xdata <= x0 + width:
+            x0 = event.xdata - width / 2
+            _move_viewport(app, x0, x0 + width)
+        app.overview_drag = ('move', event.xdata - x0)
+
+def on_overview_motion(app, event):
+    """
+    Follow the drag on the strip and schedule the main plot update
+    """
+    if app.overview_drag is None or event.xdata is None:
+        return
+    mode, anchor = app.overview_drag
+    width = app.overview_viewport.get_width()
+    # Keep a resized viewport at least a few envelope bins wide
+    x_min, x_max = app.overview_ax.get_xlim()
+    min_width = (x_max - x_min) / OVERVIEW_BINS * 4
+
+    if mode == 'move':
+        x0 = event.xdata - anchor
+        _move_viewport(app, x0, x0 + width)
+    elif mode == 'left':
+        _move_viewport(app, min(event.xdata, anchor - min_width), anchor)
+    else:
+        _move_viewport(app, anchor, max(event.xdata, anchor + min_width))
+
+def on_overview_release(app, event):
+    if app.overview_drag is not None:
+        app.overview_drag = None
+        apply_pending_view(app)
+
+def _move_viewport(app, x0, x1):
+    """
+    Draw the viewport at a new position on the strip right away and let the main plot
+    follow as a pending navigation target: fast drags only redraw the latest position
+    """
+    app.overview_viewport.set_x(x0)
+    app.overview_viewport.set_width(x1 - x0)
+    app.overview_canvas.draw_idle()
+    request_view(app, xlim=(x0, x1))
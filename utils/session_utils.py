@@ -0,0 +1,247 @@
+"""
+Session file module
+Saves the loaded trace, parameters, peaks and fit results to one compressed .npz project
+file and restores them, redrawing the fit curves from the stored arrays without refitting
+"""
+import json
+import numpy as np
+from tkinter import filedialog, messagebox
+from core.app_state import clear_plot
+from core.event_fitting import EVENT_MODEL, set_tau_source, tau_source
+from core.instrumentation import get_instrumentation
+from core.precision import as_float_array
+
+SESSION_VERSION = 1
+SESSION_FILETYPES = [("CaFire session", "*.cafire.npz"), ("All files", "*.*")]
+
+def _curve_arrays(app, line_map):
+    """
+    Data of the curves of every marked peak as one ragged array: x, y and per-peak offsets
+    """
+    xs, ys, offsets = [], [], [0]
+    for peak in app.marked_peaks:
+        line = line_map.get(peak)
+        if line is not None:
+            xs.append(np.asarray(line.get_xdata(), dtype=float))
+            ys.append(np.asarray(line.get_ydata(), dtype=float))
+            offsets.append(offsets[-1] + len(xs[-1]))
+        else:
+            offsets.append(offsets[-1])
+    x = np.concatenate(xs) if xs else np.empty(0)
+    y = np.concatenate(ys) if ys else np.empty(0)
+    return x, y, np.asarray(offsets, dtype=np.int64)
+
+def _per_peak(app, results):
+    return np.array([
+        results[peak] if isinstance(results.get(peak), (int, float, np.floating)) else np.nan
+        for peak in app.marked_peaks
+    ], dtype=float)
+
+def collect_session(app):
+    """
+    Arrays describing the current session
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        dict: Name -> array, ready for write_session
+    """
+    app.marked_peaks = sorted(app.marked_peaks, key=lambda peak: peak[0])
+
+    metadata = {
+        'version': SESSION_VERSION,
+        'source_path': getattr(app, 'source_path', None),
+        'convert_to_df_f': bool(app.convert_to_df_f),
+        'evoked_status': app.evoked_status,
+        # Dialog parameters, partition settings included
+        'parameters': {name: value for name, value in vars(app).items() if name.startswith('last_') and isinstance(value, str)},
+        'xlim': list(app.ax.get_xlim()),
+        'ylim': list(app.ax.get_ylim()),
+    }
+
+    onsets = np.full((len(app.marked_peaks), 2), np.nan)
+    for i, peak in enumerate(app.marked_peaks):
+        marker = app.rise_start_markers.get(peak)
+        if marker is not None:
+            onsets[i] = marker.get_xdata()[0], marker.get_ydata()[0]
+
+    rise_x, rise_y, rise_offsets = _curve_arrays(app, app.rise_line_map)
+    decay_x, decay_y, decay_offsets = _curve_arrays(app, app.decay_line_map)
+
+    arrays = {
+        'metadata': np.array(json.dumps(metadata)),
+        'time': np.asarray(app.time, dtype=float),
+        # The trace arrays keep their precision (float32 or float64)
+        'df_f': as_float_array(app.df_f),
+        'peaks': np.asarray(app.marked_peaks, dtype=float).reshape(-1, 2),
+        'rise_times': _per_peak(app, app.rise_times),
+        'tau_values': _per_peak(app, app.tau_values),
+        'amplitudes': _per_peak(app, app.amplitudes),
+        # Taus of the event model, the others come from the separate exponential fits
+        'event_rise': np.array([tau_source(app, peak, 'rise') == EVENT_MODEL for peak in app.marked_peaks], dtype=bool),
+        'event_decay': np.array([tau_source(app, peak, 'decay') == EVENT_MODEL for peak in app.marked_peaks], dtype=bool),
+        'rise_calculated': np.asarray(app.rise_calculated, dtype=bool),
+        'decay_calculated': np.asarray(app.decay_calculated, dtype=bool),
+        'onsets': onsets,
+        'rise_x': rise_x, 'rise_y': rise_y, 'rise_offsets': rise_offsets,
+        'decay_x': decay_x, 'decay_y': decay_y, 'decay_offsets': decay_offsets,
+    }
+    for name in ('raw_values', 'baseline_values', 'raw_baseline', 'raw_rfp'):
+        value = getattr(app, name, None)
+        if value is not None:
+            arrays[name] = as_float_array(value)
+    # Copies of another array (ΔF/F traces loaded as is, baselines never recomputed) are stored once
+    for name, original in (('raw_values', 'df_f'), ('raw_baseline', 'baseline_values')):
+        if name in arrays and original in arrays and np.array_equal(arrays[name], arrays[original]):
+            arrays[name] = np.array(original)
+    return arrays
+
+def write_session(path, arrays, compress_level=1):
+    """
+    Write the session arrays to a compressed .npz file (the name is kept as given)
+
+    np.savez_compressed always uses the default deflate level, which spends most of its time
+    on the noise bits of the trace for little gain; level 1 keeps saving fast.
+    """
+    import zipfile
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compress_level) as archive:
+        for name, value in arrays.items():
+            with archive.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(value), allow_pickle=False)
+
+def read_session(path):
+    """
+    Read a session file
+
+    Returns:
+        tuple: (metadata dict, arrays dict)
+
+    Raises:
+        ValueError: If the file is not a session file or was written by a newer version
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    if 'metadata' not in arrays:
+        raise ValueError("Not a CaFire session file.")
+    metadata = json.loads(str(arrays.pop('metadata')))
+    if metadata.get('version', 0) > SESSION_VERSION:
+        raise ValueError("The session was saved by a newer version of CaFire.")
+    # Resolve arrays stored as the name of the array they duplicate
+    for name, value in arrays.items():
+        if value.dtype.kind == 'U':
+            arrays[name] = arrays[str(value)]
+    return metadata, arrays
+
+def restore_session(app, metadata, arrays):
+    """
+    Replace the current session by a saved one and redraw it
+
+    Args:
+        app: Main application instance
+        metadata: Metadata returned by read_session
+        arrays: Arrays returned by read_session
+    """
+    import pandas as pd
+    from utils.file_utils import draw_trace
+
+    clear_plot(app, reset_data=True)
+
+    for name, value in metadata['parameters'].items():
+        setattr(app, name, value)
+    app.source_path = metadata.get('source_path')
+    app.convert_to_df_f = metadata['convert_to_df_f']
+    app.evoked_status = metadata['evoked_status']
+
+    app.time = pd.Series(arrays['time'])
+    app.df_f = pd.Series(arrays['df_f'])
+    app.raw_values = pd.Series(arrays['raw_values']) if 'raw_values' in arrays else None
+    app.baseline_values = arrays.get('baseline_values')
+    app.raw_baseline = arrays.get('raw_baseline')
+    app.raw_rfp = arrays.get('raw_rfp')
+    draw_trace(app)
+
+    # Peaks, fit results and artists, rebuilt from the stored arrays
+    app.marked_peaks = [(float(t), float(v)) for t, v in arrays['peaks']]
+    app.rise_calculated = arrays['rise_calculated'].tolist()
+    app.decay_calculated = arrays['decay_calculated'].tolist()
+    for i, peak in enumerate(app.marked_peaks):
+        app.points.append(app.ax.plot(peak[0], peak[1], 'ro')[0])
+
+        for results, name in ((app.rise_times, 'rise_times'), (app.tau_values, 'tau_values'), (app.amplitudes, 'amplitudes')):
+            if np.isfinite(arrays[name][i]):
+                results[peak] = float(arrays[name][i])
+        # Sessions saved before the event model have no model arrays
+        for kind in ('rise', 'decay'):
+            if f'event_{kind}' in arrays and arrays[f'event_{kind}'][i]:
+                set_tau_source(app, peak, kind, EVENT_MODEL)
+
+        onset_x, onset_y = arrays['onsets'][i]
+        if np.isfinite(onset_x):
+            app.rise_start_markers[peak] = app.ax.plot(onset_x, onset_y, 'gx')[0]
+
+        for prefix, line_map, lines, color in (('rise', app.rise_line_map, app.rise_lines, '#00FF00'),
+                                               ('decay', app.decay_line_map, app.decay_lines, '#FF00FF')):
+            start, stop = arrays[f'{prefix}_offsets'][i:i + 2]
+            if stop > start:
+                line, = app.ax.plot(arrays[f'{prefix}_x'][start:stop], arrays[f'{prefix}_y'][start:stop], color=color, linestyle='--')
+                lines.append(line)
+                line_map[peak] = line
+
+    app.ax.set_xlim(metadata['xlim'])
+    app.ax.set_ylim(metadata['ylim'])
+
+    if app.evoked_status == "on":
+        app.partition_evoked_button.pack(side="left", padx=5, pady=5)
+    else:
+        app.partition_evoked_button.pack_forget()
+
+    app.update_table()
+    app.canvas.draw()
+
+def save_session(app):
+    """
+    Ask for a file name and save the current session
+
+    Args:
+        app: Main application instance
+    """
+    if app.time is None or app.df_f is None:
+        messagebox.showwarning(title="Warning", message="No data loaded.")
+        return
+
+    file_path = filedialog.asksaveasfilename(defaultextension=".cafire.npz", filetypes=SESSION_FILETYPES)
+    if not file_path:
+        return
+
+    instrumentation = get_instrumentation(app)
+    try:
+        with instrumentation.stage("collect"):
+            arrays = collect_session(app)
+        with instrumentation.stage("write"):
+            write_session(file_path, arrays)
+    except Exception as e:
+        messagebox.showerror(title="Error", message=f"Saving the session failed: {str(e)}")
+
+def open_session(app):
+    """
+    Ask for a session file and restore it
+
+    Args:
+        app: Main application instance
+    """
+    file_path = filedialog.askopenfilename(filetypes=SESSION_FILETYPES)
+    if not file_path:
+        return
+
+    instrumentation = get_instrumentation(app)
+    try:
+        with instrumentation.stage("read"):
+            metadata, arrays = read_session(file_path)
+    except (OSError, ValueError, KeyError) as e:
+        messagebox.showerror(title="Error", message=f"Opening the session failed: {str(e)}")
+        return
+
+    with instrumentation.stage("restore"):
+        restore_session(app, metadata, arrays)
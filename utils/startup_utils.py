@@ -0,0 +1,49 @@
+"""
+Startup helper functions
+The scientific stack is imported lazily by the functions that need it; this module
+warms those imports up in the background once the main window is on screen
+"""
+import importlib
+import threading
+
+# Modules deferred until a file is loaded or peaks are detected
+HEAVY_MODULES = (
+    'pandas',
+    'openpyxl',
+    'scipy.signal',
+    'scipy.optimize',
+)
+
+def import_heavy_modules(modules=HEAVY_MODULES):
+    """
+    Import the deferred modules, ignoring any that are unavailable
+
+    Args:
+        modules: Names of the modules to import
+    """
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+def prewarm_heavy_modules(app, delay_ms=300):
+    """
+    Import the deferred modules in a daemon thread shortly after the window is mapped,
+    so the first Load File / Detect Peaks does not pay for them
+
+    Args:
+        app: Main application instance
+        delay_ms: Delay after the first <Map> event before starting the thread
+    """
+    def start_thread():
+        if getattr(app, 'prewarm_thread', None) is None:
+            app.prewarm_thread = threading.Thread(target=import_heavy_modules, name="prewarm-imports", daemon=True)
+            app.prewarm_thread.start()
+
+    def on_first_map(event):
+        if event.widget == app and getattr(app, 'prewarm_thread', None) is None:
+            app.after(delay_ms, start_thread)
+
+    app.prewarm_thread = None
+    app.bind('<Map>', on_first_map, add='+')
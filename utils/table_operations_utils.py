@@ -2,11 +2,20 @@
 Table operation function module
 Contains functions for handling table selection, copying, exporting, and event handling
 """
-import pandas as pd
 import numpy as np
 from PIL import Image, ImageDraw, ImageTk
 from tkinter import messagebox, filedialog
 from core.calculate_decay import calculate_decay, decay_function
+from core.event_fitting import tau_model
+from core.instrumentation import get_instrumentation
+from core.kinetic_metrics import METRIC_COLUMNS, peak_metrics
+from core.artist_registry import clear_artist_groups
+from core.trace_context import get_trace_context
+
+# Columns of the peak table, in the order of build_table_rows. "τ Model" names the model the
+# taus of the row come from: "Event" (τ_rise and τ_decay of the double-exponential event
+# model), "Exponential" (separate rise and decay exponentials) or both when they differ
+TABLE_COLUMNS = ("Time", "ΔF/F", "τ (rise)", "τ (decay)", "τ Model", "Raw Peak Value", "Baseline") + METRIC_COLUMNS
 
 def get_checkbox_image(app, checked=False):
     """
@@ -94,6 +103,8 @@ def export_selected_data(app):
     Args:
         app: The application instance
     """
+    import pandas as pd
+
     # Get all the checked items
     checked_items = []
     for item in app.tree.get_children():
@@ -216,11 +227,60 @@ def handle_tree_right_click(app, event):
     
     return "break"  # Prevent the event from propagating
     
-def update_table(app):
-    # Clear the table
-    for item in app.tree.get_children():
-        app.tree.delete(item)
+def format_table_row(peak_time, delta_f_f, rise_time, decay_time, tau_model, raw_value, raw_baseline, metrics):
+    """
+    Format the values of one peak as a table row of TABLE_COLUMNS
+    
+    Args:
+        peak_time: Time of the peak
+        delta_f_f, rise_time, decay_time, raw_value, raw_baseline: Numbers, or "N/A"
+        tau_model: Model the taus come from ("N/A" without taus)
+        metrics: Values of the METRIC_COLUMNS, NaN where undefined
+    
+    Returns:
+        tuple: Formatted values
+    """
+    # np.floating also covers float32 values, which are not Python floats
+    number = (float, np.floating)
+    return (
+        f"{peak_time:g}",
+        f"{delta_f_f:.6f}" if isinstance(delta_f_f, number) else delta_f_f,
+        f"{rise_time:.6f}" if isinstance(rise_time, number) else rise_time,
+        f"{decay_time:.6f}" if isinstance(decay_time, number) else decay_time,
+        tau_model,
+        f"{raw_value:.6f}" if isinstance(raw_value, number) else raw_value,
+        f"{raw_baseline:.6f}" if isinstance(raw_baseline, number) else raw_baseline,
+        *(f"{value:.6f}" if np.isfinite(value) else "N/A" for value in metrics)
+    )
+
+def peak_delta_f_f(peak_value, raw_value, raw_baseline, df_f_table):
+    """
+    ΔF/F column of a peak outside evoked mode: the trace value when the trace is read as
+    ΔF/F, otherwise the raw value relative to the raw baseline (numbers or arrays)
+
+    Args:
+        peak_value: Trace value at the peak
+        raw_value: Raw signal at the peak
+        raw_baseline: Raw baseline at the peak
+        df_f_table: Whether the trace is read as ΔF/F (app.convert_to_df_f)
+
+    Returns:
+        The ΔF/F value(s) reported for the peak(s)
+    """
+    if df_f_table:
+        return peak_value
+    return (raw_value - raw_baseline) / raw_baseline
+
+def build_table_rows(app):
+    """
+    Build the formatted table rows for all marked peaks without touching the widget
+    
+    Args:
+        app: The application instance
     
+    Returns:
+        list: One tuple of formatted values per peak, sorted by time
+    """
     # Sort marked peaks by time
     app.marked_peaks = sorted(app.marked_peaks, key=lambda peak: peak[0])
 
@@ -235,16 +295,20 @@ def update_table(app):
         # std_peak_distance = 0
         # percentile_80 = 0
 
-    print("avg_peak_distance: ", avg_peak_distance)
+    instrumentation = get_instrumentation(app)
+    instrumentation.log(f"avg_peak_distance: {avg_peak_distance}")
 
-    baseline_std = np.std(app.baseline_values)
+    context = get_trace_context(app)
+    baseline_std = context.baseline_stats()[1]
+    # Model-free kinetics of all peaks in one pass
+    metrics = peak_metrics(app)
 
     peaks_data = []
     for peak_time, peak_value in app.marked_peaks:
         rise_time = app.rise_times.get((peak_time, peak_value), "N/A")
         decay_time = app.tau_values.get((peak_time, peak_value), "N/A")
 
-        peak_index = app.time[app.time == peak_time].index[0]
+        peak_index = context.sample_index(peak_time)
 
         # NEW: get raw value at the same index from original series
         if getattr(app, "raw_values", None) is not None and peak_index < len(app.raw_values):
@@ -268,8 +332,7 @@ def update_table(app):
                 # peak_time - app.marked_peaks[current_peak_idx-1][0] <= percentile_80 or
                 # If there is a previous peak
                 if current_peak_idx > 0 and peak_time - app.marked_peaks[current_peak_idx-1][0] <= 0.8 * avg_peak_distance:
-                    print(peak_time, "with distance: ", peak_time - app.marked_peaks[current_peak_idx-1][0])
-                    print("===")
+                    instrumentation.log(f"{peak_time} with distance: {peak_time - app.marked_peaks[current_peak_idx-1][0]}")
                     prev_peak_time, prev_peak_value = app.marked_peaks[current_peak_idx - 1]
 
                     # Check if there is a previous decay curve
@@ -289,31 +352,30 @@ def update_table(app):
                             raw_baseline = decay_value
                             delta_f_f = (raw_value - raw_baseline) / raw_baseline  
                 else: # e.g. 1Hz
-                    if app.convert_to_df_f == True:
-                        delta_f_f = peak_value
-                    else: 
-                        delta_f_f = (raw_value - raw_baseline) / raw_baseline
+                    delta_f_f = peak_delta_f_f(peak_value, raw_value, raw_baseline, app.convert_to_df_f == True)
             else: # mini
-                if app.convert_to_df_f == True:
-                    delta_f_f = peak_value
-                else: 
-                    delta_f_f = (raw_value - raw_baseline) / raw_baseline
+                delta_f_f = peak_delta_f_f(peak_value, raw_value, raw_baseline, app.convert_to_df_f == True)
         else:
             baseline = "N/A"
             raw_baseline = "N/A"
             delta_f_f = "N/A"
 
-        peaks_data.append((
-            f"{peak_time:g}",
-            f"{delta_f_f:.6f}" if isinstance(delta_f_f, float) else delta_f_f,
-            f"{rise_time:.6f}" if isinstance(rise_time, float) else rise_time,
-            f"{decay_time:.6f}" if isinstance(decay_time, float) else decay_time,
-            f"{raw_value:.6f}" if isinstance(raw_value, float) else raw_value,
-            f"{raw_baseline:.6f}" if isinstance(raw_baseline, float) else raw_baseline
+        model = tau_model(app, (peak_time, peak_value)) if (rise_time, decay_time) != ("N/A", "N/A") else "N/A"
+        peaks_data.append(format_table_row(
+            peak_time, delta_f_f, rise_time, decay_time, model, raw_value, raw_baseline,
+            metrics.get((peak_time, peak_value), (np.nan,) * len(METRIC_COLUMNS))
         ))
     
     # Sort by time
     peaks_data.sort(key=lambda x: float(x[0]))
+    return peaks_data
+
+def update_table(app):
+    # Clear the table
+    for item in app.tree.get_children():
+        app.tree.delete(item)
+    
+    peaks_data = build_table_rows(app)
     
     # Add to the table, default display blank checkbox
     for data in peaks_data:
@@ -323,10 +385,7 @@ def recalculate_column(app):
     """Recalculate the selected column"""
     if hasattr(app, 'right_clicked_column') and app.right_clicked_column == "τ (decay)":
         # Clear all decay curves
-        for line in app.decay_lines:
-            line.remove()
-        app.decay_lines.clear()
-        app.decay_line_map.clear()
+        clear_artist_groups(app, 'decay_lines')
         
         # Recalculate the decay time of all peaks
         app.decay_calculated = [False] * len(app.marked_peaks)
@@ -0,0 +1,99 @@
+"""
+Viewport culling module
+Keeps the peak markers, onset markers, fit curves and partition lines sorted by time so
+that a change of the x-limits only touches the artists entering or leaving the view
+"""
+import numpy as np
+
+class ViewportIndex:
+    """
+    Artists sorted by the start of their time extent
+
+    The artists overlapping a time range start at most the longest extent before it, so
+    two searchsorted calls bound the candidates; only the artists whose visibility changes
+    are updated, which makes a limit change O(log P + visible).
+    """
+    def __init__(self, artists, starts, ends):
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        order = np.argsort(starts, kind='stable')
+        self.artists = [artists[i] for i in order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.max_extent = float(np.max(self.ends - self.starts)) if len(order) else 0.0
+        self.visible = {i for i, artist in enumerate(self.artists) if artist.get_visible()}
+
+    def overlapping(self, x0, x1):
+        """
+        Positions of the artists whose extent overlaps [x0, x1]
+        """
+        low = np.searchsorted(self.starts, x0 - self.max_extent, side='left')
+        high = np.searchsorted(self.starts, x1, side='right')
+        return low + np.flatnonzero(self.ends[low:high] >= x0)
+
+    def cull(self, x0, x1):
+        """
+        Show the artists overlapping [x0, x1] and hide the others
+
+        Returns:
+            int: Number of visible artists
+        """
+        shown = set(self.overlapping(x0, x1).tolist())
+        for i in self.visible - shown:
+            self.artists[i].set_visible(False)
+        for i in shown - self.visible:
+            self.artists[i].set_visible(True)
+        self.visible = shown
+        return len(shown)
+
+def _signature(app):
+    """
+    Cheap fingerprint of the artist lists: a new list, a new length or a new last artist
+    means artists were added, removed or replaced
+    """
+    groups = (app.points, app.rise_lines, app.decay_lines, app.partition_lines, app.partition_labels)
+    signature = tuple((id(group), len(group), id(group[-1]) if group else None) for group in groups)
+    return signature + ((id(app.rise_start_markers), len(app.rise_start_markers)),)
+
+def build_viewport_index(app):
+    """
+    Index of every artist tied to a time: peak and onset markers, rise and decay curves,
+    partition lines and their labels
+
+    Args:
+        app: Main application instance
+
+    Returns:
+        ViewportIndex: Index of the artists still on the plot
+    """
+    artists, starts, ends = [], [], []
+
+    def add(artist, start, end):
+        if artist.axes is not None:
+            artists.append(artist)
+            starts.append(start)
+            ends.append(end)
+
+    for marker in list(app.points) + list(app.rise_start_markers.values()) + list(app.partition_lines):
+        x = marker.get_xdata()[0]
+        add(marker, x, x)
+    for label in app.partition_labels:
+        x = label.get_position()[0]
+        add(label, x, x)
+    for curve in list(app.rise_lines) + list(app.decay_lines):
+        x = np.asarray(curve.get_xdata(), dtype=float)
+        if len(x):
+            add(curve, np.nanmin(x), np.nanmax(x))
+    return ViewportIndex(artists, starts, ends)
+
+def get_viewport_index(app):
+    """
+    Viewport index of the current artists, rebuilt only when the artist lists changed
+
+    Artists added without changing the fingerprint are not indexed and simply stay visible.
+    """
+    signature = _signature(app)
+    if getattr(app, 'viewport_index', None) is None or app.viewport_index_signature != signature:
+        app.viewport_index = build_viewport_index(app)
+        app.viewport_index_signature = signature
+    return app.viewport_index